@@ -0,0 +1,355 @@
+"""
+Backups, restores and moving between databases (e.g. SQLite to PostgreSQL).
+
+    python -m app.backup dump DIR               write DIR/<table>/*.ndjson.gz and DIR/manifest.json
+    python -m app.backup restore DIR            load a dump into the database
+    python -m app.backup copy --to URL          copy straight from one database to another
+
+The database is RELAYCAT_DB_URL unless --url (dump, restore) or --from
+(copy) says otherwise. Covers users, message_routes, rules, settings and
+bad_words; queues, events and statistics are rebuilt by the app.
+
+Tables are read in primary key order, a page at a time, and written in
+batches, so memory use doesn't grow with the table. A dump reads all
+tables in one transaction, a consistent snapshot. Every step is recorded
+as it finishes (the manifest for dumps, a progress file for restore and
+copy): run the same command again after an interruption and it carries on
+where it stopped. Restore and copy replace rows with the same key instead
+of failing on them, so redoing a batch is harmless.
+"""
+import argparse
+import asyncio
+import gzip
+import json
+import os
+import sys
+import time
+from datetime import datetime
+
+from sqlalchemy import delete, func, insert, text, DateTime
+from sqlalchemy.engine import make_url
+from sqlalchemy.future import select
+
+from app.settings import settings
+from app.database.core import DB_URL, DATA_DIR, upgrade_schema
+from app.database.models import Base
+from app.database.profiles import create_engine
+
+TABLES = ["users", "message_routes", "rules", "settings", "bad_words"]
+FORMAT = 1
+
+
+def _table(name: str):
+    return Base.metadata.tables[name]
+
+
+def _key(table):
+    return table.primary_key.columns.values()[0]
+
+
+def _encode(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def _decoder(table):
+    """Turns a dumped row back into insert() values: known columns only, datetimes parsed."""
+    dates = {c.name for c in table.columns if isinstance(c.type, DateTime)}
+    names = {c.name for c in table.columns}
+
+    def decode(row: dict) -> dict:
+        return {
+            name: datetime.fromisoformat(value) if name in dates and value is not None else value
+            for name, value in row.items() if name in names
+        }
+    return decode
+
+
+def _write_json(path: str, data):
+    """Atomically, so an interrupted run never leaves half a file."""
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=1)
+    os.replace(tmp, path)
+
+
+def _read_json(path: str, default):
+    if not os.path.exists(path):
+        return default
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _where(url: str) -> str:
+    return make_url(url).render_as_string(hide_password=True)
+
+
+async def _snapshot(conn):
+    """Starts a transaction that sees one point in time for all the reads that follow."""
+    if conn.dialect.name == "sqlite":
+        # The driver only opens transactions for writes by itself
+        await conn.exec_driver_sql("BEGIN")
+    elif conn.dialect.name == "postgresql":
+        await conn.execution_options(isolation_level="REPEATABLE READ", postgresql_readonly=True)
+        await conn.begin()
+    else:
+        await conn.begin()
+
+
+async def _pages(conn, table, after, batch: int):
+    """Rows (as dicts) with a key above `after`, in key order, `batch` at a time."""
+    key = _key(table)
+    while True:
+        stmt = select(table).order_by(key).limit(batch)
+        if after is not None:
+            stmt = stmt.where(key > after)
+        rows = [dict(row) for row in (await conn.execute(stmt)).mappings()]
+        if not rows:
+            return
+        yield rows
+        after = rows[-1][key.name]
+
+
+async def _write_batch(conn, table, rows: list[dict]):
+    """Replaces the rows with these keys, in the caller's transaction."""
+    key = _key(table)
+    await conn.execute(delete(table).where(key.in_([row[key.name] for row in rows])))
+    await conn.execute(insert(table), rows)
+
+
+async def _prepare_target(engine):
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(upgrade_schema)
+
+
+async def _reset_sequences(engine, tables: list[str]):
+    """Explicit ids don't move PostgreSQL's sequences, later inserts would collide."""
+    if engine.dialect.name != "postgresql":
+        return
+    async with engine.begin() as conn:
+        for name in tables:
+            key = _key(_table(name))
+            sequence = await conn.scalar(text("SELECT pg_get_serial_sequence(:table, :column)"),
+                                         {"table": name, "column": key.name})
+            if sequence:
+                await conn.execute(text(f"SELECT setval(:sequence, coalesce(max({key.name}), 0) + 1, false) FROM {name}"),
+                                   {"sequence": sequence})
+
+
+def _report(name: str, rows: int, started: float):
+    took = time.perf_counter() - started
+    print(f"  {name:<16} {rows:>12,} rows  {took:7.1f}s  {rows / took if took else 0:>10,.0f} rows/s", flush=True)
+
+
+# ---------- dump ----------
+
+async def dump(url: str, directory: str, tables: list[str], chunk: int, batch: int):
+    os.makedirs(directory, exist_ok=True)
+    manifest_path = os.path.join(directory, "manifest.json")
+    manifest = _read_json(manifest_path, None) or {
+        "format": FORMAT, "source": _where(url), "started_at": datetime.utcnow().isoformat(), "tables": {},
+    }
+    if manifest.get("format") != FORMAT:
+        sys.exit(f"{manifest_path} is from an unknown version of this tool.")
+    if manifest.get("finished_at"):
+        sys.exit(f"{directory} already holds a finished dump, pick an empty directory.")
+    if manifest["tables"]:
+        print(f"Resuming the dump in {directory}.")
+        manifest["resumed"] = True  # the tables are no longer one snapshot
+
+    engine = create_engine(url, settings.DB_PROFILE)
+    try:
+        async with engine.connect() as conn:
+            await _snapshot(conn)
+            for name in tables:
+                table = _table(name)
+                entry = manifest["tables"].setdefault(name, {
+                    "columns": [c.name for c in table.columns], "key": _key(table).name,
+                    "rows": 0, "chunks": [], "done": False,
+                })
+                if entry["done"]:
+                    continue
+                started, rows_before = time.perf_counter(), entry["rows"]
+                os.makedirs(os.path.join(directory, name), exist_ok=True)
+                after = entry["chunks"][-1]["last"] if entry["chunks"] else None
+                pages = _pages(conn, table, after, batch)
+                while True:
+                    number = len(entry["chunks"]) + 1
+                    file = f"{name}/{number:06d}.ndjson.gz"
+                    path = os.path.join(directory, file)
+                    count, first, last = 0, None, None
+                    with gzip.open(path + ".tmp", "wt", encoding="utf-8", compresslevel=6) as out:
+                        async for page in pages:
+                            for row in page:
+                                out.write(json.dumps({k: _encode(v) for k, v in row.items()}, ensure_ascii=False))
+                                out.write("\n")
+                            count += len(page)
+                            first = page[0][entry["key"]] if first is None else first
+                            last = page[-1][entry["key"]]
+                            if count >= chunk:
+                                break
+                    if not count:
+                        os.remove(path + ".tmp")
+                        break
+                    os.replace(path + ".tmp", path)
+                    entry["chunks"].append({"file": file, "rows": count, "first": first, "last": last})
+                    entry["rows"] += count
+                    _write_json(manifest_path, manifest)
+                entry["done"] = True
+                _write_json(manifest_path, manifest)
+                _report(name, entry["rows"] - rows_before, started)
+    finally:
+        await engine.dispose()
+    manifest["finished_at"] = datetime.utcnow().isoformat()
+    _write_json(manifest_path, manifest)
+    print(f"Dump of {_where(url)} written to {directory}.")
+
+
+# ---------- restore ----------
+
+def _read_chunk(path: str, skip: int, batch: int):
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        rows = []
+        for number, line in enumerate(f):
+            if number < skip:
+                continue
+            rows.append(json.loads(line))
+            if len(rows) >= batch:
+                yield rows
+                rows = []
+        if rows:
+            yield rows
+
+
+async def restore(url: str, directory: str, tables: list[str], batch: int):
+    manifest = _read_json(os.path.join(directory, "manifest.json"), None)
+    if not manifest:
+        sys.exit(f"No manifest.json in {directory}.")
+    if manifest.get("format") != FORMAT:
+        sys.exit("The dump is from an unknown version of this tool.")
+    if not manifest.get("finished_at"):
+        sys.exit("The dump is unfinished, run the dump again to complete it first.")
+
+    # Progress per target database: {table: [chunk index, rows of it done]}
+    progress_path = os.path.join(directory, "restore-progress.json")
+    all_progress = _read_json(progress_path, {})
+    progress = all_progress.setdefault(_where(url), {})
+    if progress:
+        print(f"Resuming the restore into {_where(url)}.")
+
+    engine = create_engine(url, settings.DB_PROFILE)
+    try:
+        await _prepare_target(engine)
+        for name in tables:
+            entry = manifest["tables"].get(name)
+            if entry is None:
+                print(f"  {name:<16} not in this dump, skipped")
+                continue
+            table, started, restored = _table(name), time.perf_counter(), 0
+            decode = _decoder(table)
+            done_chunks, done_rows = progress.get(name, [0, 0])
+            for index, chunk in enumerate(entry["chunks"]):
+                if index < done_chunks:
+                    continue
+                skip = done_rows if index == done_chunks else 0
+                for rows in _read_chunk(os.path.join(directory, chunk["file"]), skip, batch):
+                    async with engine.begin() as conn:
+                        await _write_batch(conn, table, [decode(row) for row in rows])
+                    skip += len(rows)
+                    restored += len(rows)
+                    progress[name] = [index, skip]
+                    _write_json(progress_path, all_progress)
+                progress[name] = [index + 1, 0]
+                _write_json(progress_path, all_progress)
+            _report(name, restored, started)
+        await _reset_sequences(engine, tables)
+    finally:
+        await engine.dispose()
+    print(f"Restored {directory} into {_where(url)}.")
+
+
+# ---------- copy ----------
+
+async def copy(source_url: str, target_url: str, tables: list[str], batch: int, progress_path: str):
+    if _where(source_url) == _where(target_url):
+        sys.exit("Source and target are the same database.")
+    # Progress per source/target pair: {table: last key copied, or [key] when done}
+    all_progress = _read_json(progress_path, {})
+    progress = all_progress.setdefault(f"{_where(source_url)} -> {_where(target_url)}", {})
+    if progress:
+        print(f"Resuming the copy ({progress_path}).")
+
+    source = create_engine(source_url, settings.DB_PROFILE)
+    target = create_engine(target_url, settings.DB_PROFILE)
+    try:
+        await _prepare_target(target)
+        async with source.connect() as conn:
+            await _snapshot(conn)
+            for name in tables:
+                state = progress.get(name)
+                if isinstance(state, list):
+                    continue  # done
+                table, started, copied = _table(name), time.perf_counter(), 0
+                async for rows in _pages(conn, table, state, batch):
+                    async with target.begin() as out:
+                        await _write_batch(out, table, rows)
+                    copied += len(rows)
+                    progress[name] = rows[-1][_key(table).name]
+                    _write_json(progress_path, all_progress)
+                progress[name] = [progress.get(name)]
+                _write_json(progress_path, all_progress)
+                _report(name, copied, started)
+        await _reset_sequences(target, tables)
+
+        # Row counts should now agree
+        for name in tables:
+            table = _table(name)
+            async with source.connect() as a, target.connect() as b:
+                here = await a.scalar(select(func.count()).select_from(table))
+                there = await b.scalar(select(func.count()).select_from(table))
+            if here != there:
+                print(f"  {name}: {here:,} rows in the source but {there:,} in the target "
+                      f"(rows changed during the copy, or the target had extra rows)")
+    finally:
+        await source.dispose()
+        await target.dispose()
+    print(f"Copied {_where(source_url)} to {_where(target_url)}.")
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m app.backup", description=__doc__.split("\n\n")[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    p = commands.add_parser("dump", help="write the tables to compressed NDJSON files")
+    p.add_argument("directory")
+    p.add_argument("--url", default=DB_URL)
+    p.add_argument("--chunk", type=int, default=100_000, help="rows per file")
+
+    p = commands.add_parser("restore", help="load a dump into the database")
+    p.add_argument("directory")
+    p.add_argument("--url", default=DB_URL)
+
+    p = commands.add_parser("copy", help="copy from one database to another")
+    p.add_argument("--from", dest="source", default=DB_URL)
+    p.add_argument("--to", dest="target", required=True)
+    p.add_argument("--progress", default=os.path.join(DATA_DIR, "copy-progress.json"))
+
+    for p in commands.choices.values():
+        p.add_argument("--tables", default=",".join(TABLES), help="comma separated, default all")
+        p.add_argument("--batch", type=int, default=1000, help="rows per query and per insert")
+
+    args = parser.parse_args()
+    tables = [name.strip() for name in args.tables.split(",") if name.strip()]
+    if unknown := set(tables) - set(TABLES):
+        sys.exit(f"Unknown tables: {', '.join(sorted(unknown))}. Choose from {', '.join(TABLES)}.")
+
+    if args.command == "dump":
+        asyncio.run(dump(args.url, args.directory, tables, args.chunk, args.batch))
+    elif args.command == "restore":
+        asyncio.run(restore(args.url, args.directory, tables, args.batch))
+    else:
+        asyncio.run(copy(args.source, args.target, tables, args.batch, args.progress))
+
+
+if __name__ == "__main__":
+    main()
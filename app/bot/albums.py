@@ -0,0 +1,65 @@
+import asyncio
+import logging
+
+from aiogram.types import Message
+
+from app.settings import settings
+
+logger = logging.getLogger(__name__)
+
+
+class AlbumBuffer:
+    """
+    Collects the messages of a media group (album) for a short while.
+
+    Telegram delivers every item of an album as its own update, with the
+    same media_group_id. The first item starts a timer; when it fires all
+    items seen so far are handed to `on_album` together, in message order.
+    stop() hands over whatever is still waiting, so a shutdown loses none.
+    """
+
+    def __init__(self, wait: float):
+        self.wait = wait
+        self._groups: dict[tuple, list] = {}
+        self._contexts: dict[tuple, object] = {}
+        self._tasks: set = set()
+        self.on_album = None  # async (messages, context) -> None
+        self.albums = 0
+        self.items = 0
+
+    def add(self, message: Message, context=None):
+        key = (message.chat.id, message.media_group_id)
+        group = self._groups.get(key)
+        if group is None:
+            group = self._groups[key] = []
+            self._contexts[key] = context
+            task = asyncio.create_task(self._flush_later(key))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        group.append(message)
+
+    async def stop(self):
+        """Cancels the timers and hands over every album still waiting."""
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for key in list(self._groups):
+            await self._flush(key)
+
+    async def _flush_later(self, key):
+        await asyncio.sleep(self.wait)
+        await self._flush(key)
+
+    async def _flush(self, key):
+        context = self._contexts.pop(key)
+        messages = sorted(self._groups.pop(key), key=lambda m: m.message_id)
+        self.albums += 1
+        self.items += len(messages)
+        try:
+            await self.on_album(messages, context)
+        except Exception as e:
+            logger.error("Error forwarding album %s: %s", key[1], e)
+
+
+album_buffer = AlbumBuffer(settings.ALBUM_WAIT_MS / 1000)
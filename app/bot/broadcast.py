@@ -0,0 +1,213 @@
+import asyncio
+import logging
+from datetime import datetime
+
+from aiogram.exceptions import TelegramForbiddenError
+from sqlalchemy import func, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from app.settings import settings
+from app.bot.loader import bot
+from app.bot.outbound import outbound_priority, Priority
+from app.database.core import AsyncSessionLocal
+from app.database.models import Broadcast, User
+from app.database.cache import evict_user
+from app.metrics import Counter
+from app.bot.unit_of_work import on_commit
+
+logger = logging.getLogger(__name__)
+
+broadcast_messages = Counter("relaycat_broadcast_messages_total", "Broadcast sends, by result.", ("result",))
+
+SENT, FAILED, BLOCKED = "sent", "failed", "blocked"
+
+
+def recipients_query(after: int, limit: int):
+    """Next page of recipients in id order: verified, not banned, not blocked."""
+    return (
+        select(User.id)
+        .where(
+            User.id > after,
+            User.id != settings.ADMIN_ID,
+            User.is_verified.is_(True),
+            User.is_banned.isnot(True),
+            User.is_blocked.isnot(True),
+        )
+        .order_by(User.id)
+        .limit(limit)
+    )
+
+
+async def mark_blocked(user_ids: list[int]):
+    """Telegram said 403: the user blocked the bot (or deleted their account)."""
+    if not user_ids:
+        return
+    async with AsyncSessionLocal() as session:
+        await session.execute(update(User).where(User.id.in_(user_ids)).values(is_blocked=True))
+        await session.commit()
+    for user_id in user_ids:
+        evict_user(user_id)
+
+
+async def clear_blocked(user_id: int, session: AsyncSession | None = None):
+    """The user wrote to the bot again, so they unblocked it."""
+    query = update(User).where(User.id == user_id).values(is_blocked=False)
+    if session is not None:
+        await session.execute(query)
+        on_commit(session, lambda: evict_user(user_id))
+        return
+    async with AsyncSessionLocal() as session:
+        await session.execute(query)
+        await session.commit()
+    evict_user(user_id)
+
+
+class Broadcaster:
+    """
+    Sends broadcasts one after another, in the background.
+
+    Recipients are read a page at a time with a keyset cursor on users.id
+    (no OFFSET, nothing loaded up front) and sent to `concurrency` at a
+    time. After each of those chunks the cursor and the counters are
+    saved to the broadcasts row, so after a restart the broadcast
+    continues where it was; at worst the chunk that was in flight is
+    sent again. Sends go through the outbound scheduler at BULK priority,
+    so replies and forwards are not held up by a broadcast.
+
+    In multi-process mode only one process runs the broadcaster; the
+    others just insert rows, which it picks up within `poll_interval`.
+    """
+
+    def __init__(self, batch: int, concurrency: int, poll_interval: float = 5):
+        self.batch = batch
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self._wake = asyncio.Event()
+        self._closing = False
+        self._task: asyncio.Task | None = None
+
+    async def create(self, text: str | None = None, from_chat_id: int | None = None,
+                     message_id: int | None = None) -> Broadcast:
+        """Either `text`, or the message to copy_message to every recipient."""
+        async with AsyncSessionLocal() as session:
+            total = await session.scalar(
+                select(func.count()).select_from(recipients_query(0, None).subquery())
+            )
+            broadcast = Broadcast(text=text, from_chat_id=from_chat_id, message_id=message_id, total=total or 0)
+            session.add(broadcast)
+            await session.commit()
+        self._wake.set()
+        logger.info("Broadcast %d created for %d recipients.", broadcast.id, broadcast.total)
+        return broadcast
+
+    async def cancel(self, broadcast_id: int | None = None) -> int:
+        """Cancels one broadcast, or all running ones. Returns how many were running."""
+        query = update(Broadcast).where(Broadcast.status == "running")
+        if broadcast_id is not None:
+            query = query.where(Broadcast.id == broadcast_id)
+        async with AsyncSessionLocal() as session:
+            result = await session.execute(query.values(status="cancelled", finished_at=datetime.utcnow()))
+            await session.commit()
+        return result.rowcount or 0
+
+    def start(self):
+        if self._task is None:
+            self._closing = False
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self, timeout: float = 10):
+        """Lets the chunk in flight finish (up to `timeout`) so it isn't sent twice."""
+        if not self._task:
+            return
+        self._closing = True
+        self._wake.set()
+        try:
+            await asyncio.wait_for(self._task, timeout=timeout)
+        except asyncio.TimeoutError:
+            pass  # cancelled by wait_for, the chunk is sent again after the restart
+        self._task = None
+
+    async def _run(self):
+        while not self._closing:
+            try:
+                broadcast = await self._next()
+                if broadcast:
+                    await self.run(broadcast)
+                    continue
+            except Exception as e:
+                logger.error("Broadcast failed: %s", e)
+            self._wake.clear()
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _next(self) -> Broadcast | None:
+        async with AsyncSessionLocal() as session:
+            result = await session.execute(
+                select(Broadcast).where(Broadcast.status == "running").order_by(Broadcast.id).limit(1)
+            )
+            return result.scalar_one_or_none()
+
+    async def run(self, broadcast: Broadcast):
+        while not self._closing:
+            async with AsyncSessionLocal() as session:
+                result = await session.execute(recipients_query(broadcast.cursor, self.batch))
+                user_ids = result.scalars().all()
+            if not user_ids:
+                await self._save(broadcast, status="done", finished_at=datetime.utcnow())
+                logger.info("Broadcast %d done: %d sent, %d failed, %d blocked.",
+                            broadcast.id, broadcast.sent, broadcast.failed, broadcast.blocked)
+                return
+
+            for low in range(0, len(user_ids), self.concurrency):
+                chunk = user_ids[low:low + self.concurrency]
+                results = await asyncio.gather(*(self._send(broadcast, user_id) for user_id in chunk))
+                await mark_blocked([user_id for user_id, r in zip(chunk, results) if r == BLOCKED])
+                broadcast.cursor = chunk[-1]
+                broadcast.sent += results.count(SENT)
+                broadcast.failed += results.count(FAILED)
+                broadcast.blocked += results.count(BLOCKED)
+                if not await self._save(broadcast):
+                    logger.info("Broadcast %d cancelled.", broadcast.id)
+                    return
+                if self._closing:
+                    return
+
+    async def _send(self, broadcast: Broadcast, user_id: int) -> str:
+        try:
+            with outbound_priority(Priority.BULK):
+                if broadcast.text is not None:
+                    await bot.send_message(user_id, broadcast.text, parse_mode=None)
+                else:
+                    await bot.copy_message(user_id, broadcast.from_chat_id, broadcast.message_id)
+            result = SENT
+        except TelegramForbiddenError:
+            result = BLOCKED
+        except Exception as e:
+            logger.warning("Broadcast %d to %s failed: %s", broadcast.id, user_id, e)
+            result = FAILED
+        broadcast_messages.inc(result)
+        return result
+
+    async def _save(self, broadcast: Broadcast, **values) -> bool:
+        """Saves cursor and counters; False if the broadcast was cancelled meanwhile."""
+        async with AsyncSessionLocal() as session:
+            result = await session.execute(
+                update(Broadcast)
+                .where(Broadcast.id == broadcast.id, Broadcast.status == "running")
+                .values(cursor=broadcast.cursor, sent=broadcast.sent, failed=broadcast.failed,
+                        blocked=broadcast.blocked, **values)
+            )
+            if not result.rowcount:
+                # Cancelled: keep the counts of the last page anyway
+                await session.execute(
+                    update(Broadcast).where(Broadcast.id == broadcast.id)
+                    .values(sent=broadcast.sent, failed=broadcast.failed, blocked=broadcast.blocked)
+                )
+            await session.commit()
+        return bool(result.rowcount)
+
+
+broadcaster = Broadcaster(settings.BROADCAST_BATCH, settings.BROADCAST_CONCURRENCY)
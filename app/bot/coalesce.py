@@ -0,0 +1,44 @@
+from app.settings import settings
+from app.database.cache import TTLCache
+
+
+class InfoCardCoalescer:
+    """
+    Decides whether a forwarded message gets its own "User Info" card.
+
+    Only the first message of a burst gets one; the burst lasts as long as
+    the user keeps writing with gaps shorter than `window` seconds. Every
+    skipped card saves one sendMessage call and one MessageRoute row.
+    """
+
+    def __init__(self, window: float):
+        self.window = window
+        self._recent = TTLCache("info_card_bursts", 50000, window)
+        self.sent = 0
+        self.skipped = 0
+
+    def should_send(self, user_id: int) -> bool:
+        if self.window <= 0:
+            self.sent += 1
+            return True
+        in_burst = self._recent.get(user_id) is not None
+        # Re-set on every message, so the window restarts from the latest one
+        self._recent.set(user_id, True)
+        if in_burst:
+            self.skipped += 1
+            return False
+        self.sent += 1
+        return True
+
+    def stats(self) -> dict:
+        return {
+            "window": self.window,
+            "cards_sent": self.sent,
+            "cards_skipped": self.skipped,
+            # One API call and one route row per skipped card
+            "api_calls_saved": self.skipped,
+            "route_writes_saved": self.skipped,
+        }
+
+
+info_cards = InfoCardCoalescer(settings.INFO_CARD_WINDOW)
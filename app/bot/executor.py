@@ -0,0 +1,170 @@
+import asyncio
+import logging
+import time
+from collections import deque
+
+from aiogram import Bot, Dispatcher
+from aiogram.dispatcher.middlewares.user_context import UserContextMiddleware
+from aiogram.methods import GetUpdates
+from aiogram.types import Update
+from aiogram.utils.backoff import Backoff, BackoffConfig
+
+from app.bot.loader import bot, dp
+from app.settings import settings
+
+logger = logging.getLogger(__name__)
+
+OVERFLOW_POLICIES = ("block", "drop")
+
+
+def update_key(update: Update) -> int:
+    """Chat the update belongs to, or its sender; updates with the same key stay in order."""
+    context = UserContextMiddleware.resolve_event_context(update)
+    if context.chat is not None:
+        return context.chat.id
+    if context.user is not None:
+        return context.user.id
+    return update.update_id
+
+
+class KeyedExecutor:
+    """
+    Runs updates on `shards` workers, each with its own bounded queue.
+    An update goes to the shard of its chat (or user), so one user's
+    updates are handled one after another in arrival order while other
+    users' run in parallel on the other shards.
+
+    When a shard's queue is full, `overflow` decides:
+      block  submit() waits for room. Polling stops fetching, so Telegram
+             holds on to the rest. Webhook requests would be answered late
+             and Telegram backs off or retries, see overflow_policy().
+      drop   the update is discarded and counted, the request still gets
+             its 200 at once.
+    """
+
+    def __init__(self, dispatcher: Dispatcher, bot: Bot, shards: int, queue_size: int, overflow: str = "block"):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy {overflow!r}, expected one of {', '.join(OVERFLOW_POLICIES)}")
+        self.dispatcher = dispatcher
+        self.bot = bot
+        self.overflow = overflow
+        self._queues = [asyncio.Queue(maxsize=queue_size) for _ in range(shards)]
+        self._tasks: list[asyncio.Task] = []
+        self.accepted = 0
+        self.dropped = 0
+        self.blocked = 0  # submits that had to wait for room
+        self.peak_depth = 0
+        self.processed = 0
+        self.errors = 0
+        # Seconds from "received" to "handled", for the last few thousand updates
+        self.latencies: deque = deque(maxlen=10000)
+
+    @property
+    def shards(self) -> int:
+        return len(self._queues)
+
+    async def submit(self, update: Update) -> bool:
+        queue = self._queues[update_key(update) % len(self._queues)]
+        item = (update, time.perf_counter())
+        try:
+            queue.put_nowait(item)
+        except asyncio.QueueFull:
+            if self.overflow == "drop":
+                self.dropped += 1
+                return False
+            self.blocked += 1
+            await queue.put(item)
+        self.accepted += 1
+        self.peak_depth = max(self.peak_depth, queue.qsize())
+        return True
+
+    def start(self):
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._worker(queue)) for queue in self._queues]
+
+    async def drain(self):
+        """Waits until every update submitted so far has been handled."""
+        await asyncio.gather(*(q.join() for q in self._queues))
+
+    async def flush(self):
+        """Nothing is buffered before the queues, see UpdateSink for one that is."""
+
+    async def stop(self, timeout: float = 10):
+        """Gives queued updates `timeout` seconds to finish, then cancels the workers."""
+        try:
+            await asyncio.wait_for(self.drain(), timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Dropping %d queued updates on shutdown.", sum(q.qsize() for q in self._queues))
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _worker(self, queue: asyncio.Queue):
+        while True:
+            update, received_at = await queue.get()
+            try:
+                await self.dispatcher.feed_update(self.bot, update)
+                self.processed += 1
+            except Exception as e:
+                self.errors += 1
+                logger.exception("Error handling update %s: %s", update.update_id, e)
+            finally:
+                self.latencies.append(time.perf_counter() - received_at)
+                queue.task_done()
+
+    def depths(self) -> list[int]:
+        return [q.qsize() for q in self._queues]
+
+    def stats(self) -> dict:
+        depths = self.depths()
+        return {
+            "queued": sum(depths),
+            "shards": self.shards,
+            "shard_queue_size": self._queues[0].maxsize,
+            "shard_depths": depths,
+            "peak_depth": self.peak_depth,
+            "overflow": self.overflow,
+            "accepted": self.accepted,
+            "dropped": self.dropped,
+            "blocked": self.blocked,
+            "processed": self.processed,
+            "errors": self.errors,
+        }
+
+
+def overflow_policy() -> str:
+    """
+    UPDATE_OVERFLOW, with "auto" resolved for BOT_MODE: blocking is what
+    gives polling its backpressure, a webhook sheds load with a fast 200.
+    """
+    if settings.UPDATE_OVERFLOW == "auto":
+        return "drop" if settings.BOT_MODE == "webhook" else "block"
+    return settings.UPDATE_OVERFLOW
+
+
+async def poll_updates(executor, polling_timeout: int = 30):
+    """
+    Long polling that hands updates to `executor` (a KeyedExecutor, or the
+    multi-process UpdateSink). Updates are confirmed to Telegram with the
+    next getUpdates call, after the executor accepted and flushed them;
+    with the "block" policy a full shard pauses polling.
+    """
+    backoff = Backoff(BackoffConfig(min_delay=1.0, max_delay=5.0, factor=1.3, jitter=0.1))
+    get_updates = GetUpdates(timeout=polling_timeout, allowed_updates=executor.dispatcher.resolve_used_update_types())
+    request_timeout = int((executor.bot.session.timeout or 60) + polling_timeout)
+    while True:
+        try:
+            updates = await executor.bot(get_updates, request_timeout=request_timeout)
+        except Exception as e:
+            logger.error("Failed to fetch updates - %s: %s", type(e).__name__, e)
+            await backoff.asleep()
+            continue
+        backoff.reset()
+        for update in updates:
+            await executor.submit(update)
+            get_updates.offset = update.update_id + 1
+        await executor.flush()
+
+
+update_executor = KeyedExecutor(dp, bot, settings.UPDATE_SHARDS, settings.UPDATE_QUEUE_SIZE, overflow_policy())
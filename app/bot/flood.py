@@ -0,0 +1,147 @@
+import asyncio
+import logging
+import time
+from collections import deque
+
+from aiogram import BaseMiddleware
+from sqlalchemy.future import select
+
+from app.settings import settings
+from app.database.core import AsyncSessionLocal
+from app.database.models import User
+from app.database.cache import get_setting
+from app.metrics import Counter
+
+logger = logging.getLogger(__name__)
+
+flood_dropped = Counter("relaycat_flood_dropped_total", "Updates dropped before any handler ran.", ("reason",))
+flood_mutes = Counter("relaycat_flood_mutes_total", "Automatic mutes for flooding.")
+
+# Setting keys editable on the settings page, with their defaults
+FLOOD_SETTINGS = {
+    "flood_limit": settings.FLOOD_LIMIT,
+    "flood_window": settings.FLOOD_WINDOW,
+    "flood_mute": settings.FLOOD_MUTE,
+    "flood_max_mute": settings.FLOOD_MAX_MUTE,
+}
+
+
+class FloodGuard(BaseMiddleware):
+    """
+    Outer middleware on messages and callback queries, runs before filters
+    and handlers. Updates from banned users, and from users muted for
+    flooding, are dropped from memory without touching the database or the
+    Telegram API.
+
+    A user sending more than `limit` updates within `window` seconds is
+    muted for `mute` seconds; every further mute while earlier ones are
+    remembered doubles that, up to `max_mute`. The admin gets one message
+    per mute.
+    """
+
+    def __init__(self, limit: int, window: float, mute: float, max_mute: float):
+        self.configure(limit, window, mute, max_mute)
+        self.banned: set[int] = set()
+        self._muted: dict[int, float] = {}  # user_id -> monotonic time the mute ends
+        self._strikes: dict[int, tuple] = {}  # user_id -> (count, monotonic time of last mute)
+        self._notify_tasks: set = set()
+        self.bot = None
+
+    def configure(self, limit: int, window: float, mute: float, max_mute: float):
+        self.limit = limit
+        self.window = window
+        self.mute = mute
+        self.max_mute = max_mute
+        self._hits: dict[int, deque] = {}  # user_id -> times of the last limit+1 updates
+
+    async def load(self):
+        """Reads the thresholds from the settings table and the banned ids."""
+        values = {key: int(await get_setting(key, str(default))) for key, default in FLOOD_SETTINGS.items()}
+        self.configure(values["flood_limit"], values["flood_window"], values["flood_mute"], values["flood_max_mute"])
+        async with AsyncSessionLocal() as session:
+            result = await session.execute(select(User.id).where(User.is_banned == True))
+            self.banned = set(result.scalars().all())
+        logger.info("Flood guard: %d/%ss, %d banned users.", self.limit, self.window, len(self.banned))
+
+    def ban(self, user_id: int):
+        self.banned.add(user_id)
+
+    def unban(self, user_id: int):
+        self.banned.discard(user_id)
+        self._muted.pop(user_id, None)
+        self._strikes.pop(user_id, None)
+
+    async def __call__(self, handler, event, data):
+        user = data.get("event_from_user")
+        if user is None or user.id == settings.ADMIN_ID:
+            return await handler(event, data)
+        if user.id in self.banned:
+            flood_dropped.inc("banned")
+            return None
+
+        now = time.monotonic()
+        muted_until = self._muted.get(user.id)
+        if muted_until is not None:
+            if now < muted_until:
+                flood_dropped.inc("muted")
+                return None
+            del self._muted[user.id]
+
+        if self.limit and self._over_limit(user.id, now):
+            self._mute(user, now)
+            flood_dropped.inc("flood")
+            return None
+        return await handler(event, data)
+
+    def _over_limit(self, user_id: int, now: float) -> bool:
+        hits = self._hits.get(user_id)
+        if hits is None:
+            if len(self._hits) > 50000:
+                self._prune(now)
+            hits = self._hits[user_id] = deque(maxlen=self.limit + 1)
+        hits.append(now)
+        # maxlen keeps the last limit+1 hits; all of them inside the window = too many
+        return len(hits) > self.limit and now - hits[0] < self.window
+
+    def _mute(self, user, now: float):
+        count, last = self._strikes.get(user.id, (0, 0.0))
+        if now - last > self.max_mute * 2:  # forgiven after a quiet period
+            count = 0
+        duration = min(self.mute * 2 ** count, self.max_mute)
+        self._strikes[user.id] = (count + 1, now)
+        self._muted[user.id] = now + duration
+        self._hits.pop(user.id, None)
+        flood_mutes.inc()
+        logger.warning("Auto-muted %s for %ds (flooding).", user.id, duration)
+
+        if self.bot is not None:
+            task = asyncio.create_task(self._notify(user, duration, count + 1))
+            self._notify_tasks.add(task)
+            task.add_done_callback(self._notify_tasks.discard)
+
+    async def _notify(self, user, duration: float, strike: int):
+        name = f"@{user.username}" if user.username else user.full_name
+        try:
+            await self.bot.send_message(
+                settings.ADMIN_ID,
+                f"🔇 Auto-muted {name} (ID: {user.id}) for {int(duration)}s: more than "
+                f"{self.limit} messages in {self.window}s (mute #{strike}).\n/ban {user.id} to block for good.",
+                parse_mode=None,
+            )
+        except Exception as e:
+            logger.error("Failed to notify admin about mute of %s: %s", user.id, e)
+
+    def _prune(self, now: float):
+        self._hits = {k: v for k, v in self._hits.items() if v and now - v[-1] < self.window}
+        self._muted = {k: v for k, v in self._muted.items() if v > now}
+        self._strikes = {k: v for k, v in self._strikes.items() if now - v[1] <= self.max_mute * 2}
+
+    def stats(self) -> dict:
+        return {
+            "banned": len(self.banned),
+            "muted": sum(1 for until in self._muted.values() if until > time.monotonic()),
+            "tracked": len(self._hits),
+        }
+
+
+flood_guard = FloodGuard(settings.FLOOD_LIMIT, settings.FLOOD_WINDOW, settings.FLOOD_MUTE, settings.FLOOD_MAX_MUTE)
@@ -1,50 +1,78 @@
 from aiogram import Router, F, Bot, types
 from aiogram.filters import CommandStart, Command
 from aiogram.types import Message, CallbackQuery, Chat, ReactionTypeEmoji
-from sqlalchemy.future import select
-from sqlalchemy import update
+from aiogram.exceptions import TelegramForbiddenError
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.bot.loader import bot, dp
 from app.settings import settings
-from app.database.core import AsyncSessionLocal
-from app.database.models import User, MessageRoute, Rule, Setting
-from app.bot.verification import generate_verification_challenge
+from app.database.models import User
+from app.bot.verification import generate_verification_challenge, challenge_pool
+from app.bot.rules import rule_engine
+from app.bot.keywords import keyword_filter
+from app.database.cache import get_user, cache_user, evict_user, get_setting, user_cache
+from app.database.route_index import route_index
+from app.database.user_writer import user_writer
+from app.bot.outbound import outbound_priority, Priority
+from app.bot.coalesce import info_cards
+from app.bot.albums import album_buffer
+from app.database.stats import stats
+from app.bot.moderation import set_banned
+from app.bot.broadcast import broadcaster, mark_blocked, clear_blocked
+from app.bot.outbox import outbox
+import logging
 import re
 
+logger = logging.getLogger(__name__)
+
 router = Router()
 dp.include_router(router)
 
 from aiogram.types import User as TgUser
 
-async def get_or_create_user(tg_user: TgUser):
-    async with AsyncSessionLocal() as session:
-        result = await session.execute(select(User).where(User.id == tg_user.id))
-        user = result.scalar_one_or_none()
-        if not user:
-            user = User(
-                id=tg_user.id,
-                username=tg_user.username,
-                first_name=tg_user.first_name,
-                last_name=tg_user.last_name,
-                is_verified=False
-            )
-            session.add(user)
-            await session.commit()
-            await session.refresh(user)
+async def get_or_create_user(tg_user: TgUser, session: AsyncSession):
+    """New users are queued in user_writer, which inserts them in batches."""
+    user = user_cache.get(tg_user.id)
+    if user:
+        return user
+    # Not user_cache's "no such user": another worker may have created it since
+    evict_user(tg_user.id)
+    user = await get_user(tg_user.id, session)
+    if user:
         return user
+    user = User(
+        id=tg_user.id,
+        username=tg_user.username,
+        first_name=tg_user.first_name,
+        last_name=tg_user.last_name,
+        is_verified=False,
+        is_banned=False,
+        is_blocked=False,
+    )
+    user_writer.add(user)
+    cache_user(user)
+    stats.record_user()
+    return user
+
+def mark_verified(user_id: int):
+    user_writer.verify(user_id)
+    # The cached row stays right until the flag is written
+    user = user_cache.get(user_id)
+    if user:
+        user.is_verified = True
 
 @router.message(CommandStart())
-async def cmd_start(message: Message):
+async def cmd_start(message: Message, session: AsyncSession):
     if message.chat.type != 'private':
         return
 
-    user = await get_or_create_user(message.from_user)
+    user = await get_or_create_user(message.from_user, session)
     
     if user.is_verified or message.from_user.id == settings.ADMIN_ID:
         await message.answer("Hello again! You are verified. Messages you send here will be forwarded to the admin.")
     else:
         # Start verification
-        target, markup = generate_verification_challenge()
+        target, markup = generate_verification_challenge(message.from_user.id)
         # Store target in state or just check callback?
         # A simple stateless way is to encode target in callback data of correct answer, but that's insecure.
         # Better: We encode the target in the text instructions.
@@ -52,43 +80,50 @@ async def cmd_start(message: Message):
             f"Welcome! To prove you are human, please tap the {target} button below:",
             reply_markup=markup
         )
+    # Writes go last: on SQLite the write lock is held until the update commits
+    if user.is_blocked:
+        await clear_blocked(user.id, session)
 
 @router.callback_query(F.data.startswith("verify:"))
 async def on_verify_callback(callback: CallbackQuery):
-    emoji_clicked = callback.data.split(":")[1]
-    # We need to know what the target was.
-    # Parsing the message text is a hack but stateless and simple for this level.
-    # Text: "Welcome! ... tap the 🍎 button below:"
-    
-    msg_text = callback.message.text
-    if "tap the" not in msg_text:
-        await callback.answer("Session expired or invalid.", show_alert=True)
-        return
-        
-    target_emoji = msg_text.split("tap the")[1].strip().split(" ")[0]
-    
-    if emoji_clicked == target_emoji:
-        # Verify user
-        async with AsyncSessionLocal() as session:
-            await session.execute(
-                update(User).where(User.id == callback.from_user.id).values(is_verified=True)
+    if callback.data.count(":") == 4:
+        # verify:<epoch>:<slot>:<idx>:<sig>, checked against the signature alone
+        correct = challenge_pool.check(callback.data, callback.from_user.id)
+        if correct is None:
+            target, markup = generate_verification_challenge(callback.from_user.id)
+            await callback.message.edit_text(
+                f"This challenge expired. Tap the {target}:",
+                reply_markup=markup
             )
-            await session.commit()
-            
+            return
+    else:
+        # verify:<emoji> from keyboards sent before the signed format.
+        # Parsing the message text is a hack but stateless and simple for this level.
+        # Text: "Welcome! ... tap the 🍎 button below:"
+        emoji_clicked = callback.data.split(":")[1]
+        msg_text = callback.message.text
+        if "tap the" not in msg_text:
+            await callback.answer("Session expired or invalid.", show_alert=True)
+            return
+        target_emoji = msg_text.split("tap the")[1].strip().split(" ")[0]
+        correct = emoji_clicked == target_emoji
+
+    if correct:
+        mark_verified(callback.from_user.id)
         await callback.message.edit_text("✅ Verified! You can now send messages to the admin.")
     else:
         # Wrong answer, retry
-        target, markup = generate_verification_challenge()
+        target, markup = generate_verification_challenge(callback.from_user.id)
         await callback.message.edit_text(
             f"Wrong! Try again. Tap the {target}:",
             reply_markup=markup
         )
 
 
-async def get_reply_target_id(message: Message) -> int | None:
+async def get_reply_target_id(message: Message, session: AsyncSession | None = None) -> int | None:
     """
     Try to find the target user ID from a reply message.
-    1. Check MessageRoute in DB (most reliable for active sessions)
+    1. Check MessageRoute (in-memory index, then DB; most reliable for active sessions)
     2. Check Info Card text (stateless fallback)
     3. Check Forward Origin (stateless fallback for forwards)
     """
@@ -96,14 +131,10 @@ async def get_reply_target_id(message: Message) -> int | None:
     if not reply_msg:
         return None
 
-    # 1. Check DB Route
-    async with AsyncSessionLocal() as session:
-        result = await session.execute(
-            select(MessageRoute).where(MessageRoute.admin_message_id == reply_msg.message_id)
-        )
-        route = result.scalar_one_or_none()
-        if route:
-            return route.user_id
+    # 1. Check Route (hot index first, DB only for older messages)
+    user_id = await route_index.lookup(reply_msg.message_id, session)
+    if user_id:
+        return user_id
 
     # 2. Check Info Card Text (e.g. "ID: 123456")
     text = reply_msg.text or reply_msg.caption or ""
@@ -121,7 +152,7 @@ async def get_reply_target_id(message: Message) -> int | None:
 
 # ---------- Admin Commands ----------
 @router.message(Command("ban"), F.from_user.id == settings.ADMIN_ID)
-async def cmd_ban(message: Message):
+async def cmd_ban(message: Message, session: AsyncSession):
     # Extract ID from args or reply
     target_id = None
     args = message.text.split()
@@ -129,79 +160,86 @@ async def cmd_ban(message: Message):
     if len(args) > 1 and args[1].isdigit():
         target_id = int(args[1])
     elif message.reply_to_message:
-        target_id = await get_reply_target_id(message)
+        target_id = await get_reply_target_id(message, session)
     
     if not target_id:
         await message.answer("⚠️ Usage: /ban <user_id> or reply to a user message.")
         return
 
-    async with AsyncSessionLocal() as session:
-        await session.execute(update(User).where(User.id == target_id).values(is_banned=True))
-        await session.commit()
+    await set_banned([target_id], True)
     
     await message.answer(f"🔒 User {target_id} has been banned.")
 
 @router.message(Command("unban"), F.from_user.id == settings.ADMIN_ID)
-async def cmd_unban(message: Message):
+async def cmd_unban(message: Message, session: AsyncSession):
     target_id = None
     args = message.text.split()
     
     if len(args) > 1 and args[1].isdigit():
         target_id = int(args[1])
     elif message.reply_to_message:
-        target_id = await get_reply_target_id(message)
+        target_id = await get_reply_target_id(message, session)
 
     if not target_id:
         await message.answer("⚠️ Usage: /unban <user_id> or reply to a user message.")
         return
 
-    async with AsyncSessionLocal() as session:
-        await session.execute(update(User).where(User.id == target_id).values(is_banned=False))
-        await session.commit()
+    await set_banned([target_id], False)
     
     await message.answer(f"✅ User {target_id} has been unbanned.")
 
-async def check_rules(message: Message, user: User) -> str:
+@router.message(Command("broadcast"), F.from_user.id == settings.ADMIN_ID)
+async def cmd_broadcast(message: Message):
+    # Reply /broadcast to any message to copy it to everyone, or /broadcast <text>
+    args = message.text.split(maxsplit=1)
+    arg = args[1].strip() if len(args) > 1 else ""
+
+    if arg == "stop":
+        cancelled = await broadcaster.cancel()
+        await message.answer(f"⏹ Cancelled {cancelled} broadcast(s).")
+        return
+    if message.reply_to_message:
+        broadcast = await broadcaster.create(from_chat_id=message.chat.id, message_id=message.reply_to_message.message_id)
+    elif arg:
+        broadcast = await broadcaster.create(text=arg)
+    else:
+        await message.answer(
+            "⚠️ Usage: reply /broadcast to a message, or /broadcast <text>.\n"
+            "/broadcast stop cancels running broadcasts. Progress is on the Broadcasts page of the web panel."
+        )
+        return
+
+    await message.answer(f"📣 Broadcast #{broadcast.id} queued for {broadcast.total} users.")
+
+async def check_rules(message: Message, user: User, session: AsyncSession | None = None) -> str:
     """Returns 'allow', 'block', or 'drop'"""
     # 1. Default Policy: Block non-admin commands
     if message.text and message.text.startswith("/") and message.from_user.id != settings.ADMIN_ID:
         return "drop" # Silent drop for commands
 
-    async with AsyncSessionLocal() as session:
-        result = await session.execute(select(Rule).where(Rule.is_active == True))
-        rules = result.scalars().all()
-    
-    for rule in rules:
-        matched = False
-        try:
-            if rule.rule_type == "message_content":
-                text = message.text or message.caption or ""
-                if re.search(rule.pattern, text): matched = True
-            elif rule.rule_type == "username":
-                if re.search(rule.pattern, user.username or ""): matched = True
-            elif rule.rule_type == "is_forwarded":
-                 if message.forward_origin and rule.pattern == "true": matched = True
-        except Exception:
-            continue # Invalid regex
-
-        if matched:
-            return rule.action
-            
-    return "allow"
+    text = message.text or message.caption or ""
+    hit = await rule_engine.match(text, user.username or "", bool(message.forward_origin), session)
+    if not hit:
+        # 2. Bad words, when no rule (allow rules included) decided first
+        if text and await keyword_filter.match(text, session):
+            stats.record_block(0)
+            return settings.KEYWORD_ACTION
+        return "allow"
+    if hit.action != "allow":
+        stats.record_block(hit.rule_id)
+    return hit.action
 
 # ---------- Message Forwarding (User -> Admin) ----------
 @router.message(F.chat.type == "private")
-async def handle_user_message(message: Message):
+async def handle_user_message(message: Message, session: AsyncSession):
     if message.from_user.id == settings.ADMIN_ID:
         if message.reply_to_message:
-            await handle_admin_reply(message)
+            await handle_admin_reply(message, session)
         return
 
     # Check verification
-    async with AsyncSessionLocal() as session:
-        result = await session.execute(select(User).where(User.id == message.from_user.id))
-        user = result.scalar_one_or_none()
-        
+    user = await get_user(message.from_user.id, session)
+
     # Verification Check
     if message.from_user.id != settings.ADMIN_ID and (not user or not user.is_verified):
         await message.answer("Please type /start to verify yourself first.")
@@ -211,71 +249,117 @@ async def handle_user_message(message: Message):
         return # Ignore
 
     # Rule Check
-    action = await check_rules(message, user)
-    if action == "drop": return
+    action = await check_rules(message, user, session)
     if action == "block":
         await message.answer("🚫 Message blocked by filter.")
+    # They wrote, so they unblocked the bot (written after the answer above,
+    # SQLite holds the write lock until the update commits)
+    if user.is_blocked:
+        await clear_blocked(user.id, session)
+    if action != "allow":
+        return
+
+    # Albums arrive as one update per item, they are forwarded together
+    if message.media_group_id:
+        album_buffer.add(message, user)
         return
 
-    # Forward to Admin
-    # We use copy_message or forward_message. 
+    # Forward to Admin (from the outbox, with retries)
     # RelayCat original design: Forward message, then send metadata card.
-    
+    outbox.enqueue(
+        "forward", f"forward:{user.id}:{message.message_id}", f"in:{user.id}",
+        {"user_id": user.id, "message_id": message.message_id},
+    )
+
+async def queue_album(messages: list[Message], user: User):
+    outbox.enqueue(
+        "album", f"album:{user.id}:{messages[0].message_id}", f"in:{user.id}",
+        {"user_id": user.id, "message_ids": [m.message_id for m in messages]},
+    )
+
+album_buffer.on_album = queue_album
+
+async def deliver_forward(payload: dict):
+    user = await get_user(payload["user_id"])
+    with outbound_priority(Priority.FORWARD):
+        fwd = await bot.forward_message(settings.ADMIN_ID, user.id, payload["message_id"])
+    route_index.add(user.id, fwd.message_id, payload["message_id"])
+    stats.record_message()
+    await send_info_card(user, fwd.message_id, payload["message_id"])
+
+async def deliver_album(payload: dict):
+    """One forward_messages call and one card for a whole media group."""
+    user = await get_user(payload["user_id"])
+    message_ids = payload["message_ids"]
+    with outbound_priority(Priority.FORWARD):
+        forwarded = await bot.forward_messages(settings.ADMIN_ID, from_chat_id=user.id, message_ids=message_ids)
+    if len(forwarded) == len(message_ids):
+        originals = message_ids
+    else:
+        # Telegram skips items the user deleted meanwhile and doesn't say
+        # which: the copies still route to the user, but not to a message
+        logger.info("Album of %s: %d of %d items forwarded", user.id, len(forwarded), len(message_ids))
+        originals = [None] * len(forwarded)
+    for original_id, fwd in zip(originals, forwarded):
+        route_index.add(user.id, fwd.message_id, original_id)
+    stats.record_message(len(forwarded))
+    if forwarded:
+        await send_info_card(user, forwarded[0].message_id, originals[0])
+
+async def send_info_card(user: User, admin_message_id: int, user_message_id: int):
+    """Info card under a forwarded message, only for the first message of a burst."""
+    if not info_cards.should_send(user.id):
+        return
+    info_text = (
+        f"👤 <b>User Info</b>\n"
+        f"ID: <code>{user.id}</code>\n"
+        f"Name: {user.first_name} {user.last_name or ''}\n"
+        f"Username: @{user.username or 'none'}\n"
+        f"<i>Reply to this or the forwarded message to answer.</i>"
+    )
+    # The forward went through, a failed card must not make the outbox send it again
     try:
-        # Forward original
-        fwd = await message.forward(settings.ADMIN_ID)
-        
-        # Send info card
-        info_text = (
-            f"👤 <b>User Info</b>\n"
-            f"ID: <code>{user.id}</code>\n"
-            f"Name: {user.first_name} {user.last_name or ''}\n"
-            f"Username: @{user.username or 'none'}\n"
-            f"<i>Reply to this or the forwarded message to answer.</i>"
-        )
-        card = await bot.send_message(settings.ADMIN_ID, info_text, reply_to_message_id=fwd.message_id)
-        
-        # Save route
-        async with AsyncSessionLocal() as session:
-            # Route for forwarding
-            session.add(MessageRoute(
-                user_id=user.id,
-                admin_message_id=fwd.message_id,
-                user_message_id=message.message_id
-            ))
-            # Route for card
-            session.add(MessageRoute(
-                user_id=user.id,
-                admin_message_id=card.message_id,
-                user_message_id=message.message_id
-            ))
-            await session.commit()
-            
+        with outbound_priority(Priority.CARD):
+            card = await bot.send_message(settings.ADMIN_ID, info_text, reply_to_message_id=admin_message_id)
+        route_index.add(user.id, card.message_id, user_message_id)
     except Exception as e:
-        # Admin might have blocked bot
-        print(f"Error forwarding: {e}")
+        logger.warning("Info card for %s failed: %s", user.id, e)
 
 # ---------- Admin Reply (Admin -> User) ----------
-async def handle_admin_reply(message: Message):
+async def handle_admin_reply(message: Message, session: AsyncSession):
     # Check if reply is to a routed message
-    user_id = await get_reply_target_id(message)
+    user_id = await get_reply_target_id(message, session)
         
     if not user_id:
         await message.answer("⚠️ Route not found. Cannot reply to this message.")
         return
         
-    # Send back to user
-    try:
+    # Send back to user, from the outbox
+    outbox.enqueue(
+        "reply", f"reply:{message.message_id}", f"out:{user_id}",
+        {"user_id": user_id, "message_id": message.message_id},
+    )
+
+async def deliver_reply(payload: dict):
+    # Replies jump ahead of queued forwards and info cards
+    with outbound_priority(Priority.REPLY):
         # We use copy_message to preserve content type (text/photo/etc)
-        await message.copy_to(chat_id=user_id)
-        
-        # Confirm Reply (Thumps Up) if enabled
-        async with AsyncSessionLocal() as session:
-            res = await session.execute(select(Setting).where(Setting.key == "confirm_reply"))
-            setting = res.scalar_one_or_none()
-            if setting and setting.value == "true":
-                 await message.react([ReactionTypeEmoji(emoji="👍")])
-            
-    except Exception as e:
-        await message.reply(f"❌ Failed to reach user: {e}")
+        await bot.copy_message(payload["user_id"], settings.ADMIN_ID, payload["message_id"])
+    # Confirm Reply (Thumps Up) if enabled
+    if await get_setting("confirm_reply") == "true":
+        try:
+            with outbound_priority(Priority.REPLY):
+                await bot.set_message_reaction(settings.ADMIN_ID, payload["message_id"],
+                                               [ReactionTypeEmoji(emoji="👍")])
+        except Exception as e:
+            logger.warning("Reply reaction failed: %s", e)
+
+async def reply_failed(payload: dict, error: Exception):
+    if isinstance(error, TelegramForbiddenError):
+        await mark_blocked([payload["user_id"]])
+    await bot.send_message(settings.ADMIN_ID, f"❌ Failed to reach user: {error}",
+                           reply_to_message_id=payload["message_id"])
 
+outbox.register("forward", deliver_forward)
+outbox.register("album", deliver_album)
+outbox.register("reply", deliver_reply, on_dead=reply_failed)
@@ -0,0 +1,303 @@
+"""
+Keyword filter over the bad_words table.
+
+Spam word lists run to tens of thousands of entries, too many for one
+alternation in a Rule. The literal words are matched with an Aho–Corasick
+automaton instead: one pass over the message, a few dict lookups per
+character, however many words there are. Words and messages are compared
+after NFKC normalization and case folding (so "ＷｅＣｈａｔ" finds "wechat"),
+with invisible characters removed. Regex words are compiled as written, so
+they ignore case and are searched in the normalized text and, if that
+differs, in the message as sent: a pattern with characters NFKC changes
+still matches the original.
+
+The automaton can't be changed in place, so changes go into a second,
+small automaton (added words) and a set of removed words that are skipped
+when the big one reports them. Once the changes pile up the big one is
+rebuilt in a thread with everything folded in.
+"""
+import asyncio
+import json
+import logging
+import re
+import time
+import unicodedata
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from app.database.core import AsyncSessionLocal
+from app.database.models import BadWord
+from app.metrics import Counter
+
+keyword_matches = Counter("relaycat_keyword_matches_total", "Messages that contained a bad word.")
+
+logger = logging.getLogger(__name__)
+
+# Zero-width and other invisible characters spammers put inside words
+_INVISIBLE = re.compile("[\u00ad\u034f\u061c\u115f\u1160\u17b4\u17b5\u180b-\u180f\u200b-\u200f"
+                        "\u202a-\u202e\u2060-\u206f\u3164\ufe00-\ufe0f\ufeff\uffa0]")
+_SHIFT = 21  # bits of a code point; transitions are keyed state << 21 | ord(char)
+
+MERGE_MIN = 1000  # pending changes before the big automaton is rebuilt...
+MERGE_RATIO = 0.1  # ...or this share of its words, whichever is larger
+
+
+def normalize(text: str) -> str:
+    return _INVISIBLE.sub("", unicodedata.normalize("NFKC", unicodedata.normalize("NFKC", text).casefold()))
+
+
+class Automaton:
+    """Aho–Corasick automaton over already normalized words. Immutable once built."""
+
+    def __init__(self, words):
+        goto: dict[int, int] = {}
+        word_at: list = [None]  # state -> the word ending there
+        children: list = [[]]  # state -> [(char code, state)], only while building
+        for word in words:
+            state = 0
+            for ch in word:
+                key = state << _SHIFT | ord(ch)
+                child = goto.get(key)
+                if child is None:
+                    child = len(word_at)
+                    goto[key] = child
+                    word_at.append(None)
+                    children.append([])
+                    children[state].append((ord(ch), child))
+                state = child
+            if state:
+                word_at[state] = word
+
+        # Breadth first: fail[s] is the longest proper suffix of s that is
+        # also a state, out[s] the longest of those that ends a word
+        fail = [0] * len(word_at)
+        out = [0] * len(word_at)
+        queue = [child for _, child in children[0]]
+        for state in queue:
+            for code, child in children[state]:
+                f = fail[state]
+                while f and (f << _SHIFT | code) not in goto:
+                    f = fail[f]
+                target = goto.get(f << _SHIFT | code, 0)
+                fail[child] = target
+                out[child] = target if word_at[target] is not None else out[target]
+                queue.append(child)
+
+        self.goto = goto
+        self.fail = fail
+        self.out = out
+        self.word_at = word_at
+        self.size = sum(1 for word in word_at if word is not None)
+
+    def find_all(self, text: str):
+        """Every word occurrence in text (normalized), in order of where it ends."""
+        goto, fail, out, word_at = self.goto, self.fail, self.out, self.word_at
+        state = 0
+        for ch in text:
+            code = ord(ch)
+            while True:
+                child = goto.get(state << _SHIFT | code)
+                if child is not None:
+                    state = child
+                    break
+                if not state:
+                    break
+                state = fail[state]
+            found = state if word_at[state] is not None else out[state]
+            while found:
+                yield word_at[found]
+                found = out[found]
+
+
+class KeywordFilter:
+    """
+    The bad words, ready for matching. Loaded on first use, call add() and
+    remove() with the changed rows after writing them, or reload().
+    """
+
+    def __init__(self):
+        self.words: dict[str, int] = {}  # normalized literal word -> rows that normalize to it
+        self.regexes: dict[str, re.Pattern] = {}  # pattern -> compiled, case-insensitive
+        self._base = Automaton(())
+        self._base_words: frozenset = frozenset()
+        self._added = Automaton(())
+        # Changes since the big automaton was built
+        self._pending_added: set = set()
+        self._pending_removed: set = set()
+        self._loaded = False
+        self._lock = asyncio.Lock()
+        self._merge_task: asyncio.Task | None = None
+        self.merges = 0
+
+    def stats(self) -> dict:
+        return {
+            "words": len(self.words),
+            "regexes": len(self.regexes),
+            "states": len(self._base.word_at) + len(self._added.word_at),
+            "pending_added": len(self._pending_added),
+            "pending_removed": len(self._pending_removed),
+            "merges": self.merges,
+        }
+
+    async def load(self, session: AsyncSession | None = None):
+        """
+        Reads the table unless that was done already. Updates pass their own
+        session: while they wait for the lock they hold a connection, and
+        enough of them would leave none for a load in a new session.
+        """
+        if self._loaded:
+            return
+        async with self._lock:
+            if not self._loaded:
+                await self._reload(session)
+
+    async def reload(self):
+        """Reads the whole table again, if it was loaded at all."""
+        if not self._loaded:
+            return
+        async with self._lock:
+            await self._reload()
+
+    async def _reload(self, session: AsyncSession | None = None):
+        literal, regexes = {}, {}
+        if session is not None:
+            await self._read(session, literal, regexes)
+        else:
+            async with AsyncSessionLocal() as session:
+                await self._read(session, literal, regexes)
+        start = time.perf_counter()
+        base = await asyncio.to_thread(Automaton, literal)
+        self._base, self._base_words, self.words = base, frozenset(literal), literal
+        self._added = Automaton(())
+        self._pending_added, self._pending_removed = set(), set()
+        self.regexes = regexes
+        self._loaded = True
+        logger.info("Keyword filter loaded %d words and %d regexes in %.2fs.",
+                    len(literal), len(regexes), time.perf_counter() - start)
+
+    async def _read(self, session: AsyncSession, literal: dict, regexes: dict):
+        result = await session.stream(select(BadWord.word, BadWord.is_regex))
+        async for word, is_regex in result:
+            if is_regex:
+                self._compile(word, regexes)
+            elif key := normalize(word):
+                literal[key] = literal.get(key, 0) + 1
+
+    @staticmethod
+    def _compile(pattern: str, into: dict):
+        try:
+            into[pattern] = re.compile(pattern, re.IGNORECASE)
+        except re.error as e:
+            logger.warning("Skipping bad word regex %r: %s", pattern, e)
+
+    def add(self, rows: list[tuple[str, bool]]):
+        """rows: (word, is_regex) that were just inserted."""
+        if not self._loaded:
+            return  # the first load reads them
+        changed = False
+        for word, is_regex in rows:
+            if is_regex:
+                self._compile(word, self.regexes)
+            elif key := normalize(word):
+                count = self.words.get(key, 0)
+                self.words[key] = count + 1
+                if not count:
+                    changed = True
+                    if key in self._base_words:
+                        self._pending_removed.discard(key)
+                    else:
+                        self._pending_added.add(key)
+        if changed:
+            self._changed()
+
+    def remove(self, rows: list[tuple[str, bool]]):
+        """rows: (word, is_regex) that were just deleted."""
+        if not self._loaded:
+            return
+        changed = False
+        for word, is_regex in rows:
+            if is_regex:
+                self.regexes.pop(word, None)
+            elif (count := self.words.get(key := normalize(word))) is not None:
+                if count > 1:
+                    self.words[key] = count - 1
+                    continue
+                del self.words[key]
+                changed = True
+                if key in self._base_words:
+                    self._pending_removed.add(key)
+                else:
+                    self._pending_added.discard(key)
+        if changed:
+            self._changed()
+
+    def _over_limit(self) -> bool:
+        pending = len(self._pending_added) + len(self._pending_removed)
+        return pending > max(MERGE_MIN, MERGE_RATIO * len(self._base_words))
+
+    def _changed(self):
+        if self._over_limit():
+            # Too big to rebuild here; until the merge is done the small
+            # automaton stays as it was (removed words are still skipped)
+            if self._merge_task is None or self._merge_task.done():
+                self._merge_task = asyncio.create_task(self._merge())
+            return
+        # Small on purpose, so rebuilding it on every change is cheap
+        self._added = Automaton(self._pending_added)
+
+    async def _merge(self):
+        while True:
+            snapshot = frozenset(self.words)
+            base = await asyncio.to_thread(Automaton, snapshot)
+            self._base, self._base_words = base, snapshot
+            self.merges += 1
+            # Changes made while it was building stay pending
+            self._pending_added = self.words.keys() - snapshot
+            self._pending_removed = snapshot - self.words.keys()
+            if not self._over_limit():
+                self._added = Automaton(self._pending_added)
+                return
+
+    def find(self, text: str) -> str | None:
+        """The first bad word (or regex) in text, or None."""
+        if not self.words and not self.regexes:
+            return None
+        original, text = text, normalize(text)
+        words = self.words
+        for word in self._base.find_all(text):
+            if word in words:
+                return word
+        for word in self._added.find_all(text):
+            if word in words:
+                return word
+        for pattern, regex in self.regexes.items():
+            if regex.search(text) or (original != text and regex.search(original)):
+                return pattern
+        return None
+
+    async def match(self, text: str, session: AsyncSession | None = None) -> str | None:
+        await self.load(session)
+        word = self.find(text)
+        if word is not None:
+            keyword_matches.inc()
+        return word
+
+
+def event_payload(added: list[tuple[str, bool]] = (), removed: list[tuple[str, bool]] = ()) -> str:
+    """What other processes need to apply a change; big changes just make them reload."""
+    if len(added) + len(removed) > MERGE_MIN:
+        return "reload"
+    return json.dumps({"add": list(added), "remove": list(removed)}, ensure_ascii=False)
+
+
+async def apply_event(payload: str):
+    if payload == "reload":
+        await keyword_filter.reload()
+        return
+    change = json.loads(payload)
+    keyword_filter.add([tuple(row) for row in change["add"]])
+    keyword_filter.remove([tuple(row) for row in change["remove"]])
+
+
+keyword_filter = KeywordFilter()
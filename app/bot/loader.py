@@ -1,13 +1,41 @@
 from aiogram import Bot, Dispatcher
 from aiogram.enums import ParseMode
 from aiogram.client.default import DefaultBotProperties
+from aiogram.types import BotCommand
 from app.settings import settings
+from app.bot.outbound import outbound
+from app.metrics import install_bot_metrics
+from app.bot.flood import flood_guard
+from app.bot.unit_of_work import unit_of_work
 
 # Initialize Bot
 bot = Bot(token=settings.BOT_TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
+# Every outgoing API call goes through the rate limiter / 429 handler
+bot.session.middleware(outbound)
 
 # Initialize Dispatcher
 dp = Dispatcher()
 
+# Handler, update and Telegram API timings for /metrics
+install_bot_metrics(dp, bot)
+
+# One database session per update, committed once after the handler
+dp.update.outer_middleware(unit_of_work)
+
+# Drops updates from banned and flooding users before any handler runs
+flood_guard.bot = bot
+dp.message.outer_middleware(flood_guard)
+dp.callback_query.outer_middleware(flood_guard)
+
 # Store bot instance in context for webhook access if needed
 # (FastAPI will access 'bot' directly)
+
+
+async def setup_bot_commands():
+    commands = [
+        BotCommand(command="start", description="Start interaction"),
+        BotCommand(command="ban", description="[Admin] Ban user"),
+        BotCommand(command="unban", description="[Admin] Unban user"),
+        BotCommand(command="broadcast", description="[Admin] Message all verified users"),
+    ]
+    await bot.set_my_commands(commands)
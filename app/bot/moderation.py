@@ -0,0 +1,27 @@
+from sqlalchemy import update
+
+from app.database.core import AsyncSessionLocal
+from app.database.models import User
+from app.database.cache import evict_user
+from app.database.events import events
+from app.bot.flood import flood_guard
+
+
+async def set_banned(user_ids: list[int], banned: bool) -> int:
+    """
+    Bans or unbans users with one UPDATE, then updates this process' caches
+    and tells the other processes. Returns the number of users changed.
+    """
+    if not user_ids:
+        return 0
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(update(User).where(User.id.in_(user_ids)).values(is_banned=banned))
+        await session.commit()
+    for user_id in user_ids:
+        evict_user(user_id)
+        if banned:
+            flood_guard.ban(user_id)
+        else:
+            flood_guard.unban(user_id)
+    await events.publish("ban" if banned else "unban", ",".join(map(str, user_ids)))
+    return result.rowcount or 0
@@ -0,0 +1,216 @@
+import asyncio
+import heapq
+import logging
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from enum import IntEnum
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+
+from app.settings import settings
+
+logger = logging.getLogger(__name__)
+
+
+class Priority(IntEnum):
+    """Lower goes first when the global rate limit is the bottleneck."""
+    REPLY = 0     # admin -> user
+    NORMAL = 1    # everything not tagged otherwise
+    FORWARD = 2   # user -> admin
+    CARD = 3      # info cards
+    BULK = 4      # broadcasts and other background sends
+
+
+_priority: ContextVar[Priority] = ContextVar("outbound_priority", default=Priority.NORMAL)
+
+
+@contextmanager
+def outbound_priority(priority: Priority):
+    """Tags every Telegram call made inside the block with `priority`."""
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now: float) -> float:
+        """Seconds until one token is available."""
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self, now: float):
+        self._refill(now)
+        self.tokens -= 1
+
+
+class ChatSlots:
+    """
+    Per-chat limiter. Each call reserves the next free slot for its chat
+    (virtual scheduling), so callers for the same chat queue up in order
+    and only sleep for as long as they have to. A 429 pauses the chat
+    until its retry_after is over, with no burst tolerance taken off.
+    """
+
+    def __init__(self, rate: float, burst: int):
+        self.interval = 1 / rate
+        self.burst = burst
+        self.tolerance = self.interval * max(burst - 1, 0)
+        self._next: dict[int, float] = {}
+        self._paused: dict[int, float] = {}  # chat id -> end of its flood wait
+
+    def reserve(self, chat_id: int, now: float) -> float:
+        tat = max(self._next.get(chat_id, now), now)
+        self._next[chat_id] = tat + self.interval
+        if len(self._next) > 50000:
+            self._prune(now)
+        return max(0.0, tat - self.tolerance - now)
+
+    def pause(self, chat_id: int, until: float):
+        self._paused[chat_id] = max(self._paused.get(chat_id, 0.0), until)
+        self._next[chat_id] = max(self._next.get(chat_id, 0.0), until)
+
+    def paused(self, chat_id: int, now: float) -> float:
+        """Seconds left of the chat's flood wait."""
+        until = self._paused.get(chat_id)
+        if until is None:
+            return 0.0
+        if until <= now:
+            del self._paused[chat_id]
+            return 0.0
+        return until - now
+
+    def _prune(self, now: float):
+        self._next = {k: v for k, v in self._next.items() if v > now}
+        self._paused = {k: v for k, v in self._paused.items() if v > now}
+
+
+class OutboundScheduler(BaseRequestMiddleware):
+    """
+    Request middleware on the Bot session: every Telegram call that targets
+    a chat waits for its per-chat slot, then for a global token handed out
+    in priority order. 429s are retried after `retry_after` seconds.
+    Calls without a chat_id (getUpdates, setWebhook, answerCallbackQuery...)
+    pass straight through.
+    """
+
+    def __init__(self, global_rate: float, chat_rate: float, chat_burst: int, max_retries: int = 3):
+        # No burst: calls are at least 1/rate apart, so no second ever
+        # holds more than `rate` of them, not even after an idle period
+        self.global_bucket = TokenBucket(global_rate, 1.0)
+        self.chats = ChatSlots(chat_rate, chat_burst)
+        self.max_retries = max_retries
+        self._waiters: list = []  # heap of (priority, seq, future)
+        self._seq = 0
+        self._pump_task: asyncio.Task | None = None
+        self.depth = {p: 0 for p in Priority}
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+        self.waits: deque = deque(maxlen=5000)  # (priority, seconds waited)
+
+    def share(self, processes: int):
+        """
+        Splits the limits between `processes` bot processes using the same
+        token (multi-process mode), each enforcing its part locally.
+        """
+        rate = self.global_bucket.rate / processes
+        self.global_bucket = TokenBucket(rate, 1.0)
+        self.chats = ChatSlots(1 / (self.chats.interval * processes), self.chats.burst)
+
+    async def __call__(self, make_request, bot, method):
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None:
+            return await make_request(bot, method)
+
+        priority = _priority.get()
+        for attempt in range(self.max_retries + 1):
+            await self._acquire(chat_id, priority)
+            try:
+                result = await make_request(bot, method)
+                self.sent += 1
+                return result
+            except TelegramRetryAfter as e:
+                self.chats.pause(chat_id, time.monotonic() + e.retry_after)
+                if attempt == self.max_retries:
+                    self.failed += 1
+                    raise
+                self.retried += 1
+                logger.warning("Flood limit on %s in chat %s, retrying in %ss.",
+                               type(method).__name__, chat_id, e.retry_after)
+            except Exception:
+                self.failed += 1
+                raise
+
+    async def _acquire(self, chat_id, priority: Priority):
+        start = time.monotonic()
+        self.depth[priority] += 1
+        try:
+            delay = self.chats.reserve(chat_id, start)
+            if delay:
+                await asyncio.sleep(delay)
+            # A 429 in this chat (ours or one that came in while we slept)
+            # is waited out in full
+            while wait := self.chats.paused(chat_id, time.monotonic()):
+                await asyncio.sleep(wait)
+
+            future = asyncio.get_running_loop().create_future()
+            self._seq += 1
+            heapq.heappush(self._waiters, (priority, self._seq, future))
+            if self._pump_task is None or self._pump_task.done():
+                self._pump_task = asyncio.create_task(self._pump())
+            await future
+        finally:
+            self.depth[priority] -= 1
+        self.waits.append((priority, time.monotonic() - start))
+
+    async def _pump(self):
+        # Hands out global tokens, highest priority waiter first
+        while self._waiters:
+            delay = self.global_bucket.delay(time.monotonic())
+            if delay:
+                await asyncio.sleep(delay)
+                continue
+            _, _, future = heapq.heappop(self._waiters)
+            if future.done():  # caller gave up (cancelled)
+                continue
+            self.global_bucket.take(time.monotonic())
+            future.set_result(None)
+
+    def stats(self) -> dict:
+        lanes = {}
+        for p in Priority:
+            waited = [w for prio, w in self.waits if prio == p]
+            lanes[p.name.lower()] = {
+                "queued": self.depth[p],
+                "avg_wait_ms": round(sum(waited) / len(waited) * 1000, 2) if waited else 0.0,
+                "max_wait_ms": round(max(waited) * 1000, 2) if waited else 0.0,
+            }
+        return {
+            "sent": self.sent,
+            "retried": self.retried,
+            "failed": self.failed,
+            "lanes": lanes,
+        }
+
+
+outbound = OutboundScheduler(
+    settings.OUTBOUND_GLOBAL_RATE,
+    settings.OUTBOUND_CHAT_RATE,
+    settings.OUTBOUND_CHAT_BURST,
+    settings.OUTBOUND_MAX_RETRIES,
+)
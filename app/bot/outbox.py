@@ -0,0 +1,346 @@
+import asyncio
+import json
+import logging
+import random
+import time
+from datetime import datetime, timedelta
+
+from aiogram.exceptions import (
+    TelegramBadRequest, TelegramEntityTooLarge, TelegramForbiddenError, TelegramNotFound,
+)
+from sqlalchemy import delete, func, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+from sqlalchemy.orm import aliased
+
+from app.settings import settings
+from app.database.core import AsyncSessionLocal, insert_ignore
+from app.database.models import OutboxItem
+from app.metrics import Counter
+
+logger = logging.getLogger(__name__)
+
+outbox_deliveries = Counter("relaycat_outbox_deliveries_total", "Outbox delivery attempts, by kind and result.",
+                            ("kind", "result"))
+
+PENDING, SENDING, DONE, DEAD = "pending", "sending", "done", "dead"
+ACTIVE = (PENDING, SENDING)
+# Telegram won't accept these however often we ask
+PERMANENT_ERRORS = (TelegramBadRequest, TelegramNotFound, TelegramForbiddenError, TelegramEntityTooLarge)
+
+
+class Outbox:
+    """
+    Forwards and replies, delivered from a table instead of inside the handler.
+
+    A handler enqueue()s what should be sent and returns. Delivery tasks
+    (`concurrency` per process) claim due items and call the function
+    registered for the item's kind. Failures are retried with exponential
+    backoff; errors retrying can't fix (blocked, message deleted, ...) and
+    items out of attempts become dead letters, which the web panel lists
+    and can retry.
+
+    The table is written in rounds, one transaction each: the items
+    enqueued since the last round (like RouteWriter, a process that dies
+    loses the last few ms of them), the outcome of the deliveries that
+    finished, and the claim of the next due items, all with a statement
+    per batch rather than per item. Under load a round covers many
+    messages, so there is no commit per message.
+
+    Items of one lane (a user's messages to the admin, or the admin's
+    replies to one user) go out in order: an item is only claimed when no
+    older item of its lane is still pending. Claims expire after `lease`
+    seconds, so the items of a process that died are picked up by the
+    others (or after the restart); the claims of items still waiting in
+    this process (in the rate limiter, or on a retry_after) are renewed.
+    Delivery is at least once: a process killed right after Telegram
+    accepted an item sends it again.
+
+    Every item has an idempotency key (e.g. the message it relays), the
+    same update handled twice still makes a single item.
+    """
+
+    def __init__(self, concurrency: int, max_attempts: int, backoff_base: float, backoff_max: float,
+                 keep: float, lease: float = 120, poll_interval: float = 1):
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.keep = keep  # seconds delivered items stay in the table
+        self.lease = lease
+        self.poll_interval = poll_interval
+        self._kinds: dict[str, tuple] = {}
+        self._queued: dict[str, dict] = {}  # idempotency key -> row, not written yet
+        self._writing = 0  # queued rows the current round is writing
+        self._done: list[int] = []  # delivered, not written yet
+        self._failed: list[tuple[int, dict]] = []  # (item id, new values), not written yet
+        self._local: dict[int, float] = {}  # item id -> monotonic end of our claim
+        self._inflight: set[asyncio.Task] = set()
+        self._wake = asyncio.Event()
+        self._closing = False
+        self._task: asyncio.Task | None = None
+        self._last_purge = 0.0
+        self.delivered = 0
+        self.retried = 0
+        self.dead = 0
+        self.duplicates = 0
+
+    def register(self, kind: str, deliver, on_dead=None):
+        """deliver(payload) sends one item; on_dead(payload, error) runs when it is given up on."""
+        self._kinds[kind] = (deliver, on_dead)
+
+    def enqueue(self, kind: str, key: str, lane: str, payload: dict) -> bool:
+        """
+        Queues an item for delivery, it is written with the next round.
+        False if an item with this key is already queued; one already in
+        the table is skipped when the round writes it.
+        """
+        if key in self._queued:
+            self.duplicates += 1
+            return False
+        now = datetime.utcnow()
+        self._queued[key] = {
+            "kind": kind,
+            "idempotency_key": key,
+            "lane": lane,
+            "payload": json.dumps(payload),
+            "status": PENDING,
+            "attempts": 0,
+            "next_attempt_at": now,
+            "created_at": now,
+            "updated_at": now,
+        }
+        self._wake.set()
+        return True
+
+    @property
+    def queued(self) -> int:
+        return len(self._queued) + self._writing
+
+    def stats(self) -> dict:
+        return {
+            "queued": self.queued,
+            "inflight": len(self._inflight),
+            "delivered": self.delivered,
+            "retried": self.retried,
+            "dead": self.dead,
+            "duplicates": self.duplicates,
+        }
+
+    # ---- panel ----
+
+    async def counts(self) -> dict:
+        async with AsyncSessionLocal() as session:
+            result = await session.execute(select(OutboxItem.status, func.count()).group_by(OutboxItem.status))
+            return {PENDING: 0, SENDING: 0, DONE: 0, DEAD: 0, **dict(result.all())}
+
+    async def items(self, statuses: tuple, limit: int = 100) -> list[OutboxItem]:
+        async with AsyncSessionLocal() as session:
+            result = await session.execute(
+                select(OutboxItem).where(OutboxItem.status.in_(statuses)).order_by(OutboxItem.id).limit(limit)
+            )
+            return result.scalars().all()
+
+    async def retry(self, item_ids: list[int] | None = None) -> int:
+        """Dead letters (or waiting retries) back to pending, due now. None = every dead letter."""
+        query = update(OutboxItem).where(OutboxItem.status.in_((PENDING, DEAD) if item_ids else (DEAD,)))
+        if item_ids:
+            query = query.where(OutboxItem.id.in_(item_ids))
+        async with AsyncSessionLocal() as session:
+            result = await session.execute(
+                query.values(status=PENDING, attempts=0, next_attempt_at=datetime.utcnow())
+            )
+            await session.commit()
+        self._wake.set()
+        return result.rowcount or 0
+
+    async def discard(self, item_ids: list[int]) -> int:
+        async with AsyncSessionLocal() as session:
+            result = await session.execute(
+                delete(OutboxItem).where(OutboxItem.id.in_(item_ids), OutboxItem.status.in_((PENDING, DEAD)))
+            )
+            await session.commit()
+        return result.rowcount or 0
+
+    # ---- delivery ----
+
+    def start(self):
+        if self._task is None:
+            self._closing = False
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self, timeout: float = 10):
+        """
+        Lets deliveries in flight finish (up to `timeout`), the rest is
+        picked up after the restart, and writes what is still queued.
+        """
+        if not self._task:
+            return
+        self._closing = True
+        self._wake.set()
+        await self._task
+        self._task = None
+        if self._inflight:
+            await asyncio.wait(self._inflight, timeout=timeout)
+            for task in self._inflight:
+                task.cancel()
+            await asyncio.gather(*self._inflight, return_exceptions=True)
+        try:
+            await self._round(claim=False)
+        except Exception as e:
+            logger.error("Outbox failed to write %d queued items: %s", len(self._queued), e)
+
+    async def _run(self):
+        while not self._closing:
+            self._wake.clear()
+            try:
+                await self._round()
+                if time.monotonic() - self._last_purge > 600:
+                    self._last_purge = time.monotonic()
+                    await self._purge()
+            except Exception as e:
+                logger.error("Outbox failed: %s", e)
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def _finished(self, task: asyncio.Task):
+        self._inflight.discard(task)
+        self._wake.set()  # a slot is free and the next item of its lane may be due
+
+    async def _round(self, claim: bool = True):
+        """One transaction: queued items, finished deliveries, renewed and new claims."""
+        queued, self._queued = self._queued, {}
+        done, self._done = self._done, []
+        failed, self._failed = self._failed, []
+        written = done + [item_id for item_id, _ in failed]
+        now = time.monotonic()
+        renew = [item_id for item_id, ends in self._local.items() if ends - now < self.lease / 2]
+        renew = list(set(renew) - set(written))
+        free = self.concurrency - len(self._inflight) if claim else 0
+        self._writing = len(queued)
+        try:
+            async with AsyncSessionLocal() as session:
+                if queued:
+                    conn = await session.connection()
+                    result = await conn.execute(insert_ignore(OutboxItem, "idempotency_key"), list(queued.values()))
+                    if result.rowcount >= 0:  # not every driver counts executemany rows
+                        self.duplicates += len(queued) - result.rowcount
+                if done:
+                    await session.execute(
+                        update(OutboxItem).where(OutboxItem.id.in_(done)).values(status=DONE, last_error=None)
+                        .execution_options(synchronize_session=False)
+                    )
+                for item_id, values in failed:
+                    await session.execute(
+                        update(OutboxItem).where(OutboxItem.id == item_id).values(**values)
+                        .execution_options(synchronize_session=False)
+                    )
+                if renew:
+                    await session.execute(
+                        update(OutboxItem).where(OutboxItem.id.in_(renew), OutboxItem.status == SENDING)
+                        .values(next_attempt_at=datetime.utcnow() + timedelta(seconds=self.lease))
+                        .execution_options(synchronize_session=False)
+                    )
+                claimed = await self._claim(session, free) if free > 0 else []
+                await session.commit()
+        except Exception:
+            # Everything goes again with the next round (queued behind anything newer)
+            self._queued = {**queued, **self._queued}
+            self._done[:0] = done
+            self._failed[:0] = failed
+            raise
+        finally:
+            self._writing = 0
+        for item_id in written:
+            self._local.pop(item_id, None)
+        for item_id in renew:
+            self._local[item_id] = now + self.lease
+        for item in claimed:
+            self._local[item.id] = now + self.lease
+            task = asyncio.create_task(self._deliver(item))
+            self._inflight.add(task)
+            task.add_done_callback(self._finished)
+
+    async def _claim(self, session: AsyncSession, limit: int) -> list[OutboxItem]:
+        now = datetime.utcnow()
+        older = aliased(OutboxItem)
+        lane_busy = (
+            select(older.id)
+            .where(older.lane == OutboxItem.lane, older.id < OutboxItem.id, older.status.in_(ACTIVE))
+            .exists()
+        )
+        query = select(OutboxItem).where(OutboxItem.status.in_(ACTIVE), OutboxItem.next_attempt_at <= now, ~lane_busy)
+        if self._local:
+            # Still ours: an expired claim here only means it waited long
+            query = query.where(OutboxItem.id.notin_(self._local))
+        items = (await session.execute(query.order_by(OutboxItem.id).limit(limit))).scalars().all()
+        if not items:
+            return []
+        for item in items:
+            session.expunge(item)
+        ids = [item.id for item in items]
+        # The claim's expiry doubles as its marker, to tell our items from
+        # those another process claimed in between
+        lease_until = now + timedelta(seconds=self.lease)
+        taken = await session.execute(
+            update(OutboxItem)
+            .where(OutboxItem.id.in_(ids), OutboxItem.status.in_(ACTIVE), OutboxItem.next_attempt_at <= now)
+            .values(status=SENDING, next_attempt_at=lease_until, attempts=OutboxItem.attempts + 1)
+            .execution_options(synchronize_session=False)
+        )
+        if taken.rowcount != len(ids):
+            result = await session.execute(
+                select(OutboxItem.id)
+                .where(OutboxItem.id.in_(ids), OutboxItem.status == SENDING, OutboxItem.next_attempt_at == lease_until)
+            )
+            mine = set(result.scalars().all())
+            items = [item for item in items if item.id in mine]
+        for item in items:
+            item.attempts += 1
+        return items
+
+    async def _deliver(self, item: OutboxItem):
+        deliver, on_dead = self._kinds[item.kind]
+        payload = json.loads(item.payload)
+        try:
+            await deliver(payload)
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"[:500]
+            if isinstance(e, PERMANENT_ERRORS) or item.attempts >= self.max_attempts:
+                logger.warning("Outbox item %d (%s) is a dead letter after %d attempts: %s",
+                               item.id, item.kind, item.attempts, error)
+                self._failed.append((item.id, {"status": DEAD, "last_error": error}))
+                self.dead += 1
+                outbox_deliveries.inc(item.kind, "dead")
+                if on_dead:
+                    try:
+                        await on_dead(payload, e)
+                    except Exception as e2:
+                        logger.error("Outbox item %d: on_dead failed: %s", item.id, e2)
+                return
+            delay = min(self.backoff_max, self.backoff_base * 2 ** (item.attempts - 1)) * random.uniform(0.5, 1)
+            self._failed.append((item.id, {"status": PENDING, "last_error": error,
+                                           "next_attempt_at": datetime.utcnow() + timedelta(seconds=delay)}))
+            self.retried += 1
+            outbox_deliveries.inc(item.kind, "retry")
+            return
+        self._done.append(item.id)
+        self.delivered += 1
+        outbox_deliveries.inc(item.kind, "delivered")
+
+    async def _purge(self):
+        cutoff = datetime.utcnow() - timedelta(seconds=self.keep)
+        async with AsyncSessionLocal() as session:
+            await session.execute(delete(OutboxItem).where(OutboxItem.status == DONE, OutboxItem.updated_at < cutoff))
+            await session.commit()
+
+
+outbox = Outbox(
+    settings.OUTBOX_CONCURRENCY,
+    settings.OUTBOX_MAX_ATTEMPTS,
+    settings.OUTBOX_BACKOFF_BASE,
+    settings.OUTBOX_BACKOFF_MAX,
+    settings.OUTBOX_KEEP_HOURS * 3600,
+)
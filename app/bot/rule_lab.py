@@ -0,0 +1,249 @@
+"""
+Rule lab: pattern validation and dry runs, away from the event loop.
+
+Python's re can't be interrupted: a catastrophic pattern holds the GIL
+until it is done, in any thread. So whatever runs patterns nobody has
+vetted yet (validation probes, dry runs of proposed rules) runs in a
+forked child process that is killed when it takes too long.
+"""
+import asyncio
+import json
+import logging
+import multiprocessing
+import re
+import time
+from types import SimpleNamespace
+
+from app.settings import settings
+from app.bot.rules import CompiledRules, REGEX_RULE_TYPES
+
+try:
+    from re import _parser as sre_parse, _constants as sre_constants
+except ImportError:  # Python < 3.11
+    import sre_parse, sre_constants
+
+logger = logging.getLogger(__name__)
+
+MAX_MESSAGE_LENGTH = 4096  # Telegram's limit, the longest text a rule ever sees
+PROBE_TIMEOUT = 2.0  # seconds for all probes of one pattern
+MAX_CORPUS = 10000  # messages per dry run
+
+_REPEATS = (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT, sre_constants.POSSESSIVE_REPEAT)
+_CATEGORY_CHARS = {
+    sre_constants.CATEGORY_DIGIT: "1", sre_constants.CATEGORY_NOT_DIGIT: "a",
+    sre_constants.CATEGORY_SPACE: " ", sre_constants.CATEGORY_NOT_SPACE: "a",
+    sre_constants.CATEGORY_WORD: "a", sre_constants.CATEGORY_NOT_WORD: " ",
+}
+
+
+def _children(op, av) -> list:
+    """Sub-pattern token lists of one parsed token."""
+    if op in _REPEATS:
+        return [av[2]]
+    if op == sre_constants.SUBPATTERN:
+        return [av[-1]]
+    if op == sre_constants.BRANCH:
+        return av[1]
+    if op in (sre_constants.ASSERT, sre_constants.ASSERT_NOT):
+        return [av[1]]
+    if op == sre_constants.ATOMIC_GROUP:
+        return [av]
+    if op == sre_constants.GROUPREF_EXISTS:
+        return [branch for branch in av[1:] if branch]
+    return []
+
+
+def nested_quantifier(tokens, inside_unbounded: bool = False) -> bool:
+    """True for a variable repeat inside an unbounded one, like (a+)+ or (\\s*\\w+)*."""
+    for op, av in tokens:
+        if op in _REPEATS:
+            low, high, sub = av
+            if inside_unbounded and low != high:
+                return True
+            if nested_quantifier(sub, inside_unbounded or high == sre_constants.MAXREPEAT):
+                return True
+        else:
+            for sub in _children(op, av):
+                if nested_quantifier(sub, inside_unbounded):
+                    return True
+    return False
+
+
+def _atoms(tokens, found: set):
+    """One representative character for every literal and class in the pattern."""
+    for op, av in tokens:
+        if op == sre_constants.LITERAL:
+            found.add(chr(av))
+        elif op == sre_constants.ANY:
+            found.add("a")
+        elif op == sre_constants.IN:
+            for item_op, item in av:
+                if item_op == sre_constants.LITERAL:
+                    found.add(chr(item))
+                    break
+                if item_op == sre_constants.RANGE:
+                    found.add(chr(item[0]))
+                    break
+                if item_op == sre_constants.CATEGORY and item in _CATEGORY_CHARS:
+                    found.add(_CATEGORY_CHARS[item])
+                    break
+        for sub in _children(op, av):
+            _atoms(sub, found)
+
+
+def probe_inputs(pattern: str) -> list[str]:
+    """
+    Long strings built from the pattern's own characters, with a tail that
+    makes the match fail at the very end: the inputs that make backtracking
+    patterns try every way of splitting the string.
+    """
+    found: set = set()
+    _atoms(sre_parse.parse(pattern), found)
+    atoms = sorted(found)[:8] or ["a"]
+    units = atoms + [a + b for a in atoms for b in atoms if a != b]
+    return [
+        unit * ((MAX_MESSAGE_LENGTH - 1) // len(unit)) + tail
+        for unit in units
+        for tail in ("\x00", "!")
+    ]
+
+
+def _probe(pattern: str) -> float:
+    regex = re.compile(pattern)
+    slowest = 0.0
+    for text in probe_inputs(pattern):
+        start = time.perf_counter()
+        regex.search(text)
+        slowest = max(slowest, time.perf_counter() - start)
+    return slowest
+
+
+def _run_child(conn, fn, args):
+    try:
+        conn.send(("ok", fn(*args)))
+    except Exception as e:
+        conn.send(("error", f"{type(e).__name__}: {e}"))
+    finally:
+        conn.close()
+
+
+def _run_isolated(fn, args: tuple, timeout: float):
+    """fn(*args) in a child process; TimeoutError (and the child killed) after `timeout` seconds."""
+    method = "fork" if "fork" in multiprocessing.get_all_start_methods() else "spawn"
+    ctx = multiprocessing.get_context(method)
+    receiver, sender = ctx.Pipe(duplex=False)
+    process = ctx.Process(target=_run_child, args=(sender, fn, args), daemon=True)
+    process.start()
+    sender.close()
+    try:
+        if not receiver.poll(timeout):
+            raise TimeoutError
+        status, value = receiver.recv()
+    finally:
+        if process.is_alive():
+            process.kill()
+        process.join()
+        receiver.close()
+    if status == "error":
+        raise RuntimeError(value)
+    return value
+
+
+async def run_isolated(fn, args: tuple, timeout: float):
+    return await asyncio.to_thread(_run_isolated, fn, args, timeout)
+
+
+async def validate_pattern(rule_type: str, pattern: str) -> str | None:
+    """Returns why the pattern can't be saved, or None if it is fine."""
+    if not pattern:
+        return "The pattern is empty."
+    if rule_type not in REGEX_RULE_TYPES:
+        return None
+    try:
+        parsed = sre_parse.parse(pattern)
+    except re.error as e:
+        return f"Invalid regex: {e}"
+
+    hint = " It has a nested quantifier like (a+)+, which backtracks exponentially." \
+        if nested_quantifier(parsed) else ""
+    budget_ms = settings.RULE_TIME_BUDGET_MS
+    try:
+        slowest = await run_isolated(_probe, (pattern,), PROBE_TIMEOUT)
+    except TimeoutError:
+        return f"The pattern never finished on a {MAX_MESSAGE_LENGTH}-character test message.{hint}"
+    if slowest * 1000 > budget_ms:
+        return (
+            f"The pattern took {slowest * 1000:.0f} ms on a {MAX_MESSAGE_LENGTH}-character test message, "
+            f"the limit is {budget_ms} ms.{hint or ' A leading or trailing .* is never needed, search() looks everywhere.'}"
+        )
+    return None
+
+
+def parse_corpus(raw: str) -> list[tuple]:
+    """
+    One message per line: plain text, or a JSON object with "text" and
+    optionally "username" and "forwarded". Returns (text, username, forwarded).
+    """
+    corpus = []
+    for line in raw.splitlines():
+        if len(corpus) >= MAX_CORPUS:
+            break
+        if not line.strip():
+            continue
+        if line.lstrip().startswith("{"):
+            try:
+                item = json.loads(line)
+                corpus.append((str(item.get("text") or ""), str(item.get("username") or ""), bool(item.get("forwarded"))))
+                continue
+            except (ValueError, AttributeError):
+                pass
+        corpus.append((line.replace("\\n", "\n"), "", False))
+    return corpus
+
+
+def _dry_run(rules: list[dict], corpus: list[tuple]) -> dict:
+    """Runs in the child: first-match decisions of the whole set, plus every rule on its own."""
+    as_rules = [SimpleNamespace(**rule) for rule in rules]
+    compiled = CompiledRules(as_rules, budget=None)
+
+    decided = {"block": 0, "drop": 0, "allow": 0, "none": 0}
+    first_hits: dict = {}
+    start = time.perf_counter()
+    for text, username, forwarded in corpus:
+        hit = compiled.match(text, username, forwarded)
+        if hit is None:
+            decided["none"] += 1
+        else:
+            decided[hit.action] = decided.get(hit.action, 0) + 1
+            first_hits[hit.rule_id] = first_hits.get(hit.rule_id, 0) + 1
+    set_ms = (time.perf_counter() - start) * 1000
+
+    report = []
+    for rule in as_rules:
+        row = {"id": rule.id, "rule_type": rule.rule_type, "pattern": rule.pattern, "action": rule.action,
+               "matches": 0, "decided": first_hits.get(rule.id, 0), "total_ms": 0.0, "max_ms": 0.0, "error": None}
+        report.append(row)
+        if rule.rule_type not in REGEX_RULE_TYPES:
+            if rule.rule_type == "is_forwarded" and rule.pattern == "true":
+                row["matches"] = sum(1 for _, _, forwarded in corpus if forwarded)
+            continue
+        try:
+            regex = re.compile(rule.pattern)
+        except re.error as e:
+            row["error"] = str(e)
+            continue
+        for text, username, _ in corpus:
+            subject = text if rule.rule_type == "message_content" else username
+            t = time.perf_counter()
+            if regex.search(subject):
+                row["matches"] += 1
+            took = (time.perf_counter() - t) * 1000
+            row["total_ms"] += took
+            row["max_ms"] = max(row["max_ms"], took)
+
+    return {"messages": len(corpus), "decided": decided, "set_ms": set_ms, "rules": report}
+
+
+async def dry_run(rules: list[dict], corpus: list[tuple]) -> dict:
+    """rules: dicts with id, rule_type, pattern, action, in evaluation order."""
+    return await run_isolated(_dry_run, (rules, corpus[:MAX_CORPUS]), settings.RULE_LAB_TIMEOUT)
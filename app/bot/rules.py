@@ -0,0 +1,253 @@
+import asyncio
+import logging
+import re
+import time
+from collections import deque
+from dataclasses import dataclass, field
+
+from sqlalchemy import update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from app.settings import settings
+from app.database.core import AsyncSessionLocal
+from app.database.models import Rule
+from app.database.events import events
+from app.metrics import rule_eval_seconds, rule_matches, Counter
+
+rules_disabled = Counter("relaycat_rules_disabled_total", "Rules disabled for exceeding RULE_TIME_BUDGET_MS.")
+
+logger = logging.getLogger(__name__)
+
+# A rule is "literal" when its pattern is just a list of keywords, like the
+# default (兼职|刷单|日结|...). Those are merged into one trie-shaped
+# alternation: sre can skip a branch on its first character, so one search
+# over the merged trie is much cheaper than a search per rule. Arbitrary
+# regexes don't merge well (sre tries every branch at every position), so
+# they stay compiled on their own.
+_LITERAL_CHAR = r"(?:[^\\()\[\]{}.*+?^$|]|\\[^0-9A-Za-z])"
+_LITERAL_RULE = re.compile(rf"\(?({_LITERAL_CHAR}+(?:\|{_LITERAL_CHAR}+)*)\)?")
+_ESCAPE = re.compile(r"\\(.)")
+
+# Rule types whose pattern is a regex
+REGEX_RULE_TYPES = ("message_content", "username")
+
+
+@dataclass
+class CompiledRule:
+    order: int
+    rule_id: int
+    action: str
+    regex: re.Pattern
+
+
+def _literal_words(pattern: str) -> list | None:
+    m = _LITERAL_RULE.fullmatch(pattern)
+    if not m or pattern.startswith("(") != pattern.endswith(")"):
+        return None
+    return [_ESCAPE.sub(r"\1", word) for word in m.group(1).split("|")]
+
+
+def _trie_regex(words) -> str:
+    trie: dict = {}
+    for word in words:
+        node = trie
+        for ch in word:
+            node = node.setdefault(ch, {})
+        node[""] = True
+
+    def build(node) -> str:
+        alts = [re.escape(ch) + build(child) for ch, child in sorted(node.items()) if ch]
+        if not alts:
+            return ""
+        if len(alts) == 1 and "" not in node:
+            return alts[0]
+        body = "(?:" + "|".join(alts) + ")"
+        return body + "?" if "" in node else body
+
+    return build(trie)
+
+
+@dataclass
+class PatternGroup:
+    """All active rules of one regex-based rule_type, in rule order."""
+    literal: list = field(default_factory=list)  # keyword rules, merged into `trie`
+    trie: re.Pattern | None = None
+    owner: dict = field(default_factory=dict)  # keyword -> first rule containing it
+    standalone: list = field(default_factory=list)  # everything else
+    # Keyword tries run in linear time, arbitrary regexes may not: each
+    # standalone search slower than `budget` seconds is reported in `slow`.
+    # Measured after the search returns: sre holds the GIL and can't be
+    # interrupted, so this can't cut a search short.
+    budget: float | None = None
+    slow: dict = field(default_factory=dict)  # rule_id -> seconds
+
+    def first_match(self, text: str) -> CompiledRule | None:
+        best = None
+        if self.trie is not None:
+            m = self.trie.search(text)
+            if m:
+                best = self.owner[m.group()]
+                # The trie finds the leftmost keyword in the text, not the
+                # lowest rule. Only the rules before it need a second look.
+                for entry in self.literal:
+                    if entry.order >= best.order:
+                        break
+                    if entry.regex.search(text):
+                        best = entry
+                        break
+
+        for entry in self.standalone:
+            if best and entry.order > best.order:
+                break
+            start = time.perf_counter()
+            found = entry.regex.search(text)
+            if self.budget is not None and (took := time.perf_counter() - start) > self.budget:
+                self.slow[entry.rule_id] = took
+            if found:
+                best = entry
+                break
+        return best
+
+
+def _build_group(rules: list, budget: float | None, slow: dict) -> PatternGroup:
+    group = PatternGroup(budget=budget, slow=slow)
+    for order, rule in rules:
+        try:
+            regex = re.compile(rule.pattern)
+        except re.error as e:
+            logger.warning("Skipping rule %s, invalid regex %r: %s", rule.id, rule.pattern, e)
+            continue
+        entry = CompiledRule(order=order, rule_id=rule.id, action=rule.action, regex=regex)
+        words = _literal_words(rule.pattern)
+        if not words:
+            group.standalone.append(entry)
+            continue
+        group.literal.append(entry)
+        for word in words:
+            group.owner.setdefault(word, entry)
+
+    if group.owner:
+        group.trie = re.compile(_trie_regex(group.owner))
+    return group
+
+
+class CompiledRules:
+    def __init__(self, rules: list, budget: float | None = None):
+        by_type: dict[str, list] = {}
+        for order, rule in enumerate(rules):
+            by_type.setdefault(rule.rule_type, []).append((order, rule))
+
+        self.count = len(rules)
+        self.slow: dict[int, float] = {}  # shared by both groups
+        self.content = _build_group(by_type.get("message_content", []), budget, self.slow)
+        self.username = _build_group(by_type.get("username", []), budget, self.slow)
+        self.forwarded = None
+        for order, rule in by_type.get("is_forwarded", []):
+            if rule.pattern == "true":
+                self.forwarded = CompiledRule(order=order, rule_id=rule.id, action=rule.action, regex=None)
+                break
+
+    def match(self, text: str, username: str, is_forwarded: bool) -> CompiledRule | None:
+        """Returns the first rule (in rule order) that matches, or None."""
+        hits = [
+            self.content.first_match(text),
+            self.username.first_match(username),
+            self.forwarded if is_forwarded else None,
+        ]
+        hits = [h for h in hits if h]
+        return min(hits, key=lambda h: h.order) if hits else None
+
+    def drop(self, rule_id: int):
+        """Stops evaluating a rule right away, before the reload catches up."""
+        for group in (self.content, self.username):
+            group.standalone = [entry for entry in group.standalone if entry.rule_id != rule_id]
+
+
+class RuleEngine:
+    """
+    Keeps the active rules compiled in memory.
+    Call invalidate() after any change to the rules table, the next
+    evaluation reloads them with a single query.
+
+    A regex rule that took longer than `budget` seconds on one message is
+    disabled (is_active = False, with the reason in disabled_reason) so it
+    can't slow down every message after that one. This is not a time
+    limit: the slow search itself runs to the end, blocking the event loop
+    meanwhile. Bounding it would take a process per message (sre can't be
+    interrupted from a thread), so the real guard is the ReDoS check when
+    a pattern is saved (app/bot/rule_lab.py); this catches what gets past
+    it.
+
+    The last `samples` evaluated messages are kept in memory as a corpus
+    for dry runs in the rule lab.
+    """
+
+    def __init__(self, budget: float | None = None, samples: int = 0):
+        self.budget = budget
+        self.samples: deque = deque(maxlen=samples or None)
+        self._keep_samples = samples > 0
+        self._compiled: CompiledRules | None = None
+        self._built_generation = -1
+        self._generation = 0
+        self._lock = asyncio.Lock()
+
+    def invalidate(self):
+        self._generation += 1
+
+    async def get(self, session: AsyncSession | None = None) -> CompiledRules:
+        if self._compiled is not None and self._built_generation == self._generation:
+            return self._compiled
+        async with self._lock:
+            if self._compiled is None or self._built_generation != self._generation:
+                generation = self._generation
+                query = select(Rule).where(Rule.is_active == True).order_by(Rule.id)
+                if session is not None:
+                    rules = (await session.execute(query)).scalars().all()
+                else:
+                    async with AsyncSessionLocal() as session:
+                        rules = (await session.execute(query)).scalars().all()
+                self._compiled = CompiledRules(rules, self.budget)
+                self._built_generation = generation
+                logger.info("Rule engine loaded %d active rules.", self._compiled.count)
+        return self._compiled
+
+    async def match(self, text: str, username: str, is_forwarded: bool,
+                    session: AsyncSession | None = None) -> CompiledRule | None:
+        compiled = await self.get(session)
+        start = time.perf_counter()
+        hit = compiled.match(text, username, is_forwarded)
+        rule_eval_seconds.observe(time.perf_counter() - start)
+        if self._keep_samples:
+            self.samples.append((text, username, is_forwarded))
+        if compiled.slow:
+            await self._disable_slow(compiled)
+        if hit:
+            rule_matches.inc(hit.rule_id, hit.action)
+        return hit
+
+    async def _disable_slow(self, compiled: CompiledRules):
+        slow = dict(compiled.slow)
+        compiled.slow.clear()
+        for rule_id, took in slow.items():
+            compiled.drop(rule_id)
+            reason = f"Took {took * 1000:.0f} ms on one message (limit {self.budget * 1000:.0f} ms)"
+            logger.warning("Disabling rule %s: %s.", rule_id, reason)
+            rules_disabled.inc()
+            try:
+                async with AsyncSessionLocal() as session:
+                    await session.execute(
+                        update(Rule).where(Rule.id == rule_id).values(is_active=False, disabled_reason=reason)
+                    )
+                    await session.commit()
+            except Exception as e:
+                logger.error("Failed to disable rule %s: %s", rule_id, e)
+        self.invalidate()
+        await events.publish("rules")
+
+    async def evaluate(self, text: str, username: str, is_forwarded: bool) -> str | None:
+        hit = await self.match(text, username, is_forwarded)
+        return hit.action if hit else None
+
+
+rule_engine = RuleEngine(settings.RULE_TIME_BUDGET_MS / 1000, settings.RULE_LAB_SAMPLES)
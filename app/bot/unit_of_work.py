@@ -0,0 +1,62 @@
+import logging
+
+from aiogram import BaseMiddleware
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.database.core import AsyncSessionLocal
+
+logger = logging.getLogger(__name__)
+
+
+def on_commit(session: AsyncSession, callback):
+    """
+    Runs `callback()` once the update's work is committed, e.g. to evict a
+    cache entry only when the new row is visible to everyone else.
+    Dropped if the update fails and its work is rolled back.
+    """
+    session.info.setdefault("on_commit", []).append(callback)
+
+
+class UnitOfWork(BaseMiddleware):
+    """
+    Outer middleware on dp.update: one database session per update.
+
+    Handlers that take a `session` argument get it, and pass it on to the
+    helpers they call (get_or_create_user, check_rules, get_reply_target_id,
+    ...). Whatever they wrote is committed once, after the
+    handler returned; an exception rolls all of it back. The session only
+    checks out a connection at its first query, so updates that never
+    touch the database (most of them, with the caches warm) cost nothing.
+
+    Writes that must be visible at once, to other processes or the web
+    panel (bans, broadcasts), still commit on their own.
+    """
+
+    def __init__(self):
+        self.commits = 0
+        self.rollbacks = 0
+
+    async def __call__(self, handler, event, data):
+        async with AsyncSessionLocal() as session:
+            data["session"] = session
+            try:
+                result = await handler(event, data)
+                if session.in_transaction():
+                    await session.commit()
+                    self.commits += 1
+            except Exception:
+                if session.in_transaction():
+                    self.rollbacks += 1
+                raise
+        for callback in session.info.get("on_commit", ()):
+            try:
+                callback()
+            except Exception as e:
+                logger.error("on_commit callback failed: %s", e)
+        return result
+
+    def stats(self) -> dict:
+        return {"commits": self.commits, "rollbacks": self.rollbacks}
+
+
+unit_of_work = UnitOfWork()
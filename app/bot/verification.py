@@ -1,30 +1,147 @@
+import base64
+import hashlib
+import hmac
 import random
+import time
+from dataclasses import dataclass
+
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
-from aiogram.utils.keyboard import InlineKeyboardBuilder
+
+from app.settings import settings
 
 EMOJIS = ["🍎", "🍐", "🍊", "🍋", "🍌", "🍉", "🍇", "🍓"]
+OPTIONS = 9  # 3x3 grid
+SIG_BYTES = 12  # 16 characters of base64
+
+
+@dataclass(frozen=True)
+class Layout:
+    target: str
+    options: tuple[str, ...]
+
+
+@dataclass(frozen=True)
+class Challenge:
+    target: str
+    options: tuple[str, ...]
+    markup: InlineKeyboardMarkup
+
+
+class ChallengePool:
+    """
+    Prebuilt verification layouts with signed, expiring callback data.
+
+    Every button carries verify:<epoch>:<slot>:<idx>:<sig>: the `ttl`-second
+    period it was issued in, which of the `size` layouts, which button, and
+    an HMAC of those and the id of the user it was sent to. Checking an
+    answer is one HMAC and a lookup in the layout, no database read and no
+    parsing of the message text, and a button only works for the user who
+    got it. An answer is accepted in its own epoch and the next one, so a
+    challenge stays valid for between `ttl` and twice that.
+
+    The layouts of an epoch are derived from the key, so all processes of a
+    cluster build the same ones. They are built once per epoch; a /start
+    only picks one and signs its nine buttons for the user.
+    """
+
+    def __init__(self, key: bytes, size: int, ttl: int):
+        self.key = key
+        self.size = size
+        self.ttl = ttl
+        self._epochs: dict[int, list[Layout]] = {}
+        self.issued = 0
+        self.passed = 0
+        self.failed = 0
+        self.rejected = 0  # expired, forged, someone else's or malformed
+
+    def epoch(self) -> int:
+        return int(time.time() // self.ttl)
+
+    def challenge(self, user_id: int) -> Challenge:
+        self.issued += 1
+        epoch = self.epoch()
+        slot = random.randrange(self.size)
+        layout = self._layouts(epoch)[slot]
+        buttons = [
+            InlineKeyboardButton(text=emoji, callback_data=self.callback_data(epoch, slot, idx, user_id))
+            for idx, emoji in enumerate(layout.options)
+        ]
+        markup = InlineKeyboardMarkup(inline_keyboard=[buttons[i:i + 3] for i in range(0, OPTIONS, 3)])
+        return Challenge(layout.target, layout.options, markup)
+
+    def check(self, data: str, user_id: int) -> bool | None:
+        """True for the right button, False for a wrong one, None if expired or not this user's."""
+        try:
+            _, epoch, slot, idx, sig = data.split(":")
+            epoch, slot, idx = int(epoch), int(slot), int(idx)
+        except ValueError:
+            self.rejected += 1
+            return None
+        current = self.epoch()
+        if (not hmac.compare_digest(sig, self._sign(epoch, slot, idx, user_id))
+                or not current - 1 <= epoch <= current or slot >= self.size or idx >= OPTIONS):
+            self.rejected += 1
+            return None
+        layout = self._layouts(epoch)[slot]
+        if layout.options[idx] == layout.target:
+            self.passed += 1
+            return True
+        self.failed += 1
+        return False
+
+    def callback_data(self, epoch: int, slot: int, idx: int, user_id: int) -> str:
+        return f"verify:{epoch}:{slot}:{idx}:{self._sign(epoch, slot, idx, user_id)}"
+
+    def _sign(self, epoch: int, slot: int, idx: int, user_id: int) -> str:
+        digest = hmac.new(self.key, f"{epoch}:{slot}:{idx}:{user_id}".encode(), hashlib.sha256).digest()
+        return base64.urlsafe_b64encode(digest[:SIG_BYTES]).decode()
+
+    def _layouts(self, epoch: int) -> list[Layout]:
+        layouts = self._epochs.get(epoch)
+        if layouts is None:
+            layouts = self._build(epoch)
+            oldest = self.epoch() - 1
+            self._epochs = {e: l for e, l in self._epochs.items() if e >= oldest}
+            self._epochs[epoch] = layouts
+        return layouts
+
+    def _build(self, epoch: int) -> list[Layout]:
+        seed = hmac.new(self.key, f"layouts:{epoch}".encode(), hashlib.sha256).digest()
+        rng = random.Random(seed)
+        layouts = []
+        for _ in range(self.size):
+            target = rng.choice(EMOJIS)
+            # Filler may repeat the target, any button showing it is right
+            options = [target] + [rng.choice(EMOJIS) for _ in range(OPTIONS - 1)]
+            rng.shuffle(options)
+            layouts.append(Layout(target, tuple(options)))
+        return layouts
+
+    def stats(self) -> dict:
+        return {
+            "size": self.size,
+            "ttl": self.ttl,
+            "issued": self.issued,
+            "passed": self.passed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+        }
+
+
+def _key() -> bytes:
+    # Without a configured secret, derive one every process of this bot agrees on
+    if settings.VERIFY_SECRET:
+        return settings.VERIFY_SECRET.encode()
+    return hashlib.sha256(b"relaycat-verify:" + settings.BOT_TOKEN.encode()).digest()
+
+
+challenge_pool = ChallengePool(_key(), settings.VERIFY_POOL_SIZE, settings.VERIFY_TTL)
+
 
-def generate_verification_challenge():
+def generate_verification_challenge(user_id: int):
     """
-    Generates a random emoji challenge.
+    Picks a challenge from the pool, signed for `user_id`.
     Returns: (target_emoji, markup)
     """
-    target = random.choice(EMOJIS)
-    
-    # Create a 3x3 grid of random emojis including the target
-    options = [target]
-    while len(options) < 9:
-        e = random.choice(EMOJIS)
-        # Allow duplicates to make it slightly harder? or unique?
-        # Let's keep it simple, just random filler.
-        options.append(e)
-    
-    random.shuffle(options)
-    
-    builder = InlineKeyboardBuilder()
-    for emoji in options:
-        # Callback data format: verify:<emoji>
-        builder.button(text=emoji, callback_data=f"verify:{emoji}")
-    
-    builder.adjust(3)
-    return target, builder.as_markup()
+    challenge = challenge_pool.challenge(user_id)
+    return challenge.target, challenge.markup
@@ -0,0 +1,59 @@
+import hashlib
+import hmac
+import logging
+
+from aiogram.types import Update
+from fastapi import APIRouter, Request, HTTPException, status
+from fastapi.responses import Response
+
+from app.bot.loader import bot, dp
+from app.bot.executor import KeyedExecutor, update_executor
+from app.settings import settings
+
+logger = logging.getLogger(__name__)
+
+
+def webhook_secret() -> str:
+    """
+    WEBHOOK_SECRET, or one derived from the bot token: without a secret
+    anyone who finds the URL could post updates claiming to be the admin.
+    """
+    if settings.WEBHOOK_SECRET:
+        return settings.WEBHOOK_SECRET
+    return hashlib.sha256(b"relaycat-webhook:" + settings.BOT_TOKEN.encode()).hexdigest()
+
+
+def build_router(executor: KeyedExecutor, path: str, secret: str) -> APIRouter:
+    """
+    The endpoint only parses the update and hands it to the executor (or
+    the multi-process UpdateSink), so Telegram gets its 200 as soon as the
+    update is queued, or dropped if its shard is full (see overflow_policy).
+    """
+    if not secret:
+        raise ValueError("The webhook needs a secret token")
+    router = APIRouter()
+
+    @router.post(path)
+    async def telegram_webhook(request: Request):
+        # Telegram echoes the secret_token we registered the webhook with
+        token = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+        if not hmac.compare_digest(token, secret):
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED)
+        update = Update.model_validate(await request.json(), context={"bot": executor.bot})
+        await executor.submit(update)
+        await executor.flush()
+        return Response(status_code=200)
+
+    return router
+
+
+router = build_router(update_executor, settings.WEBHOOK_PATH, webhook_secret())
+
+
+async def setup_webhook():
+    await bot.set_webhook(
+        url=settings.WEBHOOK_URL.rstrip("/") + settings.WEBHOOK_PATH,
+        secret_token=webhook_secret(),
+        allowed_updates=dp.resolve_used_update_types(),
+        drop_pending_updates=True,
+    )
@@ -0,0 +1,316 @@
+"""
+Multi-process mode: the relay on several cores, the web panel on its own.
+
+    python -m app.cluster ingest      the only process talking to Telegram's
+                                      getUpdates (or receiving the webhook)
+    python -m app.cluster worker 3    bot worker for shard 3 of CLUSTER_WORKERS
+    python -m app.main                web panel, as many as you like
+    python -m app.cluster run         all of the above on this machine
+
+The ingest process writes updates to the update_queue table, sharded by
+chat id so every user's updates are handled in order by one worker. Rule
+edits, bans and setting changes reach the other processes through the
+cluster_events table (app.database.events). Nothing but the database is
+shared, no broker needed. Requires RELAYCAT_CLUSTER_WORKERS > 0.
+"""
+import asyncio
+import logging
+import signal
+import subprocess
+import sys
+import time
+
+import uvicorn
+from aiogram.types import Update
+from fastapi import FastAPI
+from sqlalchemy import delete, func, insert
+from sqlalchemy.future import select
+
+from app.settings import settings
+from app.bot.loader import bot, dp, setup_bot_commands
+from app.bot.executor import KeyedExecutor, update_executor, update_key, poll_updates, overflow_policy
+from app.bot.webhook import build_router, setup_webhook, webhook_secret
+from app.bot.outbound import outbound
+from app.bot.rules import rule_engine
+from app.bot.keywords import keyword_filter, apply_event as apply_keyword_event
+from app.bot.flood import flood_guard
+from app.bot.broadcast import broadcaster
+from app.bot.outbox import outbox
+from app.bot.albums import album_buffer
+from app.database.core import init_db, AsyncSessionLocal
+from app.database.models import QueuedUpdate
+from app.database.cache import evict_user, setting_cache
+from app.database.events import events
+from app.database.route_writer import route_writer
+from app.database.user_writer import user_writer
+from app.database.route_index import route_index
+from app.database.maintenance import route_retention
+from app.database.stats import stats
+import app.bot.handlers  # noqa: F401  (registers the handlers)
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def register_invalidations():
+    """What the other processes' events mean for this process' caches."""
+
+    def banned(payload: str):
+        for user_id in map(int, payload.split(",")):
+            evict_user(user_id)
+            flood_guard.ban(user_id)
+
+    def unbanned(payload: str):
+        for user_id in map(int, payload.split(",")):
+            evict_user(user_id)
+            flood_guard.unban(user_id)
+
+    async def settings_changed(payload: str):
+        setting_cache.clear()
+        await flood_guard.load()
+
+    events.on("rules", lambda payload: rule_engine.invalidate())
+    events.on("bad_words", apply_keyword_event)
+    events.on("ban", banned)
+    events.on("unban", unbanned)
+    events.on("settings", settings_changed)
+
+
+class UpdateSink:
+    """
+    Ingest side: stands in for the KeyedExecutor in poll_updates() and the
+    webhook router, but writes the updates to the update_queue table.
+
+    The backlog checked against `max_pending` is counted in the table at
+    most once per `refresh_interval` and only grows with this process'
+    inserts in between. It runs ahead of the workers' deletes for at most
+    that long, never behind, and a flush costs no count of a backed-up
+    queue.
+    """
+
+    def __init__(self, dispatcher, bot, workers: int, max_pending: int, overflow: str):
+        self.dispatcher = dispatcher
+        self.bot = bot
+        self.workers = workers
+        self.max_pending = max_pending
+        self.overflow = overflow
+        self._rows: list[dict] = []
+        self._lock = asyncio.Lock()
+        self.refresh_interval = 1.0
+        self._backlog = 0
+        self._counted_at = float("-inf")
+        self.accepted = 0
+        self.dropped = 0
+
+    async def submit(self, update: Update) -> bool:
+        self._rows.append({
+            "shard": update_key(update) % self.workers,
+            "payload": update.model_dump_json(exclude_none=True),
+        })
+        return True
+
+    async def flush(self):
+        # Concurrent webhook requests wait here until their update is stored
+        async with self._lock:
+            if not self._rows:
+                return
+            while (pending := await self.pending()) >= self.max_pending:
+                if self.overflow == "drop":
+                    self.dropped += len(self._rows)
+                    logger.warning("Update queue full (%d), dropping %d updates.", pending, len(self._rows))
+                    self._rows = []
+                    return
+                await asyncio.sleep(0.5)
+            rows, self._rows = self._rows, []
+            async with AsyncSessionLocal() as session:
+                await session.execute(insert(QueuedUpdate), rows)
+                await session.commit()
+            self._backlog += len(rows)
+            self.accepted += len(rows)
+
+    async def pending(self) -> int:
+        now = time.monotonic()
+        if now - self._counted_at >= self.refresh_interval:
+            async with AsyncSessionLocal() as session:
+                self._backlog = await session.scalar(select(func.count(QueuedUpdate.id))) or 0
+            self._counted_at = now
+        return self._backlog
+
+
+class QueueConsumer:
+    """
+    Worker side: takes this worker's shard from update_queue in id order and
+    runs it on the local KeyedExecutor (per-chat order is kept there too).
+    Rows are deleted once the whole batch is handled, so after a crash a
+    batch may be handled again but never skipped.
+    """
+
+    def __init__(self, shard: int, executor: KeyedExecutor, batch: int, poll_interval: float):
+        self.shard = shard
+        self.executor = executor
+        self.batch = batch
+        self.poll_interval = poll_interval
+        self.handled = 0
+
+    async def run(self):
+        while True:
+            try:
+                taken = await self.take_batch()
+            except Exception as e:
+                logger.error("Worker %d failed to read the update queue: %s", self.shard, e)
+                taken = 0
+            if not taken:
+                await asyncio.sleep(self.poll_interval)
+
+    async def take_batch(self) -> int:
+        async with AsyncSessionLocal() as session:
+            result = await session.execute(
+                select(QueuedUpdate.id, QueuedUpdate.payload)
+                .where(QueuedUpdate.shard == self.shard)
+                .order_by(QueuedUpdate.id)
+                .limit(self.batch)
+            )
+            rows = result.all()
+        if not rows:
+            return 0
+        for _, payload in rows:
+            await self.executor.submit(Update.model_validate_json(payload, context={"bot": self.executor.bot}))
+        await self.executor.drain()
+        async with AsyncSessionLocal() as session:
+            await session.execute(
+                delete(QueuedUpdate).where(QueuedUpdate.shard == self.shard, QueuedUpdate.id <= rows[-1][0])
+            )
+            await session.commit()
+        self.handled += len(rows)
+        return len(rows)
+
+
+async def _until_signalled():
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    await stop.wait()
+
+
+async def _prune_events():
+    while True:
+        await asyncio.sleep(600)
+        try:
+            await events.prune()
+        except Exception as e:
+            logger.error("Event cleanup failed: %s", e)
+
+
+async def run_ingest():
+    workers = settings.CLUSTER_WORKERS
+    await init_db()
+    await stats.load()
+    route_retention.start()
+    pruner = asyncio.create_task(_prune_events())
+    await setup_bot_commands()
+    sink = UpdateSink(dp, bot, workers, settings.CLUSTER_MAX_PENDING, overflow_policy())
+
+    if settings.BOT_MODE == "webhook":
+        app = FastAPI(title="RelayCat ingest")
+        app.include_router(build_router(sink, settings.WEBHOOK_PATH, webhook_secret()))
+        server = uvicorn.Server(uvicorn.Config(app, host="0.0.0.0", port=settings.CLUSTER_INGEST_PORT))
+        receiver = asyncio.create_task(server.serve())
+        await setup_webhook()
+        logger.info("Ingest: webhook on port %d, %d workers.", settings.CLUSTER_INGEST_PORT, workers)
+    else:
+        await bot.delete_webhook(drop_pending_updates=True)
+        receiver = asyncio.create_task(poll_updates(sink))
+        logger.info("Ingest: polling, %d workers.", workers)
+
+    if settings.BOT_MODE == "webhook":
+        await receiver  # uvicorn handles SIGINT/SIGTERM itself
+    else:
+        await _until_signalled()
+        receiver.cancel()
+    pruner.cancel()
+    await sink.flush()
+    await route_retention.stop()
+    await bot.session.close()
+
+
+async def run_worker(shard: int):
+    workers = settings.CLUSTER_WORKERS
+    # Routes are written by the other workers too, don't remember misses for long
+    route_index.missing.ttl = 5
+    outbound.share(workers)
+
+    route_writer.start()
+    user_writer.start()
+    await route_index.warm(settings.ROUTE_INDEX_WARM)
+    stats.start()
+    await flood_guard.load()
+    await keyword_filter.load()
+    register_invalidations()
+    await events.start()
+    update_executor.start()
+    outbox.start()  # every worker delivers, claims keep them apart
+    if shard == 0:
+        broadcaster.start()  # one broadcaster for the whole cluster
+    consumer = asyncio.create_task(
+        QueueConsumer(shard, update_executor, settings.CLUSTER_BATCH, settings.CLUSTER_POLL_MS / 1000).run()
+    )
+    logger.info("Worker %d of %d started.", shard, workers)
+
+    await _until_signalled()
+    consumer.cancel()
+    await update_executor.stop()
+    await album_buffer.stop()
+    await outbox.stop()
+    await broadcaster.stop()
+    await events.stop()
+    await stats.stop()
+    await route_writer.stop()
+    await user_writer.stop()
+    await bot.session.close()
+
+
+def run_all():
+    """Starts ingest, the workers and one web panel as child processes."""
+    asyncio.run(init_db())  # once, before the children race for it
+    commands = [["ingest"]] + [["worker", str(i)] for i in range(settings.CLUSTER_WORKERS)]
+    children = [subprocess.Popen([sys.executable, "-m", "app.cluster", *cmd]) for cmd in commands]
+    children.append(subprocess.Popen([sys.executable, "-m", "app.main"]))
+
+    def terminate(*_):
+        for child in children:
+            if child.poll() is None:
+                child.terminate()
+
+    signal.signal(signal.SIGTERM, terminate)
+    try:
+        # If any of them dies, take the rest down too and let the supervisor restart us
+        while all(child.poll() is None for child in children):
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    terminate()
+    for child in children:
+        child.wait()
+    sys.exit(max(child.returncode or 0 for child in children))
+
+
+def main():
+    if settings.CLUSTER_WORKERS <= 0:
+        sys.exit("Set RELAYCAT_CLUSTER_WORKERS to the number of bot workers first.")
+    command = sys.argv[1] if len(sys.argv) > 1 else "run"
+    if command == "ingest":
+        asyncio.run(run_ingest())
+    elif command == "worker" and len(sys.argv) > 2 and sys.argv[2].isdigit():
+        shard = int(sys.argv[2])
+        if shard >= settings.CLUSTER_WORKERS:
+            sys.exit(f"Worker index must be below {settings.CLUSTER_WORKERS}.")
+        asyncio.run(run_worker(shard))
+    elif command == "run":
+        run_all()
+    else:
+        sys.exit(__doc__)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+import time
+from collections import OrderedDict
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from app.settings import settings
+from app.database.core import AsyncSessionLocal
+from app.database.models import User, Setting
+from app.database.user_writer import user_writer
+
+_MISSING = object()
+_caches: list = []
+
+
+class TTLCache:
+    """
+    Small LRU cache with a per-entry time to live.
+    `None` is a valid cached value (e.g. "this user does not exist"), use
+    `get(key, default)` with a sentinel to tell a miss from a cached None.
+    """
+
+    def __init__(self, name: str, maxsize: int, ttl: float):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        _caches.append(self)
+
+    def get(self, key, default=None):
+        item = self._data.get(key, _MISSING)
+        if item is _MISSING:
+            self.misses += 1
+            return default
+        value, expires_at = item
+        if expires_at < time.monotonic():
+            del self._data[key]
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value, ttl: float | None = None):
+        """`ttl` overrides the cache's time to live for this entry."""
+        self._data[key] = (value, time.monotonic() + (self.ttl if ttl is None else ttl))
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def pop(self, key):
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
+
+
+user_cache = TTLCache("users", settings.USER_CACHE_SIZE, settings.CACHE_TTL)
+setting_cache = TTLCache("settings", 256, settings.CACHE_TTL)
+
+
+async def get_user(user_id: int, session: AsyncSession | None = None) -> User | None:
+    """
+    Read-through lookup. Unknown users are cached too (as None). Uses `session` if given.
+    What user_writer has not written yet is laid over the row, and a read
+    that raced one of its changes is not cached.
+    """
+    user = user_cache.get(user_id, _MISSING)
+    if user is not _MISSING:
+        return user
+    generation = user_writer.generation
+    if session is not None:
+        user = await _load_user(session, user_id)
+    else:
+        async with AsyncSessionLocal() as session:
+            user = await _load_user(session, user_id)
+    user = _pending_user(user_id, user)
+    if user_writer.generation == generation:
+        user_cache.set(user_id, user)
+    return user
+
+
+def _pending_user(user_id: int, user: User | None) -> User | None:
+    row = user_writer.lookup(user_id)
+    if row is not None:
+        user = User(**row)
+    if user is not None and not user.is_verified and user_writer.verifying(user_id):
+        # A copy: flagging the loaded row would write it with the update's session
+        user = User(**{column.key: getattr(user, column.key) for column in User.__table__.columns})
+        user.is_verified = True
+    return user
+
+
+async def _load_user(session: AsyncSession, user_id: int) -> User | None:
+    result = await session.execute(select(User).where(User.id == user_id))
+    return result.scalar_one_or_none()
+
+
+def cache_user(user: User):
+    user_cache.set(user.id, user)
+
+
+def evict_user(user_id: int):
+    user_cache.pop(user_id)
+
+
+async def get_setting(key: str, default: str | None = None, session: AsyncSession | None = None) -> str | None:
+    value = setting_cache.get(key, _MISSING)
+    if value is _MISSING:
+        if session is not None:
+            value = await session.scalar(select(Setting.value).where(Setting.key == key))
+        else:
+            async with AsyncSessionLocal() as session:
+                value = await session.scalar(select(Setting.value).where(Setting.key == key))
+        setting_cache.set(key, value)
+    return default if value is None else value
+
+
+def cache_setting(key: str, value: str | None):
+    setting_cache.set(key, value)
+
+
+def cache_stats() -> dict:
+    return {c.name: c.stats() for c in _caches}
@@ -3,9 +3,14 @@ from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine, async_sess
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.pool import NullPool
 from sqlalchemy.future import select
+from sqlalchemy import inspect, insert
+from sqlalchemy.dialects import postgresql, sqlite
 
 from app.settings import settings
 from app.database.models import Base, Rule
+from app.database.profiles import create_engine
+from app.database.search import install_search_index
+from app.metrics import install_db_metrics
 
 # Configuration
 DATA_DIR = os.getenv("RELAYCAT_DATA_DIR", "./data")
@@ -13,12 +18,47 @@ os.makedirs(DATA_DIR, exist_ok=True)
 
 DB_URL = os.getenv("RELAYCAT_DB_URL", f"sqlite+aiosqlite:///{DATA_DIR}/relaycat.db")
 
-engine = create_async_engine(DB_URL, echo=False)
+engine = create_engine(DB_URL, settings.DB_PROFILE, echo=False)
+install_db_metrics(engine)
 AsyncSessionLocal = async_sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
 
+def insert_ignore(model, key: str):
+    """INSERT that skips rows whose `key` (a unique column) exists, instead of failing the transaction."""
+    if engine.dialect.name == "postgresql":
+        return postgresql.insert(model).on_conflict_do_nothing(index_elements=[key])
+    if engine.dialect.name == "sqlite":
+        return sqlite.insert(model).on_conflict_do_nothing(index_elements=[key])
+    return insert(model).prefix_with("IGNORE", dialect="mysql")
+
+# Indexes from older versions that the current layout replaces
+OBSOLETE_INDEXES = [
+    "ix_message_routes_user_id",  # nothing looks routes up by user
+    "ix_message_routes_admin_message_id",  # prefix of ix_message_routes_admin_user
+]
+
+# Columns added to existing tables since the first version
+ADDED_COLUMNS = [
+    ("users", "is_blocked", "BOOLEAN DEFAULT FALSE"),
+    ("rules", "disabled_reason", "VARCHAR"),
+]
+
+def upgrade_schema(conn):
+    """create_all only creates missing tables, bring columns and indexes of existing ones up to date."""
+    inspector = inspect(conn)
+    for table, column, ddl in ADDED_COLUMNS:
+        if column not in {c["name"] for c in inspector.get_columns(table)}:
+            conn.exec_driver_sql(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}")
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(conn, checkfirst=True)
+    for name in OBSOLETE_INDEXES:
+        conn.exec_driver_sql(f"DROP INDEX IF EXISTS {name}")
+    install_search_index(conn)
+
 async def init_db():
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(upgrade_schema)
     
     # Seed Rules
     async with AsyncSessionLocal() as session:
@@ -0,0 +1,124 @@
+import asyncio
+import logging
+import os
+import socket
+from collections import deque
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, func, insert
+from sqlalchemy.future import select
+
+from app.settings import settings
+from app.database.core import AsyncSessionLocal
+from app.database.models import ClusterEvent
+
+logger = logging.getLogger(__name__)
+
+
+class EventBus:
+    """
+    Cache invalidations between processes, through the cluster_events table.
+
+    Whoever changes shared state updates its own caches as before and then
+    publish()es an event; every other process polls the table and runs the
+    handlers registered for that kind. In single-process mode publish()
+    does nothing.
+    """
+
+    def __init__(self, poll_interval: float, keep: float = 3600):
+        self.poll_interval = poll_interval
+        self.keep = keep  # seconds events stay in the table
+        self.enabled = settings.CLUSTER_WORKERS > 0
+        self.origin = f"{socket.gethostname()}:{os.getpid()}"
+        self._handlers: dict[str, list] = {}
+        self._last_id = 0
+        # Ids are re-read with some overlap: on Postgres a smaller id can
+        # commit after a bigger one was already seen
+        self._seen: set = set()
+        self._seen_order: deque = deque()
+        self._task: asyncio.Task | None = None
+        self.received = 0
+
+    def on(self, kind: str, handler):
+        """handler(payload: str), sync or async."""
+        self._handlers.setdefault(kind, []).append(handler)
+
+    async def publish(self, kind: str, payload="") -> None:
+        if not self.enabled:
+            return
+        try:
+            async with AsyncSessionLocal() as session:
+                await session.execute(insert(ClusterEvent).values(
+                    kind=kind, payload=str(payload), origin=self.origin, created_at=datetime.utcnow()
+                ))
+                await session.commit()
+        except Exception as e:
+            logger.error("Failed to publish %s event: %s", kind, e)
+
+    async def start(self):
+        if not self.enabled or self._task is not None:
+            return
+        # Only events from now on, the caches start out empty anyway
+        async with AsyncSessionLocal() as session:
+            self._last_id = await session.scalar(select(func.max(ClusterEvent.id))) or 0
+            result = await session.execute(select(ClusterEvent.id).where(ClusterEvent.id > self._last_id - 100))
+        for event_id in result.scalars().all():
+            self._remember(event_id)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                await self.poll()
+            except Exception as e:
+                logger.error("Event poll failed: %s", e)
+
+    async def poll(self):
+        async with AsyncSessionLocal() as session:
+            result = await session.execute(
+                select(ClusterEvent.id, ClusterEvent.kind, ClusterEvent.payload, ClusterEvent.origin)
+                .where(ClusterEvent.id > self._last_id - 100)
+                .order_by(ClusterEvent.id)
+                .limit(1000)
+            )
+            rows = result.all()
+        for event_id, kind, payload, origin in rows:
+            if event_id in self._seen:
+                continue
+            self._remember(event_id)
+            self._last_id = max(self._last_id, event_id)
+            if origin == self.origin:
+                continue
+            self.received += 1
+            for handler in self._handlers.get(kind, ()):
+                try:
+                    result = handler(payload)
+                    if asyncio.iscoroutine(result):
+                        await result
+                except Exception as e:
+                    logger.error("Handler for %s event failed: %s", kind, e)
+
+    def _remember(self, event_id: int):
+        self._seen.add(event_id)
+        self._seen_order.append(event_id)
+        if len(self._seen_order) > 1000:
+            self._seen.discard(self._seen_order.popleft())
+
+    async def prune(self):
+        cutoff = datetime.utcnow() - timedelta(seconds=self.keep)
+        async with AsyncSessionLocal() as session:
+            await session.execute(delete(ClusterEvent).where(ClusterEvent.created_at < cutoff))
+            await session.commit()
+
+
+events = EventBus(settings.EVENT_POLL_MS / 1000)
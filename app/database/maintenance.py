@@ -0,0 +1,173 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, func
+from sqlalchemy.future import select
+
+from app.settings import settings
+from app.database.core import engine, AsyncSessionLocal
+from app.database.models import MessageRoute
+
+logger = logging.getLogger(__name__)
+
+
+class RouteRetention:
+    """
+    Background job that keeps message_routes from growing forever.
+
+    Routes older than `max_age_days`, and everything beyond the newest
+    `max_rows`, are deleted in id ranges of `batch_size` rows, one short
+    transaction each, with a pause in between so the bot's writes are not
+    locked out. Ids grow with created_at, so both limits become a single
+    id boundary and no index on created_at is needed.
+
+    Once a day the job also runs the backend's housekeeping: ANALYZE on
+    both, and on SQLite, when a lot of pages are free, PRAGMA
+    incremental_vacuum in small steps. A full VACUUM locks out every
+    writer, so it only runs when SQLITE_VACUUM is set for a maintenance
+    window; it also turns on incremental auto_vacuum for files created
+    before the engine asked for it.
+    """
+
+    VACUUM_STEP = 1000  # pages per incremental_vacuum transaction
+
+    def __init__(self, max_age_days: int, max_rows: int, batch_size: int, interval: float,
+                 full_vacuum: bool = False):
+        self.max_age_days = max_age_days
+        self.max_rows = max_rows
+        self.batch_size = batch_size
+        self.interval = interval
+        self.full_vacuum = full_vacuum
+        self.housekeeping_interval = 86400
+        self._last_housekeeping = time.monotonic()
+        self._task: asyncio.Task | None = None
+        self.deleted = 0
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.prune()
+                if time.monotonic() - self._last_housekeeping >= self.housekeeping_interval:
+                    await self.housekeeping()
+                    self._last_housekeeping = time.monotonic()
+            except Exception as e:
+                logger.error("Route retention failed: %s", e)
+            await asyncio.sleep(self.interval)
+
+    async def _boundary(self) -> int | None:
+        """Routes with an id below the returned one are due for deletion."""
+        boundary = None
+        async with AsyncSessionLocal() as session:
+            if self.max_age_days > 0:
+                cutoff = datetime.utcnow() - timedelta(days=self.max_age_days)
+                # Walks the primary key from the oldest row; after the first
+                # run only the rows that just expired are in front
+                first_new = await session.scalar(
+                    select(MessageRoute.id).where(MessageRoute.created_at >= cutoff)
+                    .order_by(MessageRoute.id).limit(1)
+                )
+                if first_new is None:
+                    first_new = (await session.scalar(select(func.max(MessageRoute.id))) or 0) + 1
+                boundary = first_new
+            if self.max_rows > 0:
+                max_id = await session.scalar(select(func.max(MessageRoute.id))) or 0
+                by_count = max_id - self.max_rows + 1
+                boundary = by_count if boundary is None else max(boundary, by_count)
+        return boundary
+
+    async def prune(self) -> int:
+        boundary = await self._boundary()
+        if not boundary:
+            return 0
+        async with AsyncSessionLocal() as session:
+            low = await session.scalar(select(func.min(MessageRoute.id)))
+        if low is None or low >= boundary:
+            return 0
+
+        deleted = 0
+        while low < boundary:
+            high = min(boundary, low + self.batch_size)
+            async with AsyncSessionLocal() as session:
+                result = await session.execute(
+                    delete(MessageRoute).where(MessageRoute.id >= low, MessageRoute.id < high)
+                )
+                await session.commit()
+            deleted += result.rowcount or 0
+            low = high
+            await asyncio.sleep(0.05)  # let the bot's writers in
+
+        self.deleted += deleted
+        if deleted:
+            logger.info("Route retention removed %d routes.", deleted)
+        return deleted
+
+    async def housekeeping(self):
+        dialect = engine.dialect.name
+        if dialect == "sqlite":
+            async with engine.begin() as conn:
+                await conn.exec_driver_sql("ANALYZE")
+                pages = (await conn.exec_driver_sql("PRAGMA page_count")).scalar() or 0
+                free = (await conn.exec_driver_sql("PRAGMA freelist_count")).scalar() or 0
+            # Only worth it after big deletes
+            if pages and free / pages > 0.25:
+                await self._vacuum(pages, free)
+        elif dialect == "postgresql":
+            # autovacuum does the rest
+            async with engine.connect() as conn:
+                conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+                await conn.exec_driver_sql("ANALYZE message_routes")
+
+    async def _vacuum(self, pages: int, free: int):
+        if self.full_vacuum:
+            # Rewrites the whole file under an exclusive lock
+            async with engine.connect() as conn:
+                conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+                await conn.exec_driver_sql("PRAGMA auto_vacuum=INCREMENTAL")
+                await conn.exec_driver_sql("VACUUM")
+            logger.info("SQLite VACUUM reclaimed %d of %d pages.", free, pages)
+            return
+
+        async with engine.connect() as conn:
+            mode = (await conn.exec_driver_sql("PRAGMA auto_vacuum")).scalar()
+        if mode != 2:  # INCREMENTAL
+            logger.warning(
+                "SQLite has %d of %d pages free but the file predates incremental auto_vacuum; "
+                "set RELAYCAT_SQLITE_VACUUM for one maintenance window to convert it.", free, pages
+            )
+            return
+
+        reclaimed = 0
+        while reclaimed < free:
+            # Each step is a short write transaction, like a retention batch
+            async with engine.begin() as conn:
+                await conn.exec_driver_sql(f"PRAGMA incremental_vacuum({self.VACUUM_STEP})")
+                left = (await conn.exec_driver_sql("PRAGMA freelist_count")).scalar() or 0
+            if left >= free - reclaimed:
+                break
+            reclaimed = free - left
+            await asyncio.sleep(0.05)  # let the bot's writers in
+        logger.info("SQLite incremental_vacuum reclaimed %d of %d pages.", reclaimed, pages)
+
+
+route_retention = RouteRetention(
+    settings.ROUTE_RETENTION_DAYS,
+    settings.ROUTE_MAX_ROWS,
+    settings.RETENTION_BATCH_SIZE,
+    settings.RETENTION_INTERVAL,
+    settings.SQLITE_VACUUM,
+)
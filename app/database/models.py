@@ -1,5 +1,5 @@
 from datetime import datetime
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, BigInteger, Text
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, BigInteger, Text, Index
 from sqlalchemy.orm import DeclarativeBase
 
 class Base(DeclarativeBase):
@@ -7,6 +7,13 @@ class Base(DeclarativeBase):
 
 class User(Base):
     __tablename__ = "users"
+    __table_args__ = (
+        # "Newest users" on the dashboard and the /users pages without
+        # sorting the whole table, also with a verified/banned filter
+        Index("ix_users_created_at", "created_at", "id"),
+        Index("ix_users_verified_created_at", "is_verified", "created_at", "id"),
+        Index("ix_users_banned_created_at", "is_banned", "created_at", "id"),
+    )
 
     id = Column(BigInteger, primary_key=True, index=True)  # Telegram User ID
     username = Column(String, nullable=True)
@@ -14,15 +21,21 @@ class User(Base):
     last_name = Column(String, nullable=True)
     is_verified = Column(Boolean, default=False)
     is_banned = Column(Boolean, default=False)
+    is_blocked = Column(Boolean, default=False) # User blocked the bot, broadcasts skip them
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
 class MessageRoute(Base):
     __tablename__ = "message_routes"
+    __table_args__ = (
+        # Admin replies look up user_id by admin_message_id: covering index,
+        # answered from the index alone. Retention deletes by id (= age).
+        Index("ix_message_routes_admin_user", "admin_message_id", "user_id"),
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
-    user_id = Column(BigInteger, index=True)
-    admin_message_id = Column(BigInteger, index=True) # ID of the message sent to Admin
+    user_id = Column(BigInteger)
+    admin_message_id = Column(BigInteger) # ID of the message sent to Admin
     user_message_id = Column(BigInteger) # ID of the original message from User
     created_at = Column(DateTime, default=datetime.utcnow)
 
@@ -48,4 +61,81 @@ class Rule(Base):
     pattern = Column(String, nullable=False)
     action = Column(String, default="block") # block, drop, allow
     is_active = Column(Boolean, default=True)
+    disabled_reason = Column(String, nullable=True) # Set when the rule engine disabled it (too slow)
     created_at = Column(DateTime, default=datetime.utcnow)
+
+class StatCounter(Base):
+    __tablename__ = "stat_counters"
+
+    key = Column(String, primary_key=True) # users, messages, blocked
+    value = Column(BigInteger, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class StatBucket(Base):
+    __tablename__ = "stat_buckets"
+
+    series = Column(String, primary_key=True) # e.g. messages:hour, users:day, blocks:rule:3
+    bucket = Column(DateTime, primary_key=True) # Start of the hour/day (UTC)
+    value = Column(BigInteger, default=0)
+
+class QueuedUpdate(Base):
+    """Updates handed from the ingest process to the bot workers (multi-process mode)."""
+    __tablename__ = "update_queue"
+    __table_args__ = (
+        # Each worker reads its own shard in id order
+        Index("ix_update_queue_shard_id", "shard", "id"),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    shard = Column(Integer, nullable=False)
+    payload = Column(Text, nullable=False) # Update as JSON
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class ClusterEvent(Base):
+    """Cache invalidations broadcast to every process (multi-process mode)."""
+    __tablename__ = "cluster_events"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    kind = Column(String, nullable=False) # rules, settings, ban, unban
+    payload = Column(String, default="")
+    origin = Column(String, nullable=True) # Process that published it
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class Broadcast(Base):
+    """A message sent to every verified user, progress saved as it goes."""
+    __tablename__ = "broadcasts"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    text = Column(Text, nullable=True) # Sent as is, or...
+    from_chat_id = Column(BigInteger, nullable=True) # ...copy_message of this message
+    message_id = Column(BigInteger, nullable=True)
+    status = Column(String, default="running") # running, done, cancelled
+    cursor = Column(BigInteger, default=0) # Recipients up to this user id are done
+    total = Column(Integer, default=0)
+    sent = Column(Integer, default=0)
+    failed = Column(Integer, default=0)
+    blocked = Column(Integer, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    finished_at = Column(DateTime, nullable=True)
+
+class OutboxItem(Base):
+    """A forward or reply to deliver, kept until Telegram took it (app/bot/outbox.py)."""
+    __tablename__ = "outbox"
+    __table_args__ = (
+        # Workers look for due items, the panel lists them by status
+        Index("ix_outbox_status_due", "status", "next_attempt_at"),
+        # Items of one lane are delivered in id order
+        Index("ix_outbox_lane_id", "lane", "id"),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    kind = Column(String, nullable=False) # forward, album, reply
+    idempotency_key = Column(String, unique=True, nullable=False) # Same update handled twice = one item
+    lane = Column(String, nullable=False) # e.g. in:<user id>, out:<user id>
+    payload = Column(Text, nullable=False) # JSON
+    status = Column(String, default="pending") # pending, sending, done, dead
+    attempts = Column(Integer, default=0)
+    next_attempt_at = Column(DateTime, default=datetime.utcnow) # For "sending": when the claim expires
+    last_error = Column(String, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -0,0 +1,84 @@
+from dataclasses import dataclass
+
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+
+
+@dataclass(frozen=True)
+class StorageProfile:
+    # SQLite, applied as PRAGMAs on every new connection
+    journal_mode: str | None
+    synchronous: str | None
+    busy_timeout_ms: int
+    cache_size_kb: int  # page cache per connection
+    mmap_size_mb: int
+    # Connection pool (SQLite too: every update in flight may hold a connection)
+    pool_size: int
+    max_overflow: int
+    # PostgreSQL (asyncpg)
+    pre_ping: bool
+    statement_cache_size: int  # prepared statements cached per connection
+
+
+PROFILES = {
+    # What create_async_engine() does without arguments: rollback journal,
+    # the bot and the web panel lock each other out while writing
+    "default": StorageProfile(None, None, 5000, 0, 0, 5, 10, False, 100),
+    # WAL, but every commit still waits for fsync
+    "safe": StorageProfile("WAL", "FULL", 10000, 16_000, 0, 5, 10, True, 100),
+    # WAL with fsync only at checkpoints: a power cut can lose the last
+    # commits, never corrupt the file
+    "balanced": StorageProfile("WAL", "NORMAL", 10000, 64_000, 256, 10, 20, True, 500),
+    # Big caches for large user/route tables on a dedicated host
+    "fast": StorageProfile("WAL", "NORMAL", 15000, 256_000, 1024, 20, 40, False, 1000),
+}
+
+
+def _sqlite_pragmas(profile: StorageProfile) -> list:
+    pragmas = [f"PRAGMA busy_timeout={profile.busy_timeout_ms}"]
+    # Takes effect on a new file (or at the next VACUUM), lets housekeeping
+    # hand free pages back with PRAGMA incremental_vacuum
+    pragmas.append("PRAGMA auto_vacuum=INCREMENTAL")
+    if profile.journal_mode:
+        pragmas.append(f"PRAGMA journal_mode={profile.journal_mode}")
+    if profile.synchronous:
+        pragmas.append(f"PRAGMA synchronous={profile.synchronous}")
+    if profile.cache_size_kb:
+        pragmas.append(f"PRAGMA cache_size=-{profile.cache_size_kb}")  # negative = KiB
+    if profile.mmap_size_mb:
+        pragmas.append(f"PRAGMA mmap_size={profile.mmap_size_mb * 1024 * 1024}")
+    return pragmas
+
+
+def create_engine(url: str, profile_name: str = "balanced", **kwargs) -> AsyncEngine:
+    """create_async_engine() tuned for the backend in `url` with the named profile."""
+    if profile_name not in PROFILES:
+        raise ValueError(f"Unknown storage profile {profile_name!r}, expected one of {', '.join(PROFILES)}")
+    profile = PROFILES[profile_name]
+    backend = make_url(url).get_backend_name()
+
+    if backend == "postgresql":
+        return create_async_engine(
+            url,
+            pool_size=profile.pool_size,
+            max_overflow=profile.max_overflow,
+            pool_pre_ping=profile.pre_ping,
+            connect_args={"statement_cache_size": profile.statement_cache_size},
+            **kwargs,
+        )
+
+    if backend == "sqlite" and profile_name != "default" and ":memory:" not in url:
+        kwargs = {"pool_size": profile.pool_size, "max_overflow": profile.max_overflow, **kwargs}
+    engine = create_async_engine(url, **kwargs)
+    if backend == "sqlite" and profile_name != "default":
+        pragmas = _sqlite_pragmas(profile)
+
+        @event.listens_for(engine.sync_engine, "connect")
+        def apply_pragmas(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            for pragma in pragmas:
+                cursor.execute(pragma)
+            cursor.close()
+
+    return engine
@@ -0,0 +1,82 @@
+from datetime import datetime
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from app.settings import settings
+from app.database.core import AsyncSessionLocal
+from app.database.models import MessageRoute
+from app.database.cache import TTLCache
+from app.database.route_writer import route_writer
+
+_MISSING = object()
+
+
+class RouteIndex:
+    """
+    admin_message_id -> user_id for recently forwarded messages.
+
+    Admins nearly always reply to something recent, so the hot routes are
+    kept in memory (bounded by count and age) and only older ones hit the
+    message_routes table. Misses are remembered for a short while as well,
+    so replying to an unrouted message again doesn't query the table
+    again; add() clears them, and cluster workers (whose routes other
+    workers write) keep them only for seconds.
+    """
+
+    def __init__(self, maxsize: int, max_age: float, negative_ttl: float = 60):
+        self.max_age = max_age
+        self.hot = TTLCache("routes", maxsize, max_age)
+        self.missing = TTLCache("routes_missing", 10000, negative_ttl)
+
+    def add(self, user_id: int, admin_message_id: int, user_message_id: int | None):
+        route_writer.add(user_id, admin_message_id, user_message_id)
+        self.hot.set(admin_message_id, user_id)
+        self.missing.pop(admin_message_id)
+
+    async def lookup(self, admin_message_id: int, session: AsyncSession | None = None) -> int | None:
+        user_id = self.hot.get(admin_message_id)
+        if user_id:
+            return user_id
+        # Fell out of the index but might still be waiting to be written
+        user_id = route_writer.lookup(admin_message_id)
+        if user_id:
+            return user_id
+        if self.missing.get(admin_message_id, _MISSING) is not _MISSING:
+            return None
+
+        query = select(MessageRoute.user_id).where(MessageRoute.admin_message_id == admin_message_id).limit(1)
+        if session is not None:
+            user_id = await session.scalar(query)
+        else:
+            async with AsyncSessionLocal() as session:
+                user_id = await session.scalar(query)
+        if user_id:
+            self.hot.set(admin_message_id, user_id)
+        else:
+            self.missing.set(admin_message_id, None)
+        return user_id
+
+    async def warm(self, limit: int):
+        """
+        Preload the newest `limit` routes, e.g. right after a restart. Each
+        stays for what is left of its max age, as if it had never left.
+        """
+        if limit <= 0:
+            return
+        async with AsyncSessionLocal() as session:
+            result = await session.execute(
+                select(MessageRoute.admin_message_id, MessageRoute.user_id, MessageRoute.created_at)
+                .order_by(MessageRoute.id.desc())
+                .limit(limit)
+            )
+            rows = result.all()
+        now = datetime.utcnow()
+        # Oldest first, so the newest end up as most recently used
+        for admin_message_id, user_id, created_at in reversed(rows):
+            left = self.max_age - (now - created_at).total_seconds() if created_at else self.max_age
+            if left > 0:
+                self.hot.set(admin_message_id, user_id, ttl=left)
+
+
+route_index = RouteIndex(settings.ROUTE_INDEX_SIZE, settings.ROUTE_INDEX_MAX_AGE)
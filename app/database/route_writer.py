@@ -0,0 +1,153 @@
+import asyncio
+import logging
+from datetime import datetime
+
+from sqlalchemy import insert
+from sqlalchemy.exc import OperationalError
+
+from app.settings import settings
+from app.database.core import AsyncSessionLocal
+from app.database.models import MessageRoute
+from app.metrics import Counter
+
+routes_dropped = Counter("relaycat_routes_dropped_total", "Message routes the database kept rejecting.")
+
+logger = logging.getLogger(__name__)
+
+
+class RouteWriter:
+    """
+    Write-behind buffer for MessageRoute rows.
+
+    Handlers call add() and move on. A background task inserts the queued
+    rows in one statement per batch, either when `batch_size` rows are
+    waiting or `flush_interval` seconds after the first one was queued.
+    Routes that are queued but not yet committed are still visible via
+    lookup(), so an admin can reply right away.
+
+    A batch that fails stays queued and is tried again. After
+    `max_attempts` failures in a row it is written one row per transaction
+    instead, and rows the database rejects (an integrity error, a bad
+    value) are logged and dropped so they can't hold up every later route.
+    OperationalError (locked, disk full, gone) means the database is the
+    problem, not the row: the batch stays queued.
+    """
+
+    def __init__(self, batch_size: int, flush_interval: float, max_attempts: int = 3):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_attempts = max_attempts
+        self._attempts = 0  # failures in a row of the batch at the head
+        self._rows: list[dict] = []
+        self._pending: dict[int, int] = {}  # admin_message_id -> user_id
+        self._has_rows = asyncio.Event()
+        self._full = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task: asyncio.Task | None = None
+        self._closing = False
+        self.written = 0
+        self.batches = 0
+        self.dropped = 0
+
+    def add(self, user_id: int, admin_message_id: int, user_message_id: int | None):
+        self._rows.append({
+            "user_id": user_id,
+            "admin_message_id": admin_message_id,
+            "user_message_id": user_message_id,
+            "created_at": datetime.utcnow(),
+        })
+        self._pending[admin_message_id] = user_id
+        self._has_rows.set()
+        if len(self._rows) >= self.batch_size:
+            self._full.set()
+
+    def lookup(self, admin_message_id: int) -> int | None:
+        return self._pending.get(admin_message_id)
+
+    @property
+    def queued(self) -> int:
+        return len(self._rows)
+
+    def start(self):
+        if self._task is None:
+            self._closing = False
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stops the background task and writes whatever is still queued."""
+        if self._task:
+            # Not cancel(): that could interrupt a batch halfway through
+            self._closing = True
+            self._has_rows.set()
+            self._full.set()
+            await self._task
+            self._task = None
+        await self.flush()
+
+    async def _run(self):
+        while not self._closing:
+            await self._has_rows.wait()
+            if not self._closing and len(self._rows) < self.batch_size:
+                try:
+                    await asyncio.wait_for(self._full.wait(), timeout=self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+            self._has_rows.clear()
+            self._full.clear()
+            if not await self.flush():
+                await asyncio.sleep(1)  # DB trouble, don't hammer it
+
+    async def flush(self) -> bool:
+        async with self._flush_lock:
+            while self._rows:
+                rows = self._rows[:self.batch_size]
+                del self._rows[:self.batch_size]
+                try:
+                    if self._attempts < self.max_attempts:
+                        async with AsyncSessionLocal() as session:
+                            await session.execute(insert(MessageRoute), rows)
+                            await session.commit()
+                        self.written += len(rows)
+                    else:
+                        await self._write_each(rows)
+                except Exception as e:
+                    # Keep them queued and let the next tick try again
+                    self._attempts += 1
+                    logger.error("Failed to write %d routes (attempt %d): %s", len(rows), self._attempts, e)
+                    self._rows[:0] = rows
+                    self._has_rows.set()
+                    return False
+                self._attempts = 0
+                self.batches += 1
+                self._done(rows)
+        return True
+
+    async def _write_each(self, rows: list[dict]):
+        """
+        One transaction per row, dropping the rows the database rejects. On
+        OperationalError the rows handled so far are taken off `rows`, so
+        only the rest goes back on the queue.
+        """
+        for i, row in enumerate(rows):
+            try:
+                async with AsyncSessionLocal() as session:
+                    await session.execute(insert(MessageRoute), [row])
+                    await session.commit()
+            except OperationalError:
+                self._done(rows[:i])
+                del rows[:i]
+                raise
+            except Exception as e:
+                logger.error("Dropping route %s: %s", row, e)
+                self.dropped += 1
+                routes_dropped.inc()
+                continue
+            self.written += 1
+
+    def _done(self, rows: list[dict]):
+        for row in rows:
+            if self._pending.get(row["admin_message_id"]) == row["user_id"]:
+                del self._pending[row["admin_message_id"]]
+
+
+route_writer = RouteWriter(settings.ROUTE_BATCH_SIZE, settings.ROUTE_FLUSH_MS / 1000)
@@ -0,0 +1,125 @@
+"""
+Indexed user search for the web panel (app/database/users.py).
+
+SQLite: an FTS5 table over username, first/last name and the id as text,
+kept in sync by triggers on users. Every word of the query is matched as
+a token prefix, so "jo sm" finds "John Smith" and "1234" finds ids
+starting with 1234.
+
+PostgreSQL: a pg_trgm GIN index on the lowercased names, every word is
+matched as a substring; ids are matched exactly.
+
+Other backends fall back to unindexed LIKE prefixes.
+
+Search results are ordered by user id (newest Telegram accounts first),
+the order the FTS5 index can return them in without a sort.
+"""
+import logging
+
+from sqlalchemy import and_, or_, cast, column, table, literal_column, BigInteger, String
+
+from app.database.models import User
+
+logger = logging.getLogger(__name__)
+
+# Status flags are indexed as tokens too, so "search + banned only" is
+# answered inside FTS5 instead of filtering its matches one by one
+SQLITE_FLAGS = {
+    "new": "CASE WHEN new.is_verified THEN 'verified ' ELSE '' END || CASE WHEN new.is_banned THEN 'banned' ELSE '' END",
+    "old": "CASE WHEN old.is_verified THEN 'verified ' ELSE '' END || CASE WHEN old.is_banned THEN 'banned' ELSE '' END",
+    "users": "CASE WHEN is_verified THEN 'verified ' ELSE '' END || CASE WHEN is_banned THEN 'banned' ELSE '' END",
+}
+SQLITE_COLUMNS = "username, first_name, last_name, uid, flags"
+SQLITE_INSERT = f"INSERT INTO users_fts(rowid, {SQLITE_COLUMNS}) " \
+    f"VALUES (new.id, new.username, new.first_name, new.last_name, new.id, {SQLITE_FLAGS['new']});"
+SQLITE_DELETE = f"INSERT INTO users_fts(users_fts, rowid, {SQLITE_COLUMNS}) " \
+    f"VALUES ('delete', old.id, old.username, old.first_name, old.last_name, old.id, {SQLITE_FLAGS['old']});"
+SQLITE_DDL = [
+    # Contentless: the names live in users, the index only stores tokens
+    f"CREATE VIRTUAL TABLE users_fts USING fts5({SQLITE_COLUMNS}, "
+    "content='', tokenize='unicode61 remove_diacritics 2', prefix='1 2 3')",
+    f"CREATE TRIGGER users_fts_insert AFTER INSERT ON users BEGIN {SQLITE_INSERT} END",
+    f"CREATE TRIGGER users_fts_delete AFTER DELETE ON users BEGIN {SQLITE_DELETE} END",
+    # Not for updated_at and the other columns nobody searches
+    "CREATE TRIGGER users_fts_update AFTER UPDATE OF username, first_name, last_name, is_verified, is_banned "
+    f"ON users BEGIN {SQLITE_DELETE} {SQLITE_INSERT} END",
+    # Users that existed before the index
+    f"INSERT INTO users_fts(rowid, {SQLITE_COLUMNS}) "
+    f"SELECT id, username, first_name, last_name, id, {SQLITE_FLAGS['users']} FROM users",
+]
+
+# Queries must use the very same expression for Postgres to pick the index
+POSTGRES_NAMES = "lower(coalesce(username, '') || ' ' || coalesce(first_name, '') || ' ' || coalesce(last_name, ''))"
+POSTGRES_DDL = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    f"CREATE INDEX IF NOT EXISTS ix_users_names_trgm ON users USING gin (({POSTGRES_NAMES}) gin_trgm_ops)",
+]
+
+
+def install_search_index(conn):
+    """Creates the search index if it is missing (sync, runs inside init_db)."""
+    dialect = conn.dialect.name
+    if dialect == "sqlite":
+        exists = conn.exec_driver_sql("SELECT 1 FROM sqlite_master WHERE name = 'users_fts'").first()
+        if not exists:
+            for statement in SQLITE_DDL:
+                conn.exec_driver_sql(statement)
+            logger.info("Created the user search index.")
+    elif dialect == "postgresql":
+        try:
+            with conn.begin_nested():
+                for statement in POSTGRES_DDL:
+                    conn.exec_driver_sql(statement)
+        except Exception as e:
+            # pg_trgm needs a superuser (or trusted extensions) the first time
+            logger.warning("No trigram index for user search, searches will scan: %s", e)
+
+
+def _words(query: str) -> list[str]:
+    return [word for word in query.split() if word][:8]
+
+
+def _flag_terms(name: str, value: bool | None) -> str:
+    if value is None:
+        return ""
+    return f" AND flags:{name}" if value else f" NOT flags:{name}"
+
+
+def search_users(stmt, dialect: str, query: str, verified: bool | None = None, banned: bool | None = None,
+                 after_id: int | None = None):
+    """
+    Narrows select(User) `stmt` to the users matching a search box query,
+    newest user id first, starting below `after_id`. Returns None for an
+    empty query. The verified/banned filters must be applied by the caller
+    as well, here they only help the index.
+    """
+    words = _words(query)
+    if not words:
+        return None
+
+    if dialect == "sqlite":
+        # Every word as a quoted token prefix of a name or the id, FTS5 syntax
+        # characters stay literal. FTS5 returns rowids in descending order and
+        # stops after LIMIT, however many users match.
+        match = "{username first_name last_name uid}: (" \
+            + " ".join('"' + word.replace('"', '""') + '"*' for word in words) + ")" \
+            + _flag_terms("verified", verified) + _flag_terms("banned", banned)
+        fts = table("users_fts", column("rowid", BigInteger))
+        stmt = stmt.join(fts, fts.c.rowid == User.id).where(literal_column("users_fts").op("MATCH")(match))
+        if after_id is not None:
+            stmt = stmt.where(fts.c.rowid < after_id)
+        return stmt.order_by(fts.c.rowid.desc())
+
+    exact_id = [User.id == int(query)] if query.strip().isdigit() and len(query.strip()) < 19 else []
+    if dialect == "postgresql":
+        names = literal_column(POSTGRES_NAMES, String)
+        match = or_(*exact_id, and_(*(names.contains(word.lower(), autoescape=True) for word in words)))
+    else:
+        fields = (User.username, User.first_name, User.last_name, cast(User.id, String))
+        match = or_(*exact_id, and_(*(
+            or_(*(field.startswith(word, autoescape=True) for field in fields)) for word in words
+        )))
+    stmt = stmt.where(match)
+    if after_id is not None:
+        stmt = stmt.where(User.id < after_id)
+    return stmt.order_by(User.id.desc())
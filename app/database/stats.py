@@ -0,0 +1,206 @@
+import asyncio
+import logging
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, insert, update
+from sqlalchemy.future import select
+
+from app.database.core import AsyncSessionLocal
+from app.database.models import User, MessageRoute, StatCounter, StatBucket
+from app.database.user_writer import user_writer
+
+logger = logging.getLogger(__name__)
+
+
+def hour_of(ts: datetime) -> datetime:
+    return ts.replace(minute=0, second=0, microsecond=0)
+
+
+def day_of(ts: datetime) -> datetime:
+    return ts.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+class Stats:
+    """
+    Dashboard numbers without scanning users/message_routes.
+
+    Events are counted in memory and added to the stat_counters and
+    stat_buckets tables every `flush_interval` seconds. Readers get the
+    table values plus whatever this process hasn't flushed yet. The user
+    total is re-checked against a real count every `reconcile_interval`.
+    The message total counts relayed messages; it is seeded once from
+    message_routes and only counted after that, because retention deletes
+    old routes.
+    """
+
+    def __init__(self, flush_interval: float = 10, reconcile_interval: float = 6 * 3600):
+        self.flush_interval = flush_interval
+        self.reconcile_interval = reconcile_interval
+        self._counters: dict = defaultdict(int)  # key -> unflushed delta
+        self._buckets: dict = defaultdict(int)  # (series, bucket) -> unflushed delta
+        self._last_reconcile = time.monotonic()
+        self._task: asyncio.Task | None = None
+
+    # ---- recording (cheap, in memory) ----
+
+    def record_message(self, count: int = 1):
+        self._counters["messages"] += count
+        self._buckets[("messages:hour", hour_of(datetime.utcnow()))] += count
+
+    def record_user(self):
+        self._counters["users"] += 1
+        self._buckets[("users:day", day_of(datetime.utcnow()))] += 1
+
+    def record_block(self, rule_id: int):
+        self._counters["blocked"] += 1
+        self._buckets[(f"blocks:rule:{rule_id}", day_of(datetime.utcnow()))] += 1
+
+    # ---- reading ----
+
+    async def totals(self) -> dict:
+        async with AsyncSessionLocal() as session:
+            result = await session.execute(select(StatCounter.key, StatCounter.value))
+            totals = dict(result.all())
+        for key, delta in self._counters.items():
+            totals[key] = totals.get(key, 0) + delta
+        return totals
+
+    async def series(self, prefix: str, since: datetime) -> dict:
+        """{series: {bucket: value}} for every series starting with `prefix`."""
+        async with AsyncSessionLocal() as session:
+            result = await session.execute(
+                select(StatBucket.series, StatBucket.bucket, StatBucket.value)
+                .where(StatBucket.series.startswith(prefix), StatBucket.bucket >= since)
+            )
+            rows = result.all()
+        out: dict = defaultdict(dict)
+        for series, bucket, value in rows:
+            out[series][bucket] = value
+        for (series, bucket), delta in self._buckets.items():
+            if series.startswith(prefix) and bucket >= since:
+                out[series][bucket] = out[series].get(bucket, 0) + delta
+        return dict(out)
+
+    # ---- persistence ----
+
+    async def load(self):
+        """Seeds missing counters from real counts (first run after upgrade)."""
+        async with AsyncSessionLocal() as session:
+            result = await session.execute(select(StatCounter.key))
+            present = set(result.scalars().all())
+            seeds = {}
+            if "users" not in present:
+                seeds["users"] = await session.scalar(select(func.count(User.id))) or 0
+            if "messages" not in present:
+                # A relayed message has a route for its copy and one for its
+                # info card (if any), both for the same user message
+                relayed = select(MessageRoute.user_id, MessageRoute.user_message_id).distinct().subquery()
+                seeds["messages"] = await session.scalar(select(func.count()).select_from(relayed)) or 0
+            if "blocked" not in present:
+                seeds["blocked"] = 0
+            if seeds:
+                await session.execute(insert(StatCounter), [{"key": k, "value": v} for k, v in seeds.items()])
+                await session.commit()
+
+    async def flush(self):
+        if not self._counters and not self._buckets:
+            return
+        counters, self._counters = self._counters, defaultdict(int)
+        buckets, self._buckets = self._buckets, defaultdict(int)
+        try:
+            async with AsyncSessionLocal() as session:
+                for key, delta in counters.items():
+                    result = await session.execute(
+                        update(StatCounter).where(StatCounter.key == key)
+                        .values(value=StatCounter.value + delta)
+                    )
+                    if not result.rowcount:
+                        session.add(StatCounter(key=key, value=delta))
+                for (series, bucket), delta in buckets.items():
+                    result = await session.execute(
+                        update(StatBucket).where(StatBucket.series == series, StatBucket.bucket == bucket)
+                        .values(value=StatBucket.value + delta)
+                    )
+                    if not result.rowcount:
+                        session.add(StatBucket(series=series, bucket=bucket, value=delta))
+                await session.commit()
+        except Exception as e:
+            logger.error("Failed to flush stats: %s", e)
+            # Put the deltas back, the next flush retries them
+            for key, delta in counters.items():
+                self._counters[key] += delta
+            for key, delta in buckets.items():
+                self._buckets[key] += delta
+
+    async def reconcile(self):
+        """
+        Corrects the user total, in case something bypassed record_user()
+        or counted a user twice. Applied as a delta, so what other processes
+        flush meanwhile is kept; their unflushed users (at most one flush
+        interval's worth) are left for the next reconcile.
+        """
+        await self.flush()
+        async with AsyncSessionLocal() as session:
+            stored = await session.scalar(select(StatCounter.value).where(StatCounter.key == "users")) or 0
+            # Ours still in memory: counted (record_user) but not in the table yet
+            real = (await session.scalar(select(func.count(User.id))) or 0) + user_writer.pending_users
+            correction = real - stored - self._counters["users"]
+            if correction:
+                logger.info("Correcting the user total by %+d.", correction)
+                await session.execute(
+                    update(StatCounter).where(StatCounter.key == "users")
+                    .values(value=StatCounter.value + correction)
+                )
+                await session.commit()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+                if time.monotonic() - self._last_reconcile >= self.reconcile_interval:
+                    await self.reconcile()
+                    self._last_reconcile = time.monotonic()
+            except Exception as e:
+                logger.error("Stats job failed: %s", e)
+
+
+stats = Stats()
+
+
+async def dashboard_trends(now: datetime | None = None) -> dict:
+    """Last 24 hours of messages, last 14 days of new users, blocks per rule over 7 days."""
+    now = now or datetime.utcnow()
+    first_hour = hour_of(now) - timedelta(hours=23)
+    first_day = day_of(now) - timedelta(days=13)
+
+    messages = (await stats.series("messages:hour", first_hour)).get("messages:hour", {})
+    users = (await stats.series("users:day", first_day)).get("users:day", {})
+    blocks = await stats.series("blocks:rule:", day_of(now) - timedelta(days=6))
+
+    hours = [first_hour + timedelta(hours=i) for i in range(24)]
+    days = [first_day + timedelta(days=i) for i in range(14)]
+    return {
+        "messages_per_hour": [(h.strftime("%H:00"), messages.get(h, 0)) for h in hours],
+        "users_per_day": [(d.strftime("%m-%d"), users.get(d, 0)) for d in days],
+        "blocks_per_rule": sorted(
+            ((int(series.rsplit(":", 1)[1]), sum(values.values())) for series, values in blocks.items()),
+            key=lambda item: -item[1],
+        ),
+    }
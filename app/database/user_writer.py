@@ -0,0 +1,163 @@
+import asyncio
+import logging
+from datetime import datetime
+
+from sqlalchemy import update
+
+from app.settings import settings
+from app.database.core import AsyncSessionLocal, insert_ignore
+from app.database.models import User
+
+logger = logging.getLogger(__name__)
+
+
+class UserWriter:
+    """
+    Write-behind buffer for new users and verified flags.
+
+    In a join flood every /start creates a user and every solved challenge
+    sets is_verified. Instead of a transaction each, handlers queue them and
+    a background task writes them together: new users with one insert
+    (ids that exist by then are skipped) and verified flags with one UPDATE
+    per batch, either when `batch_size` changes are waiting or
+    `flush_interval` seconds after the first one was queued. Users and
+    flags that are queued, or in a batch not committed yet, are still
+    visible via lookup() and verifying(); `generation` changes with every
+    change queued or written, so a reader can tell its DB read raced one.
+    """
+
+    def __init__(self, batch_size: int, flush_interval: float):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._new: dict[int, dict] = {}  # user id -> row
+        self._verified: set[int] = set()
+        # The batch being written, until it is committed
+        self._writing_new: dict[int, dict] = {}
+        self._writing_verified: set[int] = set()
+        self.generation = 0
+        self._has_rows = asyncio.Event()
+        self._full = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task: asyncio.Task | None = None
+        self._closing = False
+        self.created = 0
+        self.verified = 0
+        self.batches = 0
+
+    def add(self, user: User):
+        now = datetime.utcnow()
+        self._new[user.id] = {
+            "id": user.id,
+            "username": user.username,
+            "first_name": user.first_name,
+            "last_name": user.last_name,
+            "is_verified": bool(user.is_verified),
+            "is_banned": False,
+            "is_blocked": False,
+            "created_at": now,
+            "updated_at": now,
+        }
+        self._queued()
+
+    def verify(self, user_id: int):
+        row = self._new.get(user_id)
+        if row is not None:
+            row["is_verified"] = True  # not written yet, insert it verified
+        else:
+            self._verified.add(user_id)
+        self._queued()
+
+    def lookup(self, user_id: int) -> dict | None:
+        row = self._new.get(user_id)
+        return row if row is not None else self._writing_new.get(user_id)
+
+    def verifying(self, user_id: int) -> bool:
+        """True if a verified flag for the user is queued or being written."""
+        return user_id in self._verified or user_id in self._writing_verified
+
+    @property
+    def queued(self) -> int:
+        return len(self._new) + len(self._verified)
+
+    @property
+    def pending_users(self) -> int:
+        """New users not committed yet."""
+        return len(self._new) + len(self._writing_new)
+
+    def _queued(self):
+        self.generation += 1
+        self._has_rows.set()
+        if self.queued >= self.batch_size:
+            self._full.set()
+
+    def start(self):
+        if self._task is None:
+            self._closing = False
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stops the background task and writes whatever is still queued."""
+        if self._task:
+            self._closing = True
+            self._has_rows.set()
+            self._full.set()
+            await self._task
+            self._task = None
+        await self.flush()
+
+    async def _run(self):
+        while not self._closing:
+            await self._has_rows.wait()
+            if not self._closing and self.queued < self.batch_size:
+                try:
+                    await asyncio.wait_for(self._full.wait(), timeout=self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+            self._has_rows.clear()
+            self._full.clear()
+            if not await self.flush():
+                await asyncio.sleep(1)  # DB trouble, don't hammer it
+
+    async def flush(self) -> bool:
+        async with self._flush_lock:
+            if not self.queued:
+                return True
+            # Whatever is queued from here on goes in the next flush, after this one
+            new, verified = self._new, self._verified
+            self._new, self._verified = {}, set()
+            self._writing_new, self._writing_verified = new, verified
+            rows, ids = list(new.values()), list(verified)
+            try:
+                async with AsyncSessionLocal() as session:
+                    for low in range(0, len(rows), self.batch_size):
+                        await session.execute(insert_ignore(User, "id"), rows[low:low + self.batch_size])
+                    for low in range(0, len(ids), self.batch_size):
+                        await session.execute(
+                            update(User).where(User.id.in_(ids[low:low + self.batch_size]))
+                            .values(is_verified=True, updated_at=datetime.utcnow())
+                        )
+                    await session.commit()
+            except Exception as e:
+                # Keep them queued (behind anything newer) and let the next tick try again
+                logger.error("Failed to write %d new users and %d verified flags: %s", len(rows), len(ids), e)
+                for user_id, row in new.items():
+                    if user_id in self._new:
+                        self._new[user_id]["is_verified"] |= row["is_verified"]
+                    else:
+                        self._new[user_id] = row
+                self._verified |= verified
+                self._has_rows.set()
+                return False
+            finally:
+                self._writing_new, self._writing_verified = {}, set()
+                self.generation += 1
+            self.created += len(rows)
+            self.verified += len(ids)
+            self.batches += 1
+        return True
+
+    def stats(self) -> dict:
+        return {"queued": self.queued, "created": self.created, "verified": self.verified, "batches": self.batches}
+
+
+user_writer = UserWriter(settings.USER_BATCH_SIZE, settings.USER_FLUSH_MS / 1000)
@@ -0,0 +1,76 @@
+"""
+User directory of the web panel: newest first, keyset pagination.
+
+A page is fetched with `(created_at, id) < cursor ORDER BY created_at DESC,
+id DESC LIMIT n`, which walks ix_users_created_at (or the verified/banned
+variant when filtering) from the cursor on, so page 1000 costs the same
+as page 1. The cursor is the sort key of the last row of the previous page.
+Search results come in user id order instead (app/database/search.py),
+their cursor is just the id.
+"""
+from datetime import datetime
+
+from sqlalchemy import tuple_
+from sqlalchemy.future import select
+
+from app.database.core import engine, AsyncSessionLocal
+from app.database.models import User
+from app.database.search import search_users
+
+PAGE_SIZE = 50
+
+
+def encode_cursor(user: User, by_id: bool = False) -> str:
+    return str(user.id) if by_id else f"{user.created_at.isoformat()}_{user.id}"
+
+
+def decode_cursor(cursor: str | None) -> tuple | None:
+    """(created_at, id) or (None, id) for a search cursor."""
+    if not cursor:
+        return None
+    try:
+        if cursor.isdigit():
+            return None, int(cursor)
+        created_at, user_id = cursor.rsplit("_", 1)
+        return datetime.fromisoformat(created_at), int(user_id)
+    except ValueError:
+        return None
+
+
+async def list_users(query: str = "", verified: bool | None = None, banned: bool | None = None,
+                     cursor: str | None = None, limit: int = PAGE_SIZE) -> tuple[list[User], str | None]:
+    """One page of users and the cursor of the next page (None on the last one)."""
+    stmt = select(User)
+    if verified is not None:
+        stmt = stmt.where(User.is_verified == verified)
+    if banned is not None:
+        stmt = stmt.where(User.is_banned == banned)
+    after = decode_cursor(cursor)
+
+    searched = search_users(stmt, engine.dialect.name, query, verified, banned, after[1] if after else None)
+    if searched is not None:
+        stmt = searched
+    else:
+        if after and after[0] is not None:
+            stmt = stmt.where(tuple_(User.created_at, User.id) < after)
+        stmt = stmt.order_by(User.created_at.desc(), User.id.desc())
+
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(stmt.limit(limit + 1))
+        users = result.scalars().all()
+    if len(users) > limit:
+        return users[:limit], encode_cursor(users[limit - 1], by_id=searched is not None)
+    return users, None
+
+
+def user_dict(user: User) -> dict:
+    return {
+        "id": user.id,
+        "username": user.username,
+        "first_name": user.first_name,
+        "last_name": user.last_name,
+        "is_verified": bool(user.is_verified),
+        "is_banned": bool(user.is_banned),
+        "is_blocked": bool(user.is_blocked),
+        "created_at": user.created_at.isoformat() if user.created_at else None,
+    }
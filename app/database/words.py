@@ -0,0 +1,91 @@
+"""
+The bad_words table as a word list: one word per line, regexes prefixed
+with "re:". Imports are inserted in batches and skip words already there;
+exports are streamed, so neither holds the whole list in memory.
+"""
+from sqlalchemy import delete, func, insert
+from sqlalchemy.future import select
+
+from app.database.core import AsyncSessionLocal
+from app.database.models import BadWord
+
+BATCH = 1000
+REGEX_PREFIX = "re:"
+
+
+def parse_word_list(raw: str) -> list[tuple[str, bool]]:
+    """(word, is_regex) for every non-empty line that isn't a # comment, without duplicates."""
+    rows, seen = [], set()
+    for line in raw.splitlines():
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        is_regex = line.startswith(REGEX_PREFIX)
+        word = line[len(REGEX_PREFIX):].strip() if is_regex else line
+        if word and word not in seen:
+            seen.add(word)
+            rows.append((word, is_regex))
+    return rows
+
+
+def format_word(word: str, is_regex: bool) -> str:
+    return f"{REGEX_PREFIX}{word}" if is_regex else word
+
+
+async def count_words() -> int:
+    async with AsyncSessionLocal() as session:
+        return await session.scalar(select(func.count(BadWord.id))) or 0
+
+
+async def find_words(query: str = "", limit: int = 100) -> list[BadWord]:
+    """Words starting with `query`, alphabetically."""
+    stmt = select(BadWord).order_by(BadWord.word).limit(limit)
+    if query:
+        stmt = stmt.where(BadWord.word.startswith(query, autoescape=True))
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(stmt)
+        return result.scalars().all()
+
+
+async def import_words(rows: list[tuple[str, bool]], replace: bool = False) -> tuple[list, int]:
+    """
+    Inserts the rows that aren't in the table yet, in one transaction.
+    With `replace` the table is emptied first. Returns (inserted rows, deleted count).
+    """
+    inserted, deleted = [], 0
+    async with AsyncSessionLocal() as session:
+        if replace:
+            deleted = (await session.execute(delete(BadWord))).rowcount or 0
+        for low in range(0, len(rows), BATCH):
+            batch = rows[low:low + BATCH]
+            existing = set()
+            if not replace:
+                result = await session.execute(select(BadWord.word).where(BadWord.word.in_([w for w, _ in batch])))
+                existing = set(result.scalars().all())
+            new = [(word, is_regex) for word, is_regex in batch if word not in existing]
+            if new:
+                await session.execute(insert(BadWord), [{"word": w, "is_regex": r} for w, r in new])
+                inserted.extend(new)
+        await session.commit()
+    return inserted, deleted
+
+
+async def delete_words(word_ids: list[int]) -> list[tuple[str, bool]]:
+    if not word_ids:
+        return []
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(select(BadWord.word, BadWord.is_regex).where(BadWord.id.in_(word_ids)))
+        rows = [tuple(row) for row in result.all()]
+        await session.execute(delete(BadWord).where(BadWord.id.in_(word_ids)))
+        await session.commit()
+    return rows
+
+
+async def export_words():
+    """The word list, line by line, read in batches."""
+    async with AsyncSessionLocal() as session:
+        result = await session.stream(
+            select(BadWord.word, BadWord.is_regex).order_by(BadWord.id).execution_options(yield_per=BATCH)
+        )
+        async for word, is_regex in result:
+            yield format_word(word, is_regex) + "\n"
@@ -1,26 +1,36 @@
 import asyncio
 import logging
+import hmac
 import uvicorn
-from fastapi import FastAPI
+from fastapi import FastAPI, Request, HTTPException
+from fastapi.responses import PlainTextResponse
 from fastapi.staticfiles import StaticFiles
 from aiogram import types
 from aiogram.fsm.storage.memory import MemoryStorage
 
 from app.settings import settings
-from app.bot.loader import bot, dp
+from app.bot.loader import bot, dp, setup_bot_commands
 from app.database.core import init_db
+from app.database.route_writer import route_writer
+from app.database.user_writer import user_writer
+from app.database.route_index import route_index
+from app.database.maintenance import route_retention
+from app.database.stats import stats
+from app.bot.flood import flood_guard
+from app.bot.broadcast import broadcaster
+from app.bot.outbox import outbox
+from app.bot.albums import album_buffer
+from app.bot.keywords import keyword_filter
 # Import handlers to register them
 import app.bot.handlers
 from app.web.routes import router as web_router
-from aiogram.types import BotCommand
-
-async def setup_bot_commands():
-    commands = [
-        BotCommand(command="start", description="Start interaction"),
-        BotCommand(command="ban", description="[Admin] Ban user"),
-        BotCommand(command="unban", description="[Admin] Unban user"),
-    ]
-    await bot.set_my_commands(commands)
+from app.bot.webhook import router as webhook_router, setup_webhook
+from app.bot.executor import update_executor, poll_updates
+from app.database.events import events
+from app.cluster import register_invalidations
+from app.bot.outbound import outbound
+from app.database.cache import cache_stats
+from app import metrics
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -28,24 +38,90 @@ logger = logging.getLogger(__name__)
 app = FastAPI(title="RelayCat Admin")
 app.mount("/static", StaticFiles(directory="app/static"), name="static")
 app.include_router(web_router)
+if settings.BOT_MODE == "webhook":
+    app.include_router(webhook_router)
+
+# Queue depths and cache sizes, read when /metrics is scraped
+metrics.Gauge("relaycat_outbound_queued", "Telegram calls waiting for the rate limiter, by priority.",
+              lambda: {(lane,): s["queued"] for lane, s in outbound.stats()["lanes"].items()}, ("priority",))
+metrics.Gauge("relaycat_route_writer_queued", "Message routes not yet written to the database.",
+              lambda: {(): route_writer.queued})
+metrics.Gauge("relaycat_user_writer_queued", "New users and verified flags not yet written to the database.",
+              lambda: {(): user_writer.queued})
+metrics.Gauge("relaycat_update_queue_depth", "Updates waiting for a worker, by shard.",
+              lambda: {(str(i),): depth for i, depth in enumerate(update_executor.depths())}, ("shard",))
+metrics.Gauge("relaycat_cache_entries", "Entries per in-memory cache.",
+              lambda: {(name,): s["size"] for name, s in cache_stats().items()}, ("cache",))
+
+@app.get("/metrics")
+async def metrics_endpoint(request: Request):
+    if settings.METRICS_TOKEN:
+        token = request.headers.get("Authorization", "").removeprefix("Bearer ")
+        if not hmac.compare_digest(token, settings.METRICS_TOKEN):
+            raise HTTPException(status_code=401)
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
 
 @app.on_event("startup")
 async def on_startup():
     logger.info("Starting RelayCat...")
     await init_db()
+    if settings.CLUSTER_WORKERS > 0:
+        # Multi-process mode: this is just the web panel, the bot runs in
+        # `python -m app.cluster` processes
+        await flood_guard.load()
+        register_invalidations()
+        await events.start()
+        logger.info("Web panel started (bot runs in %d worker processes).", settings.CLUSTER_WORKERS)
+        return
+    route_writer.start()
+    user_writer.start()
+    await route_index.warm(settings.ROUTE_INDEX_WARM)
+    route_retention.start()
+    await stats.load()
+    stats.start()
+    await flood_guard.load()
+    await keyword_filter.load()
     await setup_bot_commands()
+    broadcaster.start()
+    outbox.start()
     
-    # Start Bot Polling as a background task
-    # In production with detailed webhooks, implementation differs.
-    # For now, we run polling in the same loop for simplicity (or we can use webhook).
-    # Since Docker usually runs one process, we can run polling via asyncio.create_task
-    # BUT: running polling inside FastAPI startup is a common pattern for simple bots.
-    asyncio.create_task(run_bot())
+    # Updates from both sources go through the sharded executor
+    update_executor.start()
+    if settings.BOT_MODE == "webhook":
+        # Telegram pushes updates to WEBHOOK_PATH
+        await setup_webhook()
+        logger.info("Bot webhook set, %d shards.", update_executor.shards)
+    else:
+        # Start Bot Polling as a background task
+        # Since Docker usually runs one process, we can run polling via asyncio.create_task
+        # BUT: running polling inside FastAPI startup is a common pattern for simple bots.
+        global polling_task
+        polling_task = asyncio.create_task(run_bot())
+
+polling_task: asyncio.Task | None = None
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    if settings.CLUSTER_WORKERS > 0:
+        await events.stop()
+        return
+    if polling_task:
+        polling_task.cancel()
+    await update_executor.stop()
+    # Albums still in their buffer go to the outbox before it stops
+    await album_buffer.stop()
+    await outbox.stop()
+    await broadcaster.stop()
+    await route_retention.stop()
+    await stats.stop()
+    # Make sure queued routes and users hit the DB before we exit
+    await route_writer.stop()
+    await user_writer.stop()
 
 async def run_bot():
-    logger.info("Bot polling started.")
+    logger.info("Bot polling started, %d shards.", update_executor.shards)
     await bot.delete_webhook(drop_pending_updates=True)
-    await dp.start_polling(bot)
+    await poll_updates(update_executor)
 
 @app.get("/")
 async def root():
@@ -0,0 +1,209 @@
+"""
+Prometheus-style metrics without extra dependencies.
+
+Counters and histograms are plain dicts keyed by label values, updated
+from aiogram middlewares, SQLAlchemy cursor events and the rule engine.
+render() produces the text exposition format served on /metrics.
+"""
+import bisect
+import logging
+import time
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from sqlalchemy import event
+
+from app.settings import settings
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+_metrics: list = []
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values: dict = {}
+        _metrics.append(self)
+
+    def inc(self, *label_values, amount: float = 1):
+        self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def samples(self):
+        for values, total in self.values.items():
+            yield f"{self.name}{_labels(self.labels, values)} {total}"
+
+
+class Gauge(Counter):
+    """Value read from `fn` at scrape time, returns {label values: value}."""
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, fn, labels: tuple = ()):
+        super().__init__(name, help, labels)
+        self.fn = fn
+
+    def samples(self):
+        for values, value in self.fn().items():
+            yield f"{self.name}{_labels(self.labels, values)} {value}"
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self.values: dict = {}  # label values -> [bucket counts..., +Inf count, sum]
+        _metrics.append(self)
+
+    def observe(self, value: float, *label_values):
+        series = self.values.get(label_values)
+        if series is None:
+            series = self.values[label_values] = [0] * (len(self.buckets) + 2)
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def samples(self):
+        for values, series in self.values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), series):
+                cumulative += count
+                le = f'le="{bound}"'
+                yield f"{self.name}_bucket{_labels(self.labels, values, le)} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labels, values)} {series[-1]}"
+            yield f"{self.name}_count{_labels(self.labels, values)} {cumulative}"
+
+
+def render() -> str:
+    lines = []
+    for metric in _metrics:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.samples())
+    return "\n".join(lines) + "\n"
+
+
+# ---- metrics ----
+
+updates_seconds = Histogram("relaycat_update_seconds", "Time to handle one update, by update type.", ("type",))
+handler_seconds = Histogram("relaycat_handler_seconds", "Time spent in each handler.", ("handler",))
+handler_errors = Counter("relaycat_handler_errors_total", "Exceptions raised by handlers.", ("handler",))
+slow_updates = Counter("relaycat_slow_updates_total", "Updates slower than SLOW_UPDATE_MS.", ("type",))
+
+db_seconds = Histogram("relaycat_db_query_seconds", "SQL statement duration, by statement type.", ("statement",))
+db_errors = Counter("relaycat_db_errors_total", "Failed SQL statements, by statement type.", ("statement",))
+
+telegram_seconds = Histogram("relaycat_telegram_seconds", "Telegram Bot API call latency, by method.", ("method",))
+telegram_errors = Counter("relaycat_telegram_errors_total", "Failed Telegram calls, by method and error.", ("method", "error"))
+
+rule_eval_seconds = Histogram("relaycat_rule_eval_seconds", "Time to evaluate the active rules against a message.")
+rule_matches = Counter("relaycat_rule_matches_total", "Messages matched, by rule.", ("rule_id", "action"))
+
+
+# ---- aiogram ----
+
+class UpdateMetrics(BaseMiddleware):
+    """Outer middleware on dp.update: total handling time and the slow-update log."""
+
+    def __init__(self, slow_threshold: float):
+        self.slow_threshold = slow_threshold
+
+    async def __call__(self, handler, event, data):
+        start = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            took = time.perf_counter() - start
+            kind = event.event_type
+            updates_seconds.observe(took, kind)
+            if self.slow_threshold and took >= self.slow_threshold:
+                slow_updates.inc(kind)
+                user = data.get("event_from_user")
+                logger.warning("Slow update %s (%s) from %s: %.0f ms",
+                               event.update_id, kind, user.id if user else "-", took * 1000)
+
+
+class HandlerMetrics(BaseMiddleware):
+    """Inner middleware on messages and callback queries: time per handler."""
+
+    async def __call__(self, handler, event, data):
+        name = data["handler"].callback.__name__
+        start = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            handler_errors.inc(name)
+            raise
+        finally:
+            handler_seconds.observe(time.perf_counter() - start, name)
+
+
+class TelegramMetrics(BaseRequestMiddleware):
+    """Request middleware on the Bot session, inside the outbound scheduler."""
+
+    async def __call__(self, make_request, bot, method):
+        name = type(method).__name__
+        start = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except Exception as e:
+            telegram_errors.inc(name, type(e).__name__)
+            raise
+        finally:
+            telegram_seconds.observe(time.perf_counter() - start, name)
+
+
+def install_bot_metrics(dp, bot):
+    dp.update.outer_middleware(UpdateMetrics(settings.SLOW_UPDATE_MS / 1000))
+    handler_metrics = HandlerMetrics()
+    dp.message.middleware(handler_metrics)
+    dp.callback_query.middleware(handler_metrics)
+    bot.session.middleware(TelegramMetrics())
+
+
+# ---- SQLAlchemy ----
+
+def _statement_type(statement: str) -> str:
+    return statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "OTHER"
+
+
+def _before_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+def _after_execute(conn, cursor, statement, parameters, context, executemany):
+    start = conn.info["query_start"].pop()
+    db_seconds.observe(time.perf_counter() - start, _statement_type(statement))
+
+
+def _on_error(context):
+    starts = context.connection.info.get("query_start") if context.connection else None
+    if starts:
+        starts.pop()
+    db_errors.inc(_statement_type(context.statement or ""))
+
+
+def install_db_metrics(engine):
+    sync_engine = engine.sync_engine
+    event.listen(sync_engine, "before_cursor_execute", _before_execute)
+    event.listen(sync_engine, "after_cursor_execute", _after_execute)
+    event.listen(sync_engine, "handle_error", _on_error)
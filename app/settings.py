@@ -9,8 +9,97 @@ class Settings(BaseSettings):
     ADMIN_PASSWORD: str = "admin" # Default password for initial setup
     SECRET_KEY: str = "change_me_super_secret" # For session/JWT
     
+    # Updates: "polling" (default) or "webhook"
+    BOT_MODE: str = "polling"
+    WEBHOOK_URL: str = "" # Public base URL, e.g. https://relay.example.com
+    WEBHOOK_PATH: str = "/telegram/webhook"
+    WEBHOOK_SECRET: str = "" # Checked against X-Telegram-Bot-Api-Secret-Token, derived from BOT_TOKEN if empty
+    
+    # Update processing: updates are sharded by chat, in order within a chat
+    UPDATE_SHARDS: int = 16 # Chats handled in parallel
+    UPDATE_QUEUE_SIZE: int = 100 # Queued updates per shard
+    UPDATE_OVERFLOW: str = "auto" # Full shard: "block" (intake pauses), "drop", or "auto" = drop for webhooks, block for polling
+    
+    # Multi-process mode (python -m app.cluster), 0 = everything in one process
+    CLUSTER_WORKERS: int = 0 # Bot worker processes, updates are sharded between them by chat
+    CLUSTER_INGEST_PORT: int = 8081 # Webhook port of the ingest process
+    CLUSTER_BATCH: int = 100 # Updates a worker takes from the queue table at once
+    CLUSTER_POLL_MS: int = 50 # Worker poll interval while its queue is empty
+    CLUSTER_MAX_PENDING: int = 10000 # Ingest pauses (or drops, see UPDATE_OVERFLOW) above this
+    EVENT_POLL_MS: int = 1000 # How quickly rule edits, bans etc. reach the other processes
+    
+    # Outbound Telegram API limits
+    OUTBOUND_GLOBAL_RATE: float = 25 # Calls per second, whole bot
+    OUTBOUND_CHAT_RATE: float = 1 # Calls per second, per chat
+    OUTBOUND_CHAT_BURST: int = 5 # Calls a chat may burst above its rate
+    OUTBOUND_MAX_RETRIES: int = 3 # Retries after a 429 (flood control)
+    
+    # Rules
+    RULE_TIME_BUDGET_MS: int = 50 # A regex rule slower than this on one message is disabled afterwards (not a time limit: that search still runs to the end)
+    RULE_LAB_SAMPLES: int = 1000 # Recent messages kept in memory for rule dry runs (0 = none)
+    RULE_LAB_TIMEOUT: int = 30 # Seconds a dry run may take
+    KEYWORD_ACTION: str = "block" # What a message containing a bad word gets when no rule decided: block or drop
+    
+    # Outbox: forwards and replies are stored first, then delivered with retries
+    OUTBOX_CONCURRENCY: int = 64 # Deliveries in flight at once (per process)
+    OUTBOX_MAX_ATTEMPTS: int = 8 # Failed attempts before an item becomes a dead letter
+    OUTBOX_BACKOFF_BASE: float = 2 # Seconds before the first retry, doubled each time
+    OUTBOX_BACKOFF_MAX: float = 600 # Longest wait between two retries
+    OUTBOX_KEEP_HOURS: int = 24 # Delivered items are kept this long (duplicate detection)
+    
+    # Broadcasts (rate limited by the OUTBOUND_* limits above, lowest priority)
+    BROADCAST_BATCH: int = 50 # Recipients read per page
+    BROADCAST_CONCURRENCY: int = 10 # Sends in flight at once; progress is saved after each such chunk
+    
+    # Only the first message of a burst gets an info card; a burst ends
+    # after this many seconds without a message. 0 = card for every message.
+    INFO_CARD_WINDOW: int = 60
+    
+    # Album items arriving within this window are forwarded together
+    ALBUM_WAIT_MS: int = 500
+    
     # Database
     RELAYCAT_DB_URL: str = "sqlite+aiosqlite:///data/relaycat.db"
+    DB_PROFILE: str = "balanced" # "default", "safe", "balanced" or "fast", see app/database/profiles.py
+    
+    # Message route retention (0 = no limit)
+    ROUTE_RETENTION_DAYS: int = 0 # Opt in: older routes are deleted, replies to them then fall back to the info card text
+    ROUTE_MAX_ROWS: int = 0
+    RETENTION_BATCH_SIZE: int = 5000 # Rows deleted per transaction
+    RETENTION_INTERVAL: int = 3600 # Seconds between retention runs
+    SQLITE_VACUUM: bool = False # Full VACUUM in the daily housekeeping; locks out every writer while it runs, only for a maintenance window
+    
+    # Flood protection defaults, editable on the settings page
+    FLOOD_LIMIT: int = 20 # Messages per user within FLOOD_WINDOW, 0 = off
+    FLOOD_WINDOW: int = 10 # Seconds
+    FLOOD_MUTE: int = 60 # First auto-mute in seconds, doubles on every repeat
+    FLOOD_MAX_MUTE: int = 3600
+    
+    # Verification challenges: prebuilt layouts, callback data signed per user
+    VERIFY_POOL_SIZE: int = 256 # Keyboard layouts per period
+    VERIFY_TTL: int = 600 # Seconds per period; a challenge expires after one to two periods
+    VERIFY_SECRET: str = "" # HMAC key of the callback data, derived from BOT_TOKEN if empty
+    
+    # New users and verified flags are written in batches in the background
+    USER_BATCH_SIZE: int = 500 # Flush once this many changes are queued
+    USER_FLUSH_MS: int = 50 # ...or this long after the first one was queued
+    
+    # Caching
+    USER_CACHE_SIZE: int = 10000 # Max cached User rows
+    CACHE_TTL: int = 300 # Seconds before a cached row is re-read from the DB
+    
+    # Message routes are written in batches in the background
+    ROUTE_BATCH_SIZE: int = 500 # Flush once this many routes are queued
+    ROUTE_FLUSH_MS: int = 50 # ...or this long after the first one was queued
+    
+    # Recent routes kept in memory for admin replies
+    ROUTE_INDEX_SIZE: int = 50000
+    ROUTE_INDEX_MAX_AGE: int = 86400 # Seconds
+    ROUTE_INDEX_WARM: int = 5000 # Newest routes loaded at startup
+    
+    # Monitoring
+    METRICS_TOKEN: str = "" # If set, /metrics requires "Authorization: Bearer <token>"
+    SLOW_UPDATE_MS: int = 1000 # Updates slower than this are logged, 0 = off
     
     # Feature Flags
     ENABLE_FORWARDING: bool = True
@@ -1,14 +1,32 @@
+from urllib.parse import urlencode
+
 from fastapi import APIRouter, Request, Form, Depends, HTTPException, status
 from fastapi.templating import Jinja2Templates
-from fastapi.responses import RedirectResponse
+from fastapi.responses import RedirectResponse, StreamingResponse
 from sqlalchemy import func, delete
 from sqlalchemy.future import select
 
 from app.database.core import AsyncSessionLocal
-from app.database.models import User, MessageRoute, Rule, Setting
+from app.database.models import User, MessageRoute, Rule, Setting, Broadcast
 from app.settings import settings
+from app.bot.rules import rule_engine
+from app.bot.rule_lab import validate_pattern, parse_corpus, dry_run
+from app.database.cache import get_setting, cache_setting, cache_stats
+from app.bot.outbound import outbound
+from app.bot.coalesce import info_cards
+from app.database.stats import stats, dashboard_trends
+from app.bot.flood import flood_guard, FLOOD_SETTINGS
+from app.database.events import events
+from app.bot.broadcast import broadcaster
+from app.bot.moderation import set_banned
+from app.database.users import list_users, user_dict, PAGE_SIZE
+from app.database.words import parse_word_list, count_words, find_words, import_words, delete_words, export_words
+from app.bot.keywords import keyword_filter, event_payload
+from app.bot.outbox import outbox, ACTIVE, DEAD
 
 router = APIRouter()
+MAX_CORPUS_BYTES = 5 * 1024 * 1024
+MAX_WORD_LIST_BYTES = 20 * 1024 * 1024
 templates = Jinja2Templates(directory="app/templates")
 
 # Simple dependency to check cookie/session
@@ -38,41 +56,109 @@ async def dashboard(request: Request, user=Depends(get_current_user)):
     if not user:
         return RedirectResponse(url="/login", status_code=303)
         
-    async with AsyncSessionLocal() as session:
-        # Stats
-        user_count = await session.scalar(select(func.count(User.id)))
-        msg_count = await session.scalar(select(func.count(MessageRoute.id)))
-        
-        user_count = user_count or 0
-        msg_count = msg_count or 0
+    # Stats, kept incrementally (app/database/stats.py) instead of count(*) scans
+    totals = await stats.totals()
+    trends = await dashboard_trends()
 
+    async with AsyncSessionLocal() as session:
         # Recent users
         result = await session.execute(select(User).order_by(User.created_at.desc()).limit(10))
         users = result.scalars().all()
         
     return templates.TemplateResponse("index.html", {
         "request": request,
-        "user_count": user_count,
-        "msg_count": msg_count,
+        "user_count": totals.get("users", 0),
+        "msg_count": totals.get("messages", 0),
+        "blocked_count": totals.get("blocked", 0),
+        "trends": trends,
         "users": users
     })
 
-# ... (previous imports)
+def _flag(value: str | None) -> bool | None:
+    """Filter query parameter: "1" / "0", anything else means no filter."""
+    return {"1": True, "0": False}.get(value or "")
 
-@router.get("/rules")
-async def rules_page(request: Request, user=Depends(get_current_user)):
+@router.get("/users")
+async def users_page(request: Request, q: str = "", verified: str = "", banned: str = "", cursor: str = "",
+                     user=Depends(get_current_user)):
     if not user: return RedirectResponse("/login", status_code=303)
+    users, next_cursor = await list_users(q, _flag(verified), _flag(banned), cursor)
+    return templates.TemplateResponse("users.html", {
+        "request": request,
+        "users": users,
+        "next_cursor": next_cursor,
+        "q": q,
+        "verified": verified,
+        "banned": banned,
+        "cursor": cursor,
+    })
+
+@router.get("/api/users")
+async def users_api(request: Request, q: str = "", verified: str = "", banned: str = "", cursor: str = "",
+                    limit: int = PAGE_SIZE, user=Depends(get_current_user)):
+    if not user: raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED)
+    users, next_cursor = await list_users(q, _flag(verified), _flag(banned), cursor, max(1, min(limit, 500)))
+    return {"users": [user_dict(u) for u in users], "next_cursor": next_cursor}
+
+@router.post("/users/ban")
+async def ban_users(request: Request, user=Depends(get_current_user)):
+    return await _bulk_ban(request, True, user)
+
+@router.post("/users/unban")
+async def unban_users(request: Request, user=Depends(get_current_user)):
+    return await _bulk_ban(request, False, user)
+
+async def _bulk_ban(request: Request, banned: bool, user):
+    if not user: return RedirectResponse("/login", status_code=303)
+    form = await request.form()
+    user_ids = [int(v) for v in form.getlist("user_ids") if v.isdigit()]
+    await set_banned(user_ids, banned)
+    # Back to the same page of the list
+    next_url = form.get("next") or ""
+    if not next_url.startswith("/users"):
+        next_url = "/users"
+    return RedirectResponse(next_url, status_code=303)
+
+@router.post("/ban_user")
+async def ban_user(request: Request, user_id: int = Form(...), user=Depends(get_current_user)):
+    if not user: return RedirectResponse("/login", status_code=303)
+    await set_banned([user_id], True)
+    return RedirectResponse("/", status_code=303)
+
+@router.post("/unban_user")
+async def unban_user(request: Request, user_id: int = Form(...), user=Depends(get_current_user)):
+    if not user: return RedirectResponse("/login", status_code=303)
+    await set_banned([user_id], False)
+    return RedirectResponse("/", status_code=303)
+
+
+async def render_rules(request: Request, **extra):
     async with AsyncSessionLocal() as session:
         result = await session.execute(select(Rule).order_by(Rule.id.desc()))
         rules = result.scalars().all()
-    return templates.TemplateResponse("rules.html", {"request": request, "rules": rules})
+    return templates.TemplateResponse("rules.html", {
+        "request": request,
+        "rules": rules,
+        "samples": len(rule_engine.samples),
+        **extra,
+    })
+
+@router.get("/rules")
+async def rules_page(request: Request, user=Depends(get_current_user)):
+    if not user: return RedirectResponse("/login", status_code=303)
+    return await render_rules(request)
 
 @router.post("/rules/add")
 async def add_rule(request: Request, rule_type: str = Form(...), pattern: str = Form(...), action: str = Form(...), user=Depends(get_current_user)):
     if not user: return RedirectResponse("/login", status_code=303)
+    error = await validate_pattern(rule_type, pattern.strip())
+    if error:
+        return await render_rules(request, error=error, rejected=pattern)
     async with AsyncSessionLocal() as session:
         session.add(Rule(rule_type=rule_type, pattern=pattern.strip(), action=action))
         await session.commit()
+    rule_engine.invalidate()
+    await events.publish("rules")
     return RedirectResponse("/rules", status_code=303)
 
 @router.post("/rules/delete")
@@ -81,6 +167,8 @@ async def delete_rule(request: Request, rule_id: int = Form(...), user=Depends(g
     async with AsyncSessionLocal() as session:
         await session.execute(delete(Rule).where(Rule.id == rule_id))
         await session.commit()
+    rule_engine.invalidate()
+    await events.publish("rules")
     return RedirectResponse("/rules", status_code=303)
 
 @router.post("/rules/toggle")
@@ -91,12 +179,18 @@ async def toggle_rule(request: Request, rule_id: int = Form(...), user=Depends(g
         rule = result.scalar_one_or_none()
         if rule:
             rule.is_active = not rule.is_active
+            rule.disabled_reason = None
             await session.commit()
+    rule_engine.invalidate()
+    await events.publish("rules")
     return RedirectResponse("/rules", status_code=303)
 
 @router.post("/rules/update")
 async def update_rule(request: Request, rule_id: int = Form(...), rule_type: str = Form(...), pattern: str = Form(...), action: str = Form(...), user=Depends(get_current_user)):
     if not user: return RedirectResponse("/login", status_code=303)
+    error = await validate_pattern(rule_type, pattern.strip())
+    if error:
+        return await render_rules(request, error=error, rejected=pattern)
     async with AsyncSessionLocal() as session:
         result = await session.execute(select(Rule).where(Rule.id == rule_id))
         rule = result.scalar_one_or_none()
@@ -104,31 +198,240 @@ async def update_rule(request: Request, rule_id: int = Form(...), rule_type: str
             rule.rule_type = rule_type
             rule.pattern = pattern.strip()
             rule.action = action
+            rule.disabled_reason = None
             await session.commit()
+    rule_engine.invalidate()
+    await events.publish("rules")
     return RedirectResponse("/rules", status_code=303)
 
+@router.post("/rules/lab")
+async def rule_lab(request: Request, user=Depends(get_current_user)):
+    """Dry run of the active rules, optionally plus a proposed one, against a corpus."""
+    if not user: return RedirectResponse("/login", status_code=303)
+    form = await request.form()
+    upload = form.get("corpus_file")
+    if upload is not None and getattr(upload, "filename", ""):
+        corpus = parse_corpus((await upload.read(MAX_CORPUS_BYTES)).decode("utf-8", "replace"))
+    elif (form.get("corpus_text") or "").strip():
+        corpus = parse_corpus(form.get("corpus_text"))
+    else:
+        corpus = list(rule_engine.samples)
+    if not corpus:
+        return await render_rules(request, error="The corpus is empty: upload a file, paste messages or wait for some traffic.")
+
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(select(Rule).where(Rule.is_active == True).order_by(Rule.id))
+        rules = [
+            {"id": r.id, "rule_type": r.rule_type, "pattern": r.pattern, "action": r.action}
+            for r in result.scalars().all()
+        ] if form.get("include_active") else []
+    pattern = (form.get("pattern") or "").strip()
+    if pattern:
+        rule_type = form.get("rule_type") or "message_content"
+        error = await validate_pattern(rule_type, pattern)
+        if error:
+            return await render_rules(request, error=error, rejected=pattern)
+        rules.append({"id": 0, "rule_type": rule_type, "pattern": pattern, "action": form.get("action") or "block"})
+    if not rules:
+        return await render_rules(request, error="No rules to test: include the active rules or propose one.")
+
+    try:
+        report = await dry_run(rules, corpus)
+    except TimeoutError:
+        return await render_rules(request, error=f"The dry run took longer than {settings.RULE_LAB_TIMEOUT}s and was stopped.")
+    return await render_rules(request, report=report)
+
+async def render_words(request: Request, q: str = "", **extra):
+    return templates.TemplateResponse("words.html", {
+        "request": request,
+        "q": q,
+        "total": await count_words(),
+        "words": await find_words(q),
+        "filter_stats": keyword_filter.stats(),
+        "action": settings.KEYWORD_ACTION,
+        **extra,
+    })
+
+async def check_regex_words(rows: list) -> str | None:
+    for word, is_regex in rows:
+        if is_regex and (error := await validate_pattern("message_content", word)):
+            return f"re:{word} — {error}"
+    return None
+
+@router.get("/words")
+async def words_page(request: Request, q: str = "", user=Depends(get_current_user)):
+    if not user: return RedirectResponse("/login", status_code=303)
+    return await render_words(request, q.strip())
+
+@router.post("/words/add")
+async def add_word(request: Request, word: str = Form(...), is_regex: bool = Form(False), user=Depends(get_current_user)):
+    if not user: return RedirectResponse("/login", status_code=303)
+    rows = [(word.strip(), is_regex)] if word.strip() else []
+    if error := await check_regex_words(rows):
+        return await render_words(request, error=error)
+    inserted, _ = await import_words(rows)
+    keyword_filter.add(inserted)
+    await events.publish("bad_words", event_payload(added=inserted))
+    return RedirectResponse("/words", status_code=303)
+
+@router.post("/words/delete")
+async def delete_bad_words(request: Request, user=Depends(get_current_user)):
+    if not user: return RedirectResponse("/login", status_code=303)
+    form = await request.form()
+    removed = await delete_words([int(i) for i in form.getlist("word_ids") if i.isdigit()])
+    keyword_filter.remove(removed)
+    await events.publish("bad_words", event_payload(removed=removed))
+    q = form.get("q") or ""
+    return RedirectResponse(f"/words?{urlencode({'q': q})}" if q else "/words", status_code=303)
+
+@router.post("/words/import")
+async def import_bad_words(request: Request, user=Depends(get_current_user)):
+    """One word per line, from an uploaded file or the text box; "re:" marks a regex."""
+    if not user: return RedirectResponse("/login", status_code=303)
+    form = await request.form()
+    upload = form.get("file")
+    if upload is not None and getattr(upload, "filename", ""):
+        raw = (await upload.read(MAX_WORD_LIST_BYTES)).decode("utf-8-sig", "replace")
+    else:
+        raw = form.get("text") or ""
+    rows = parse_word_list(raw)
+    if not rows:
+        return await render_words(request, error="The word list is empty.")
+    if error := await check_regex_words(rows):
+        return await render_words(request, error=error)
+
+    replace = bool(form.get("replace"))
+    inserted, deleted = await import_words(rows, replace=replace)
+    if replace:
+        await keyword_filter.reload()
+        await events.publish("bad_words", "reload")
+    else:
+        keyword_filter.add(inserted)
+        await events.publish("bad_words", event_payload(added=inserted))
+    return await render_words(
+        request, message=f"Imported {len(inserted)} of {len(rows)} words" + (f", replacing {deleted}." if replace else ".")
+    )
+
+@router.get("/words/export")
+async def export_bad_words(request: Request, user=Depends(get_current_user)):
+    if not user: return RedirectResponse("/login", status_code=303)
+    return StreamingResponse(
+        export_words(), media_type="text/plain; charset=utf-8",
+        headers={"Content-Disposition": 'attachment; filename="bad_words.txt"'},
+    )
+
 @router.get("/settings")
 async def settings_page(request: Request, user=Depends(get_current_user)):
     if not user: return RedirectResponse("/login", status_code=303)
-    async with AsyncSessionLocal() as session:
-        res = await session.execute(select(Setting).where(Setting.key == "confirm_reply"))
-        setting = res.scalar_one_or_none()
-        confirm_reply = (setting.value == "true") if setting else False
-    return templates.TemplateResponse("settings.html", {"request": request, "confirm_reply": confirm_reply})
+    confirm_reply = await get_setting("confirm_reply") == "true"
+    flood = {key: int(await get_setting(key, str(default))) for key, default in FLOOD_SETTINGS.items()}
+    return templates.TemplateResponse("settings.html", {
+        "request": request,
+        "confirm_reply": confirm_reply,
+        "flood": flood,
+        "flood_stats": flood_guard.stats(),
+    })
 
 @router.post("/settings/update")
 async def update_settings(request: Request, user=Depends(get_current_user)):
     if not user: return RedirectResponse("/login", status_code=303)
     form = await request.form()
-    confirm_reply = "true" if form.get("confirm_reply") else "false"
+    values = {"confirm_reply": "true" if form.get("confirm_reply") else "false"}
+    for key in FLOOD_SETTINGS:
+        raw = (form.get(key) or "").strip()
+        if raw.isdigit():
+            values[key] = raw
     
     async with AsyncSessionLocal() as session:
         # Upsert
-        s = await session.execute(select(Setting).where(Setting.key == "confirm_reply"))
-        setting = s.scalar_one_or_none()
-        if not setting:
-            session.add(Setting(key="confirm_reply", value=confirm_reply))
-        else:
-            setting.value = confirm_reply
+        result = await session.execute(select(Setting).where(Setting.key.in_(values)))
+        existing = {setting.key: setting for setting in result.scalars().all()}
+        for key, value in values.items():
+            if key in existing:
+                existing[key].value = value
+            else:
+                session.add(Setting(key=key, value=value))
         await session.commit()
+    for key, value in values.items():
+        cache_setting(key, value)
+    await flood_guard.load()
+    await events.publish("settings")
     return RedirectResponse("/settings", status_code=303)
+
+async def recent_broadcasts(limit: int = 20) -> list[Broadcast]:
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(select(Broadcast).order_by(Broadcast.id.desc()).limit(limit))
+        return result.scalars().all()
+
+@router.get("/broadcasts")
+async def broadcasts_page(request: Request, user=Depends(get_current_user)):
+    if not user: return RedirectResponse("/login", status_code=303)
+    return templates.TemplateResponse("broadcasts.html", {"request": request, "broadcasts": await recent_broadcasts()})
+
+@router.post("/broadcasts/create")
+async def create_broadcast(request: Request, text: str = Form(...), user=Depends(get_current_user)):
+    if not user: return RedirectResponse("/login", status_code=303)
+    if text.strip():
+        await broadcaster.create(text=text.strip())
+    return RedirectResponse("/broadcasts", status_code=303)
+
+@router.post("/broadcasts/cancel")
+async def cancel_broadcast(request: Request, broadcast_id: int = Form(...), user=Depends(get_current_user)):
+    if not user: return RedirectResponse("/login", status_code=303)
+    await broadcaster.cancel(broadcast_id)
+    return RedirectResponse("/broadcasts", status_code=303)
+
+@router.get("/broadcasts/progress")
+async def broadcast_progress_api(request: Request, user=Depends(get_current_user)):
+    if not user: raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED)
+    return [
+        {"id": b.id, "status": b.status, "total": b.total, "sent": b.sent, "failed": b.failed, "blocked": b.blocked}
+        for b in await recent_broadcasts()
+    ]
+
+def _outbox_ids(form) -> list[int]:
+    return [int(i) for i in form.getlist("item_ids") if i.isdigit()]
+
+@router.get("/outbox")
+async def outbox_page(request: Request, user=Depends(get_current_user)):
+    if not user: return RedirectResponse("/login", status_code=303)
+    return templates.TemplateResponse("outbox.html", {
+        "request": request,
+        "counts": await outbox.counts(),
+        "active": await outbox.items(ACTIVE),
+        "dead": await outbox.items((DEAD,)),
+        "max_attempts": outbox.max_attempts,
+    })
+
+@router.post("/outbox/retry")
+async def retry_outbox(request: Request, user=Depends(get_current_user)):
+    if not user: return RedirectResponse("/login", status_code=303)
+    form = await request.form()
+    if form.get("all_dead"):
+        await outbox.retry()
+    elif item_ids := _outbox_ids(form):
+        await outbox.retry(item_ids)
+    return RedirectResponse("/outbox", status_code=303)
+
+@router.post("/outbox/discard")
+async def discard_outbox(request: Request, user=Depends(get_current_user)):
+    if not user: return RedirectResponse("/login", status_code=303)
+    if item_ids := _outbox_ids(await request.form()):
+        await outbox.discard(item_ids)
+    return RedirectResponse("/outbox", status_code=303)
+
+@router.get("/outbox/stats")
+async def outbox_stats_api(request: Request, user=Depends(get_current_user)):
+    if not user: raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED)
+    return {**outbox.stats(), "counts": await outbox.counts()}
+
+@router.get("/cache/stats")
+async def cache_stats_api(request: Request, user=Depends(get_current_user)):
+    if not user: raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED)
+    return cache_stats()
+
+
+@router.get("/outbound/stats")
+async def outbound_stats_api(request: Request, user=Depends(get_current_user)):
+    if not user: raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED)
+    return {**outbound.stats(), "info_cards": info_cards.stats()}
\ No newline at end of file
@@ -0,0 +1,134 @@
+"""
+Multi-process mode (app.cluster) on one machine.
+
+For each worker count, starts that many `app.cluster` worker processes,
+with FakeSession as their Telegram backend, against one SQLite file. This
+process plays the ingest side: it writes synthetic text messages from
+verified users to the update_queue table through UpdateSink, then waits
+until the outbox has forwarded every message. Reports updates/s and
+checks that every user's messages reached the admin in the order they
+were sent (any worker may deliver them, so the fake message ids come
+from a clock all the processes share).
+As in bench_e2e the outbound rate limiter is not installed.
+
+    python -m benchmarks.bench_cluster
+    python -m benchmarks.bench_cluster --workers 1 2 4 --users 500 --messages 20 --latency-ms 20
+"""
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import time
+
+from benchmarks import common  # noqa: F401  (env setup)
+
+os.environ.setdefault("RELAYCAT_CLUSTER_WORKERS", "1")  # UpdateSink/EventBus need cluster mode
+
+
+def worker_main(shard: int, latency: float):
+    """Entry point of the child processes."""
+    from benchmarks.fakes import FakeSession
+    from app.bot.loader import bot, dp
+    from app import cluster
+
+    bot.session = FakeSession(latency=latency)
+    # Telegram numbers the admin chat's messages globally, not per worker
+    bot.session._ids = iter(time.monotonic_ns, None)
+    asyncio.run(cluster.run_worker(shard))
+
+
+async def run(workers: int, users: int, messages: int, latency_ms: float) -> dict:
+    from sqlalchemy import delete, func, insert
+    from sqlalchemy.future import select
+
+    from benchmarks.updates import UpdateFactory
+    from app.settings import settings
+    from app.bot.loader import bot, dp
+    from app.cluster import UpdateSink
+    from app.database.core import init_db, AsyncSessionLocal
+    from app.database.models import User, MessageRoute, QueuedUpdate, OutboxItem
+    from app.bot.outbox import DONE
+
+    await init_db()
+    async with AsyncSessionLocal() as session:
+        for model in (MessageRoute, QueuedUpdate, OutboxItem, User):
+            await session.execute(delete(model))
+        await session.execute(insert(User), [
+            {"id": 10_000 + i, "first_name": f"User{i}", "is_verified": True} for i in range(users)
+        ])
+        await session.commit()
+
+    env = {**os.environ, "RELAYCAT_CLUSTER_WORKERS": str(workers)}
+    logs = [os.path.join(common.BENCH_DIR, f"worker-{workers}-{i}.log") for i in range(workers)]
+    children = []
+    for i, log in enumerate(logs):
+        with open(log, "w") as f:
+            children.append(subprocess.Popen(
+                [sys.executable, "-m", "benchmarks.bench_cluster", "--child", str(i), "--latency-ms", str(latency_ms)],
+                env=env, stdout=f, stderr=subprocess.STDOUT,
+            ))
+    for log, child in zip(logs, children):
+        while "started" not in open(log).read():
+            if child.poll() is not None:
+                raise RuntimeError(f"Worker exited during startup, see {log}")
+            await asyncio.sleep(0.1)
+
+    factory = UpdateFactory(bot, settings.ADMIN_ID)
+    sink = UpdateSink(dp, bot, workers, max_pending=10**9, overflow="block")
+    total = users * messages
+    start = time.perf_counter()
+    for n in range(messages):
+        for i in range(users):
+            await sink.submit(factory.text(10_000 + i, f"message {n}"))
+        await sink.flush()
+
+    while True:
+        async with AsyncSessionLocal() as session:
+            delivered = await session.scalar(
+                select(func.count(OutboxItem.id)).where(OutboxItem.kind == "forward", OutboxItem.status == DONE)
+            )
+        if delivered >= total:
+            break
+        await asyncio.sleep(0.05)
+    took = time.perf_counter() - start
+
+    for child in children:
+        child.terminate()
+    for child in children:
+        child.wait()
+
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(
+            select(MessageRoute.user_id, MessageRoute.user_message_id, MessageRoute.admin_message_id)
+            .order_by(MessageRoute.user_id, MessageRoute.user_message_id)
+        )
+        rows = result.all()
+    out_of_order, last = 0, {}
+    for user_id, _, admin_message_id in rows:
+        if admin_message_id < last.get(user_id, 0):
+            out_of_order += 1
+        last[user_id] = admin_message_id
+    return {"updates": total, "seconds": took, "per_s": total / took, "out_of_order": out_of_order}
+
+
+async def main(args):
+    print(f"{args.users} users x {args.messages} messages, Telegram latency {args.latency_ms} ms")
+    for workers in args.workers:
+        r = await run(workers, args.users, args.messages, args.latency_ms)
+        print(f"  {workers} worker(s): {r['per_s']:7,.0f} updates/s ({r['seconds']:.1f}s), "
+              f"{r['out_of_order']} messages out of order")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--messages", type=int, default=10)
+    parser.add_argument("--latency-ms", type=float, default=20)
+    parser.add_argument("--child", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child is not None:
+        worker_main(args.child, args.latency_ms / 1000)
+    else:
+        asyncio.run(main(args))
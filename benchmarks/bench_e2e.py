@@ -0,0 +1,247 @@
+"""
+End-to-end relay throughput: synthetic updates through dp.feed_update.
+
+The bot's session is replaced by FakeSession (no network, every call is
+recorded), the database is a fresh SQLite file. Phases run in order, each
+with `--concurrency` updates in flight:
+
+    start    new users send /start
+    verify   they tap the right button
+    text     verified users send `--messages` texts each (a few are spam)
+    album    a tenth of the users send a 3-photo album
+    reply    the admin replies to forwarded messages
+
+Reports updates/s per phase, p50/p95/p99 per handler, and SQL queries and
+connection checkouts per update (made while handling the update,
+including tasks it started; background writers and outbox deliveries are
+counted separately). With one session per update (app/bot/unit_of_work.py)
+an update checks out at most one connection. `--assert-max-queries N`
+exits with an error if any update of any phase made more than N queries,
+so a change that adds round trips per message fails the run
+(tests/test_unit_of_work.py checks the same for a text update).
+Handlers only queue forwards and replies in the outbox; each phase ends
+when the outbox has delivered everything, so updates/s include
+delivery. The outbound rate limiter is not installed, so this measures
+RelayCat, not Telegram's limits.
+
+    python -m benchmarks.bench_e2e
+    python -m benchmarks.bench_e2e --users 5000 --concurrency 64 --out results.json
+    python -m benchmarks.bench_e2e --users 200 --assert-max-queries 2
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+from collections import defaultdict
+from contextvars import ContextVar
+from datetime import datetime
+
+from benchmarks.common import BENCH_DIR, summarize
+from benchmarks.fakes import FakeSession
+from benchmarks.updates import UpdateFactory
+
+from sqlalchemy import event
+from sqlalchemy.future import select
+
+from app.settings import settings
+from app.bot.loader import bot, dp
+from app.database.core import engine, init_db, AsyncSessionLocal
+from app.database.models import MessageRoute
+from app.database.route_writer import route_writer
+from app.database.user_writer import user_writer
+from app.database.stats import stats
+from app.bot.albums import album_buffer
+from app.bot.outbox import outbox, PENDING, SENDING
+from app.bot.rules import rule_engine
+from app.bot.keywords import keyword_filter
+import app.bot.handlers  # noqa: F401  (registers the handlers)
+
+WORDS = "hello there can you help me with my order it has not arrived yet thanks a lot".split()
+
+# Queries are counted into the dict of the update being handled
+_current: ContextVar[dict | None] = ContextVar("bench_current_update", default=None)
+background_queries = [0]
+
+
+def count_queries(conn, cursor, statement, parameters, context, executemany):
+    counter = _current.get()
+    if counter is None:
+        background_queries[0] += 1
+    else:
+        counter["queries"] += 1
+
+
+def count_checkouts(dbapi_connection, connection_record, connection_proxy):
+    counter = _current.get()
+    if counter is not None:
+        counter["connections"] += 1
+
+
+class HandlerTimer:
+    """Inner middleware: time spent in each handler, by handler name."""
+
+    def __init__(self):
+        self.samples: dict = defaultdict(list)
+
+    async def __call__(self, handler, event, data):
+        name = data["handler"].callback.__name__
+        # Admin replies go through handle_user_message
+        if name == "handle_user_message" and event.from_user.id == settings.ADMIN_ID:
+            name = "handle_admin_reply"
+        start = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            self.samples[name].append(time.perf_counter() - start)
+
+
+async def drain_outbox():
+    while True:
+        counts = await outbox.counts()
+        if not outbox.queued and not counts[PENDING] and not counts[SENDING]:
+            return
+        await asyncio.sleep(0.01)
+
+
+async def run_phase(name: str, updates: list, concurrency: int, results: dict):
+    """Feeds `updates` (single updates or lists fed back to back) with `concurrency` in flight."""
+    queue = list(reversed(updates))
+    latencies, queries = [], []
+
+    async def feed(update):
+        counter = {"queries": 0, "connections": 0}
+        token = _current.set(counter)
+        start = time.perf_counter()
+        try:
+            await dp.feed_update(bot, update)
+        finally:
+            _current.reset(token)
+        latencies.append(time.perf_counter() - start)
+        queries.append(counter)
+
+    async def worker():
+        while queue:
+            item = queue.pop()
+            if isinstance(item, list):
+                for update in item:
+                    await feed(update)
+            else:
+                await feed(item)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    # Albums are forwarded after ALBUM_WAIT_MS, let them finish inside the phase
+    if album_buffer._tasks:
+        await asyncio.gather(*album_buffer._tasks)
+    await drain_outbox()
+    took = time.perf_counter() - start
+
+    counts = [c["queries"] for c in queries]
+    connections = [c["connections"] for c in queries]
+    results[name] = {
+        "updates": len(latencies),
+        "seconds": took,
+        "updates_per_s": len(latencies) / took if took else 0.0,
+        "latency": summarize(latencies),
+        "queries_per_update": sum(counts) / len(counts) if counts else 0.0,
+        "max_queries_per_update": max(counts, default=0),
+        "connections_per_update": sum(connections) / len(connections) if connections else 0.0,
+        "max_connections_per_update": max(connections, default=0),
+    }
+    print(f"{name:7} {len(latencies):6,} updates  {results[name]['updates_per_s']:8,.0f}/s  "
+          f"p50 {results[name]['latency']['p50_ms']:6.2f} ms  p99 {results[name]['latency']['p99_ms']:7.2f} ms  "
+          f"{results[name]['queries_per_update']:.2f} queries/update (max {results[name]['max_queries_per_update']}), "
+          f"{results[name]['connections_per_update']:.2f} connections/update")
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--messages", type=int, default=5, help="texts per user")
+    parser.add_argument("--replies", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--out", default=os.path.join(BENCH_DIR, "bench_e2e.json"))
+    parser.add_argument("--assert-max-queries", type=int, default=None, metavar="N",
+                        help="fail if an update made more than N SQL queries")
+    args = parser.parse_args()
+
+    session = FakeSession()
+    bot.session = session
+    timer = HandlerTimer()
+    dp.message.middleware(timer)
+    dp.callback_query.middleware(timer)
+    event.listen(engine.sync_engine, "before_cursor_execute", count_queries)
+    event.listen(engine.sync_engine, "checkout", count_checkouts)
+
+    await init_db()
+    # Loaded at startup by the bot, not by the first message
+    await rule_engine.get()
+    await keyword_filter.load()
+    route_writer.start()
+    user_writer.start()
+    outbox.start()
+    factory = UpdateFactory(bot, settings.ADMIN_ID)
+    rng = random.Random(1)
+    users = [10_000 + i for i in range(args.users)]
+
+    def text():
+        if rng.random() < 0.02:
+            return "加V 日结 兼职"  # caught by the default rules
+        return " ".join(rng.choices(WORDS, k=rng.randint(3, 12)))
+
+    phases = {}
+    await run_phase("start", [factory.start(u) for u in users], args.concurrency, phases)
+    await run_phase("verify", [factory.verify(u) for u in users], args.concurrency, phases)
+    await run_phase("text", [factory.text(u, text()) for _ in range(args.messages) for u in users],
+                    args.concurrency, phases)
+    await run_phase("album", [factory.album(u, 3) for u in users[::10]], args.concurrency, phases)
+
+    await route_writer.flush()
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(select(MessageRoute.admin_message_id).order_by(MessageRoute.id.desc()).limit(args.replies))
+        targets = result.scalars().all()
+    await run_phase("reply", [factory.admin_reply(t, "Thanks, looking into it") for t in targets],
+                    args.concurrency, phases)
+
+    await outbox.stop()
+    await route_writer.stop()
+    await user_writer.stop()
+    await stats.flush()
+
+    total_updates = sum(p["updates"] for p in phases.values())
+    total_seconds = sum(p["seconds"] for p in phases.values())
+    handlers = {name: summarize(samples) for name, samples in sorted(timer.samples.items())}
+    print(f"\ntotal   {total_updates:6,} updates  {total_updates / total_seconds:8,.0f}/s, "
+          f"{background_queries[0]} background queries, {session.count()} Telegram calls, outbox {outbox.stats()}")
+    for name, s in handlers.items():
+        print(f"  {name:22} n={s['count']:6,}  p50 {s['p50_ms']:6.2f}  p95 {s['p95_ms']:6.2f}  p99 {s['p99_ms']:7.2f} ms")
+
+    report = {
+        "date": datetime.utcnow().isoformat(timespec="seconds"),
+        "args": vars(args),
+        "updates": total_updates,
+        "updates_per_s": total_updates / total_seconds,
+        "phases": phases,
+        "handlers": handlers,
+        "background_queries": background_queries[0],
+        "telegram_calls": {name: session.count(name) for name in sorted({c[0] for c in session.calls})},
+    }
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nsaved {args.out}")
+
+    if args.assert_max_queries is not None:
+        over = {name: p["max_queries_per_update"] for name, p in phases.items()
+                if p["max_queries_per_update"] > args.assert_max_queries}
+        if over:
+            print(f"FAILED: more than {args.assert_max_queries} queries in one update: "
+                  + ", ".join(f"{name} ({n})" for name, n in over.items()))
+            sys.exit(1)
+        print(f"OK: no update made more than {args.assert_max_queries} queries")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
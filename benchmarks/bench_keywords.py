@@ -0,0 +1,152 @@
+"""
+Keyword filter (app/bot/keywords.py) with large word lists.
+
+For 1k, 10k and 100k synthetic words (Chinese, Latin and mixed) it times
+building the automaton and matching messages of 50, 500 and 4096
+characters, next to the alternatives: one `in` test per word, and the
+merged-trie regex the rule engine uses for keyword rules. Match time
+should stay flat as the word count grows.
+
+Then, through the database: loading 100k bad_words rows, and applying
+single and bulk changes (the bulk one triggers a rebuild in a thread).
+
+    python -m benchmarks.bench_keywords
+    python -m benchmarks.bench_keywords --words 200000
+"""
+import argparse
+import asyncio
+import random
+import string
+import time
+
+from benchmarks.common import timeit
+
+from sqlalchemy import insert
+
+from app.database.core import init_db, AsyncSessionLocal
+from app.database.models import BadWord
+from app.bot.keywords import Automaton, KeywordFilter, normalize
+from app.bot.rules import _trie_regex
+
+import re
+
+LENGTHS = [50, 500, 4096]
+MESSAGES = 200
+CJK = [chr(c) for c in range(0x4E00, 0x4E00 + 3000)]
+
+
+def make_words(n: int, rng: random.Random) -> list[str]:
+    words = set()
+    while len(words) < n:
+        kind = rng.random()
+        if kind < 0.5:
+            words.add("".join(rng.choices(CJK, k=rng.randint(2, 4))))
+        elif kind < 0.9:
+            words.add("".join(rng.choices(string.ascii_lowercase, k=rng.randint(5, 12))))
+        else:
+            words.add("".join(rng.choices(CJK, k=2)) + "".join(rng.choices(string.ascii_lowercase, k=3)))
+    return sorted(words)
+
+
+def make_messages(rng: random.Random, words: list, length: int) -> list[str]:
+    messages = []
+    alphabet = CJK[:500] + list(string.ascii_letters + "  ,.!")
+    for i in range(MESSAGES):
+        text = "".join(rng.choices(alphabet, k=length))
+        if i % 10 == 0:  # some spam, with the word in full width / upper case
+            word = rng.choice(words)
+            variant = word.upper().translate({c: c + 0xFEE0 for c in range(0x21, 0x7F)}) if i % 20 == 0 else word
+            pos = rng.randrange(max(1, length - len(variant)))
+            text = text[:pos] + variant + text[pos + len(variant):]
+        messages.append(text[:length])
+    return messages
+
+
+def naive(words: list, text: str) -> bool:
+    text = normalize(text)
+    return any(word in text for word in words)
+
+
+def first_hit(automaton: Automaton, text: str) -> bool:
+    return next(automaton.find_all(normalize(text)), None) is not None
+
+
+def compare(sizes: list, rng: random.Random):
+    print(f"{'words':>7} {'build s':>8} {'states':>9} {'msg len':>8} "
+          f"{'AC µs':>9} {'in-test µs':>11} {'trie re µs':>11}")
+    for n in sizes:
+        words = make_words(n, rng)
+        start = time.perf_counter()
+        automaton = Automaton(words)
+        build = time.perf_counter() - start
+        try:
+            start = time.perf_counter()
+            trie = re.compile(_trie_regex(words))
+            trie_build = time.perf_counter() - start
+        except (re.error, RecursionError, OverflowError):
+            trie, trie_build = None, 0.0
+
+        for length in LENGTHS:
+            messages = make_messages(rng, words, length)
+            for text in messages:  # same answers first
+                assert first_hit(automaton, text) == naive(words, text)
+            ac = timeit(lambda: [first_hit(automaton, m) for m in messages], repeat=3) / MESSAGES
+            # The per-word test gets slow fast, fewer messages are enough
+            sample = messages[:max(5, MESSAGES * 1000 // n // 10)]
+            slow = timeit(lambda: [naive(words, m) for m in sample], repeat=1) / len(sample)
+            regex = (timeit(lambda: [trie.search(normalize(m)) for m in messages], repeat=3) / MESSAGES
+                     if trie is not None else None)
+            regex_col = f"{regex * 1e6:>11.1f}" if regex is not None else f"{'n/a':>11}"
+            print(f"{n:>7} {build:>8.2f} {len(automaton.word_at):>9} {length:>8} "
+                  f"{ac * 1e6:>9.1f} {slow * 1e6:>11.1f} {regex_col}")
+        if trie is not None:
+            print(f"{'':>7} (trie regex compile: {trie_build:.2f}s)")
+
+
+async def incremental(n: int, rng: random.Random):
+    await init_db()
+    words = make_words(n, rng)
+    async with AsyncSessionLocal() as session:
+        for low in range(0, n, 10000):
+            await session.execute(insert(BadWord), [{"word": w, "is_regex": False} for w in words[low:low + 10000]])
+        await session.commit()
+
+    keywords = KeywordFilter()
+    start = time.perf_counter()
+    await keywords.load()
+    print(f"\nload {n:,} rows from the database and build: {time.perf_counter() - start:.2f}s")
+
+    def timed(label, fn):
+        start = time.perf_counter()
+        fn()
+        print(f"{label:<44} {(time.perf_counter() - start) * 1000:>8.2f} ms  {keywords.stats()}")
+
+    new = [(w, False) for w in make_words(20000, random.Random(7)) if w not in keywords.words]
+    timed("add 1 word", lambda: keywords.add(new[:1]))
+    assert keywords.find("xx" + new[0][0].upper() + "xx")
+    timed("add 100 more words", lambda: keywords.add(new[1:101]))
+    timed("remove 1 word (of the big automaton)", lambda: keywords.remove([(words[0], False)]))
+    assert keywords.find(words[0]) is None
+    timed("remove 1 word (of the pending ones)", lambda: keywords.remove(new[:1]))
+    assert keywords.find(new[0][0]) is None
+
+    start = time.perf_counter()
+    keywords.add(new[101:])
+    queued = time.perf_counter() - start
+    while keywords._merge_task and not keywords._merge_task.done():
+        await asyncio.sleep(0.01)
+    print(f"{f'add {len(new) - 101:,} words (rebuild in a thread)':<44} {queued * 1000:>8.2f} ms "
+          f"to queue, {time.perf_counter() - start:.2f}s until rebuilt  {keywords.stats()}")
+    assert keywords.find(new[-1][0]) and keywords.find(new[1][0]) and keywords.find(words[0]) is None
+
+
+def main(args):
+    rng = random.Random(42)
+    compare([1000, 10000, args.words], rng)
+    asyncio.run(incremental(args.words, rng))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--words", type=int, default=100_000)
+    main(parser.parse_args())
@@ -0,0 +1,122 @@
+"""
+Exercises the outbound scheduler (app.bot.outbound) against FakeSession.
+
+1. flood: the fake answers the first calls into a chat with 429s, every
+   call must still go through after retry_after.
+2. retry_after: with the default per-chat burst of 5, the retry after a
+   429 and a call queued behind it must both wait out all of retry_after.
+3. burst: forwards + info cards to the admin while replies go to users;
+   replies must not wait behind the forward backlog, and neither the
+   global nor the per-chat rate may be exceeded.
+
+    python -m benchmarks.bench_outbound
+"""
+import asyncio
+import time
+
+from benchmarks import common  # noqa: F401  (env setup)
+from benchmarks.fakes import FakeSession
+
+from aiogram import Bot
+
+from app.bot.outbound import OutboundScheduler, Priority, outbound_priority
+
+ADMIN = 1
+
+
+def make_bot(session: FakeSession, scheduler: OutboundScheduler) -> Bot:
+    bot = Bot(token="123456:bench-token", session=session)
+    bot.session.middleware(scheduler)
+    return bot
+
+
+def max_in_window(times: list, window: float = 1.0) -> int:
+    times = sorted(times)
+    best, lo = 0, 0
+    for hi, t in enumerate(times):
+        while t - times[lo] >= window:
+            lo += 1
+        best = max(best, hi - lo + 1)
+    return best
+
+
+async def flood():
+    session = FakeSession(flood_chats={ADMIN: 3}, retry_after=1)
+    scheduler = OutboundScheduler(global_rate=30, chat_rate=20, chat_burst=5)
+    bot = make_bot(session, scheduler)
+    start = time.perf_counter()
+    await asyncio.gather(*(bot.send_message(ADMIN, f"msg {i}") for i in range(10)))
+    took = time.perf_counter() - start
+    assert session.count("SendMessage") == 10, session.calls
+    assert scheduler.retried == 3 and scheduler.failed == 0, scheduler.stats()
+    print(f"flood: 10 sends, {session.floods} x 429 absorbed, {took:.2f}s, stats={scheduler.stats()}")
+
+
+async def retry_after(wait: int = 3):
+    session = FakeSession(flood_chats={ADMIN: 1}, retry_after=wait)
+    scheduler = OutboundScheduler(global_rate=30, chat_rate=1, chat_burst=5)
+    bot = make_bot(session, scheduler)
+
+    async def later():
+        await asyncio.sleep(0.1)  # sent while the chat is paused
+        await bot.send_message(ADMIN, "queued")
+
+    await asyncio.gather(bot.send_message(ADMIN, "first"), later())
+    flooded_at = session.flood_calls[0][1]
+    gaps = [t - flooded_at for _, _, t in session.calls]
+    print(f"retry_after: 429 with retry_after={wait}, next calls after {', '.join(f'{g:.2f}s' for g in gaps)}")
+    assert len(gaps) == 2 and min(gaps) >= wait, gaps
+
+
+async def burst(forwards: int = 120, replies: int = 20, global_rate: float = 30):
+    session = FakeSession(latency=0.005)
+    scheduler = OutboundScheduler(global_rate=global_rate, chat_rate=1, chat_burst=5)
+    bot = make_bot(session, scheduler)
+    done = {}
+
+    async def forward(i):
+        with outbound_priority(Priority.FORWARD):
+            # One admin chat alone is capped at 1/s. Spread the forwards over
+            # 40 chats so the global rate is the bottleneck.
+            await bot.send_message(ADMIN + 1000 + i % 40, f"fwd {i}")
+        done.setdefault("forward", []).append(time.perf_counter())
+
+    async def reply(i):
+        await asyncio.sleep(0.2)  # arrives after the forward backlog built up
+        with outbound_priority(Priority.REPLY):
+            await bot.send_message(50_000 + i, f"reply {i}")
+        done.setdefault("reply", []).append(time.perf_counter())
+
+    start = time.perf_counter()
+    await asyncio.gather(*(forward(i) for i in range(forwards)), *(reply(i) for i in range(replies)))
+    total = time.perf_counter() - start
+
+    stats = scheduler.stats()
+    times = [t for _, _, t in session.calls]
+    per_chat: dict = {}
+    for _, chat_id, t in session.calls:
+        per_chat.setdefault(chat_id, []).append(t)
+
+    worst_global = max_in_window(times)
+    worst_chat = max(max_in_window(ts) for ts in per_chat.values())
+    reply_done = max(done["reply"]) - start
+    fwd_done = max(done["forward"]) - start
+    print(f"burst: {forwards} forwards + {replies} replies in {total:.2f}s")
+    print(f"  replies all done after {reply_done:.2f}s, forwards after {fwd_done:.2f}s")
+    print(f"  max calls in 1s: global {worst_global} (rate {global_rate}), per chat {worst_chat}")
+    for lane, s in stats["lanes"].items():
+        if s["avg_wait_ms"]:
+            print(f"  {lane:8} avg wait {s['avg_wait_ms']:8.1f} ms, max {s['max_wait_ms']:8.1f} ms")
+    assert reply_done < fwd_done / 2, "replies waited behind forwards"
+    assert worst_global <= global_rate
+    assert worst_chat <= 1 + 5
+
+
+async def main():
+    await flood()
+    await retry_after()
+    await burst()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,104 @@
+"""
+message_routes lookup latency at scale, old vs new index layout.
+
+old: separate indexes on user_id and admin_message_id (the original models)
+new: one covering index on (admin_message_id, user_id)
+
+Builds each layout in its own SQLite file with plain sqlite3 (so only the
+database is measured), then times the admin-reply lookup
+`SELECT user_id ... WHERE admin_message_id = ?` for random recent and old
+ids, the insert rate, and the file size.
+
+    python -m benchmarks.bench_route_lookup              # 1M rows
+    python -m benchmarks.bench_route_lookup --rows 10000000
+"""
+import argparse
+import os
+import random
+import sqlite3
+import time
+
+from benchmarks.common import BENCH_DIR, summarize
+
+LAYOUTS = {
+    "old": [
+        "CREATE INDEX ix_message_routes_user_id ON message_routes (user_id)",
+        "CREATE INDEX ix_message_routes_admin_message_id ON message_routes (admin_message_id)",
+    ],
+    "new": [
+        "CREATE INDEX ix_message_routes_admin_user ON message_routes (admin_message_id, user_id)",
+    ],
+}
+LOOKUP = "SELECT user_id FROM message_routes WHERE admin_message_id = ? LIMIT 1"
+
+
+def remove(path: str):
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+
+def build(path: str, layout: str, rows: int) -> float:
+    remove(path)
+    db = sqlite3.connect(path)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute(
+        "CREATE TABLE message_routes (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id BIGINT, "
+        "admin_message_id BIGINT, user_message_id BIGINT, created_at DATETIME)"
+    )
+    for ddl in LAYOUTS[layout]:
+        db.execute(ddl)
+    rng = random.Random(1)
+    start = time.perf_counter()
+    chunk = 100_000
+    for base in range(0, rows, chunk):
+        db.executemany(
+            "INSERT INTO message_routes (user_id, admin_message_id, user_message_id, created_at) "
+            "VALUES (?, ?, ?, datetime('now'))",
+            ((rng.randrange(1, 200_000), i, i) for i in range(base, min(rows, base + chunk))),
+        )
+        db.commit()
+    took = time.perf_counter() - start
+    db.execute("ANALYZE")
+    db.close()
+    return took
+
+
+def lookups(path: str, ids: list) -> dict:
+    db = sqlite3.connect(path)
+    samples = []
+    for admin_message_id in ids:
+        start = time.perf_counter()
+        db.execute(LOOKUP, (admin_message_id,)).fetchone()
+        samples.append(time.perf_counter() - start)
+    plan = " / ".join(row[-1] for row in db.execute("EXPLAIN QUERY PLAN " + LOOKUP, (1,)))
+    db.close()
+    return {**summarize(samples), "plan": plan}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--lookups", type=int, default=20_000)
+    args = parser.parse_args()
+
+    rng = random.Random(2)
+    recent = [rng.randrange(max(0, args.rows - 50_000), args.rows) for _ in range(args.lookups)]
+    anywhere = [rng.randrange(0, args.rows) for _ in range(args.lookups)]
+
+    print(f"{args.rows:,} rows, {args.lookups:,} lookups per run")
+    for layout in LAYOUTS:
+        path = os.path.join(BENCH_DIR, f"routes_{layout}.db")
+        insert = build(path, layout, args.rows)
+        size = os.path.getsize(path) / 1e6
+        hot = lookups(path, recent)
+        cold = lookups(path, anywhere)
+        print(f"\n[{layout}] insert {args.rows / insert:,.0f} rows/s, file {size:,.0f} MB")
+        print(f"  plan: {hot['plan']}")
+        for name, r in (("recent", hot), ("random", cold)):
+            print(f"  {name:7} p50 {r['p50_ms'] * 1000:6.1f} µs  p99 {r['p99_ms'] * 1000:6.1f} µs")
+        remove(path)
+
+
+if __name__ == "__main__":
+    main()
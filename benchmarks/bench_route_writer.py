@@ -0,0 +1,76 @@
+"""
+Forwarded messages per second, as far as route bookkeeping goes.
+
+Old: one session + commit for the two MessageRoute rows of every message.
+New: RouteWriter.add() twice per message, background batches.
+
+Both run against a fresh SQLite file (the default sqlite+aiosqlite URL
+shape). The new path is timed until every route is committed.
+
+    python -m benchmarks.bench_route_writer [messages]
+"""
+import asyncio
+import sys
+import time
+
+from benchmarks.common import BENCH_DIR
+
+from sqlalchemy import func
+from sqlalchemy.future import select
+
+from app.database.core import init_db, AsyncSessionLocal
+from app.database.models import MessageRoute
+from app.database.route_writer import RouteWriter
+
+
+async def count_routes() -> int:
+    async with AsyncSessionLocal() as session:
+        return await session.scalar(select(func.count(MessageRoute.id)))
+
+
+async def old_path(messages: int, offset: int):
+    for i in range(messages):
+        async with AsyncSessionLocal() as session:
+            session.add(MessageRoute(user_id=i % 50, admin_message_id=offset + 2 * i, user_message_id=i))
+            session.add(MessageRoute(user_id=i % 50, admin_message_id=offset + 2 * i + 1, user_message_id=i))
+            await session.commit()
+
+
+async def new_path(messages: int, offset: int):
+    writer = RouteWriter(batch_size=500, flush_interval=0.05)
+    writer.start()
+    for i in range(messages):
+        writer.add(i % 50, offset + 2 * i, i)
+        writer.add(i % 50, offset + 2 * i + 1, i)
+        # Queued routes must resolve before they are written
+        assert writer.lookup(offset + 2 * i) == i % 50
+        if i % 100 == 0:
+            await asyncio.sleep(0)  # let the flusher run, like real handlers would
+    await writer.stop()
+    return writer
+
+
+async def main():
+    messages = int(sys.argv[1]) if len(sys.argv) > 1 else 2500
+    await init_db()
+    print(f"SQLite file in {BENCH_DIR}, {messages} messages ({messages * 2} routes)")
+
+    before = await count_routes()
+    start = time.perf_counter()
+    await old_path(messages, offset=0)
+    old = time.perf_counter() - start
+    assert await count_routes() - before == messages * 2
+
+    before = await count_routes()
+    start = time.perf_counter()
+    writer = await new_path(messages, offset=10_000_000)
+    new = time.perf_counter() - start
+    assert await count_routes() - before == messages * 2
+
+    print(f"old: {messages / old:10.0f} msg/s  ({old:.2f}s, {messages} commits)")
+    print(f"new: {messages / new:10.0f} msg/s  ({new:.2f}s, {writer.batches} batches)")
+    print(f"speedup: {old / new:.1f}x")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
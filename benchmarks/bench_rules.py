@@ -0,0 +1,98 @@
+"""
+Old vs new rule evaluation.
+
+Old: re.search() on the raw pattern string of every active rule, one by one
+(what check_rules did, minus the per-message SELECT).
+New: CompiledRules from app.bot.rules (compiled once, keyword rules merged
+into one trie alternation, the rest searched with precompiled patterns).
+
+The synthetic rule set is mostly keyword lists, like the seeded defaults,
+with some URL, username and backreference regexes mixed in.
+
+    python -m benchmarks.bench_rules
+"""
+import random
+import re
+import string
+from types import SimpleNamespace
+
+from benchmarks.common import timeit
+
+from app.bot.rules import CompiledRules
+
+SIZES = [10, 100, 1000]
+MESSAGES = 300
+
+
+def make_rules(n: int, rng: random.Random) -> tuple:
+    rules, vocab = [], []
+    for i in range(n):
+        kind = i % 10
+        word = "".join(rng.choices(string.ascii_lowercase, k=8))
+        if kind == 0:
+            rule_type, pattern = "username", f"{word}(bot|admin)"
+        elif kind == 1:
+            rule_type, pattern = "message_content", rf"https?://{word}\.\w+/"
+        elif kind == 2:
+            rule_type, pattern = "message_content", rf"(\w)\1{{3,}}{word}"  # backref, kept standalone
+        else:
+            alts = "|".join("".join(rng.choices(string.ascii_lowercase, k=6)) for _ in range(3))
+            rule_type, pattern = "message_content", f"({word}|{alts})"
+            vocab.append(word)
+        action = ("block", "drop", "allow")[i % 3]
+        rules.append(SimpleNamespace(id=i + 1, rule_type=rule_type, pattern=pattern, action=action))
+    return rules, vocab
+
+
+def make_messages(rng: random.Random, vocab: list) -> list:
+    msgs = []
+    for _ in range(MESSAGES):
+        words = ["".join(rng.choices(string.ascii_lowercase, k=rng.randint(2, 9))) for _ in range(rng.randint(3, 30))]
+        if rng.random() < 0.1:  # some spam that hits one or more rules
+            words += rng.sample(vocab, min(3, len(vocab)))
+            rng.shuffle(words)
+        msgs.append((" ".join(words), "".join(rng.choices(string.ascii_lowercase, k=10)), False))
+    return msgs
+
+
+def old_check(rules, text, username, is_forwarded):
+    for rule in rules:
+        matched = False
+        try:
+            if rule.rule_type == "message_content":
+                if re.search(rule.pattern, text): matched = True
+            elif rule.rule_type == "username":
+                if re.search(rule.pattern, username): matched = True
+            elif rule.rule_type == "is_forwarded":
+                if is_forwarded and rule.pattern == "true": matched = True
+        except Exception:
+            continue
+        if matched:
+            return rule.action
+    return None
+
+
+def main():
+    rng = random.Random(42)
+    print(f"{'rules':>6} {'old µs/msg':>12} {'new µs/msg':>12} {'speedup':>8} {'compile ms':>11}")
+    for n in SIZES:
+        rules, vocab = make_rules(n, rng)
+        messages = make_messages(rng, vocab)
+        compile_time = timeit(lambda: CompiledRules(rules), repeat=3)
+        compiled = CompiledRules(rules)
+
+        # Same answers first, speed second
+        for text, username, fwd in messages:
+            hit = compiled.match(text, username, fwd)
+            assert (hit.action if hit else None) == old_check(rules, text, username, fwd)
+
+        # Beyond 512 distinct patterns re's internal cache thrashes and the
+        # old path recompiles on every call; that is part of what we measure.
+        old = timeit(lambda: [old_check(rules, *m) for m in messages], repeat=1)
+        new = timeit(lambda: [compiled.match(*m) for m in messages], repeat=3)
+        print(f"{n:>6} {old / MESSAGES * 1e6:>12.1f} {new / MESSAGES * 1e6:>12.1f} "
+              f"{old / new:>7.1f}x {compile_time * 1000:>11.1f}")
+
+
+if __name__ == "__main__":
+    main()
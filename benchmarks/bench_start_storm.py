@@ -0,0 +1,131 @@
+"""
+Join flood: `--users` new users send /start and solve the challenge.
+
+First times the challenge itself: building a keyboard per /start the old
+way (InlineKeyboardBuilder, verify:<emoji>) against picking a prebuilt
+layout from the pool and signing its buttons for the user, and checking
+an answer by parsing the message text against checking the signed
+callback data. Then feeds the storm through
+dp.feed_update like bench_e2e (FakeSession, fresh SQLite file): every
+user sends /start, then taps the challenge, `--wrong` of them a wrong
+button first. Reports updates/s, p50/p99 and SQL queries per update per
+phase, plus how many batches user_writer needed to write the new users
+and verified flags, and checks that all of them reached the database.
+
+    python -m benchmarks.bench_start_storm
+    python -m benchmarks.bench_start_storm --users 50000 --concurrency 512 --latency-ms 20
+"""
+import argparse
+import asyncio
+import random
+import time
+
+from benchmarks.common import timeit
+from benchmarks.bench_e2e import run_phase, count_queries, count_checkouts, background_queries
+from benchmarks.fakes import FakeSession
+from benchmarks.updates import UpdateFactory
+
+from aiogram.utils.keyboard import InlineKeyboardBuilder
+from sqlalchemy import event, func
+from sqlalchemy.future import select
+
+from app.settings import settings
+from app.bot.loader import bot
+from app.bot.verification import EMOJIS, ChallengePool, challenge_pool
+from app.database.core import engine, init_db, AsyncSessionLocal
+from app.database.models import User
+from app.database.route_writer import route_writer
+from app.database.user_writer import user_writer
+from app.bot.outbox import outbox
+from app.bot.rules import rule_engine
+from app.bot.keywords import keyword_filter
+
+
+def legacy_challenge():
+    """The keyboard /start used to build for every new user."""
+    target = random.choice(EMOJIS)
+    options = [target] + [random.choice(EMOJIS) for _ in range(8)]
+    random.shuffle(options)
+    builder = InlineKeyboardBuilder()
+    for emoji in options:
+        builder.button(text=emoji, callback_data=f"verify:{emoji}")
+    builder.adjust(3)
+    return target, builder.as_markup()
+
+
+def legacy_check(data: str, text: str) -> bool:
+    target = text.split("tap the")[1].strip().split(" ")[0]
+    return data.split(":")[1] == target
+
+
+def microbench(n: int):
+    text = "Welcome! To prove you are human, please tap the 🍎 button below:"
+    # Its own pool, so the storm's counters stay clean
+    pool = ChallengePool(b"microbench", settings.VERIFY_POOL_SIZE, settings.VERIFY_TTL)
+    token = pool.challenge(1).markup.inline_keyboard[0][0].callback_data
+    cases = {
+        "build keyboard (legacy)": lambda: legacy_challenge(),
+        "pick from pool, sign for user": lambda: pool.challenge(1),
+        "check by parsing text (legacy)": lambda: legacy_check("verify:🍎", text),
+        "check signed token": lambda: pool.check(token, 1),
+    }
+    for name, fn in cases.items():
+        took = timeit(fn, number=n)
+        print(f"{name:32} {took / n * 1e6:8.2f} µs")
+    print()
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=10_000)
+    parser.add_argument("--concurrency", type=int, default=256)
+    parser.add_argument("--wrong", type=float, default=0.1, help="share of users tapping a wrong button first")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="latency of every Telegram call")
+    args = parser.parse_args()
+
+    microbench(10_000)
+
+    bot.session = FakeSession(latency=args.latency_ms / 1000)
+    event.listen(engine.sync_engine, "before_cursor_execute", count_queries)
+    event.listen(engine.sync_engine, "checkout", count_checkouts)
+    await init_db()
+    await rule_engine.get()
+    await keyword_filter.load()
+    route_writer.start()
+    user_writer.start()
+    outbox.start()
+    factory = UpdateFactory(bot, settings.ADMIN_ID)
+    rng = random.Random(1)
+    users = [50_000_000 + i for i in range(args.users)]
+
+    def taps(user_id: int):
+        if rng.random() < args.wrong:
+            return [factory.verify(user_id, correct=False), factory.verify(user_id)]
+        return factory.verify(user_id)
+
+    phases = {}
+    start = time.perf_counter()
+    await run_phase("start", [factory.start(u) for u in users], args.concurrency, phases)
+    await run_phase("verify", [taps(u) for u in users], args.concurrency, phases)
+    await user_writer.stop()
+    took = time.perf_counter() - start
+
+    async with AsyncSessionLocal() as db:
+        created = (await db.execute(select(func.count()).select_from(User).where(User.id >= users[0]))).scalar()
+        verified = (await db.execute(
+            select(func.count()).select_from(User).where(User.id >= users[0], User.is_verified.is_(True))
+        )).scalar()
+    await outbox.stop()
+    await route_writer.stop()
+
+    updates = sum(p["updates"] for p in phases.values())
+    print(f"\nstorm   {updates:6,} updates in {took:.2f}s, {updates / took:,.0f}/s")
+    print(f"user_writer {user_writer.stats()}, {background_queries[0]} background queries")
+    print(f"challenges {challenge_pool.stats()}")
+    print(f"database: {created:,} of {args.users:,} users created, {verified:,} verified")
+    if created != args.users or verified != args.users:
+        raise SystemExit("FAILED: users or verified flags missing")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,132 @@
+"""
+Concurrent bot writes and dashboard reads against each storage profile
+(app.database.profiles).
+
+Writers do what a busy bot does per update: one short transaction that
+inserts a message route and touches a user row. Readers run the dashboard
+queries (user count, recent users, stat counters) in a loop. Reports
+operations per second, latency percentiles and "database is locked"
+errors for both sides.
+
+    python -m benchmarks.bench_storage
+    python -m benchmarks.bench_storage --profiles default balanced --seconds 5
+    python -m benchmarks.bench_storage --url postgresql+asyncpg://user:pw@localhost/bench
+"""
+import argparse
+import asyncio
+import os
+import random
+import time
+from datetime import datetime
+
+from benchmarks.common import BENCH_DIR, summarize
+
+from sqlalchemy import func, insert, update
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlalchemy.future import select
+
+from app.database.models import Base, User, MessageRoute, StatCounter
+from app.database.profiles import PROFILES, create_engine
+
+USERS = 20_000
+ROUTES = 200_000
+
+
+async def prepare(engine):
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+        now = datetime.utcnow()
+        await conn.execute(insert(User), [
+            {"id": i, "first_name": f"user{i}", "is_verified": True, "created_at": now}
+            for i in range(1, USERS + 1)
+        ])
+        for base in range(0, ROUTES, 50_000):
+            await conn.execute(insert(MessageRoute), [
+                {"user_id": i % USERS + 1, "admin_message_id": i, "user_message_id": i, "created_at": now}
+                for i in range(base, base + 50_000)
+            ])
+        await conn.execute(insert(StatCounter), [{"key": "users", "value": USERS}])
+
+
+class Side:
+    def __init__(self):
+        self.latencies = []
+        self.locked = 0
+        self.errors = 0
+
+    async def run(self, op, deadline: float):
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                await op()
+            except OperationalError as e:
+                if "locked" in str(e) or "busy" in str(e):
+                    self.locked += 1
+                else:
+                    self.errors += 1
+                continue
+            self.latencies.append(time.perf_counter() - start)
+
+
+async def run_profile(url: str, profile: str, writers: int, readers: int, seconds: float) -> dict:
+    engine = create_engine(url, profile)
+    await prepare(engine)
+    sessions = async_sessionmaker(engine, expire_on_commit=False)
+    rng = random.Random(1)
+    next_id = [ROUTES]
+
+    async def write():
+        next_id[0] += 1
+        msg_id = next_id[0]
+        user_id = rng.randrange(1, USERS + 1)
+        async with sessions() as session:
+            await session.execute(insert(MessageRoute).values(
+                user_id=user_id, admin_message_id=msg_id, user_message_id=msg_id, created_at=datetime.utcnow()
+            ))
+            await session.execute(update(User).where(User.id == user_id).values(is_verified=True))
+            await session.commit()
+
+    async def read():
+        async with sessions() as session:
+            await session.scalar(select(func.count(User.id)))
+            await session.execute(select(User).order_by(User.created_at.desc()).limit(10))
+            await session.execute(select(StatCounter.key, StatCounter.value))
+
+    w, r = Side(), Side()
+    deadline = time.perf_counter() + seconds
+    await asyncio.gather(
+        *(w.run(write, deadline) for _ in range(writers)),
+        *(r.run(read, deadline) for _ in range(readers)),
+    )
+    await engine.dispose()
+    return {
+        "writes": {**summarize(w.latencies), "per_s": len(w.latencies) / seconds, "locked": w.locked, "errors": w.errors},
+        "reads": {**summarize(r.latencies), "per_s": len(r.latencies) / seconds, "locked": r.locked, "errors": r.errors},
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--profiles", nargs="+", default=list(PROFILES))
+    parser.add_argument("--url", help="database to use instead of a fresh SQLite file per profile")
+    parser.add_argument("--writers", type=int, default=8)
+    parser.add_argument("--readers", type=int, default=4)
+    parser.add_argument("--seconds", type=float, default=10)
+    args = parser.parse_args()
+
+    print(f"{args.writers} writers, {args.readers} readers, {args.seconds:.0f}s per profile, "
+          f"{USERS:,} users / {ROUTES:,} routes preloaded")
+    for profile in args.profiles:
+        url = args.url or f"sqlite+aiosqlite:///{os.path.join(BENCH_DIR, f'storage_{profile}.db')}"
+        result = await run_profile(url, profile, args.writers, args.readers, args.seconds)
+        print(f"\n[{profile}]")
+        for side in ("writes", "reads"):
+            s = result[side]
+            print(f"  {side:6} {s['per_s']:8,.0f}/s  p50 {s['p50_ms']:7.2f} ms  p99 {s['p99_ms']:8.2f} ms  "
+                  f"locked {s['locked']}  other errors {s['errors']}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
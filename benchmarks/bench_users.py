@@ -0,0 +1,107 @@
+"""
+User directory (app/database/users.py) on a large users table.
+
+Fills a fresh database with `--users` synthetic users (a tenth unverified,
+1% banned), then times the queries behind the /users page: first and deep
+pages, the verified/banned filters, name and id searches, plus one bulk
+ban of a full page. The target is under 50 ms per page at 1M users.
+
+    python -m benchmarks.bench_users
+    python -m benchmarks.bench_users --users 100000 --repeat 50
+"""
+import argparse
+import asyncio
+import random
+import time
+from datetime import datetime, timedelta
+
+from benchmarks.common import summarize
+
+from sqlalchemy import insert
+
+from app.database.core import init_db, AsyncSessionLocal
+from app.database.models import User
+from app.database.users import list_users
+from app.bot.moderation import set_banned
+
+FIRST = ["Alice", "Bob", "Carol", "Dave", "Erin", "Frank", "Grace", "Heidi", "Ivan", "Judy", "小明", "Мария"]
+LAST = ["Smith", "Jones", "Brown", "Taylor", "Wilson", None, None, "Müller", "Garcia", "王"]
+
+
+async def fill(n: int):
+    rng = random.Random(1)
+    start = datetime.utcnow() - timedelta(days=365)
+    step = timedelta(days=365) / n
+    chunk = 20000
+    for low in range(0, n, chunk):
+        rows = []
+        for i in range(low, min(n, low + chunk)):
+            first = rng.choice(FIRST)
+            rows.append({
+                "id": 100_000_000 + i * 7,
+                "username": f"{first.lower()}_{rng.randrange(10**6)}" if rng.random() < 0.7 else None,
+                "first_name": first,
+                "last_name": rng.choice(LAST),
+                "is_verified": rng.random() > 0.1,
+                "is_banned": rng.random() < 0.01,
+                "created_at": start + step * i,
+            })
+        async with AsyncSessionLocal() as session:
+            await session.execute(insert(User), rows)
+            await session.commit()
+
+
+async def timed(repeat: int, fn) -> dict:
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        await fn()
+        samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+
+async def main(args):
+    await init_db()
+    start = time.perf_counter()
+    await fill(args.users)
+    print(f"Inserted {args.users:,} users (with search index) in {time.perf_counter() - start:.1f}s\n")
+
+    # A cursor from deep in the table
+    deep_cursor = None
+    users, cursor = await list_users()
+    for _ in range(20):
+        users, cursor = await list_users(cursor=cursor, limit=500)
+    deep_cursor = cursor
+
+    cases = {
+        "first page": lambda: list_users(),
+        "deep page (cursor)": lambda: list_users(cursor=deep_cursor),
+        "verified only": lambda: list_users(verified=True),
+        "unverified only": lambda: list_users(verified=False),
+        "banned only": lambda: list_users(banned=True),
+        "banned, deep page": lambda: list_users(banned=True, cursor=deep_cursor),
+        "search 'alice' (broad)": lambda: list_users("alice"),
+        "search 'alice smi'": lambda: list_users("alice smi"),
+        "search username prefix": lambda: list_users("grace_1234"),
+        "search id prefix": lambda: list_users("1000007"),
+        "search, no match": lambda: list_users("zzzzqx"),
+        "search + banned filter": lambda: list_users("bob", banned=True),
+    }
+    print(f"{'query':<26} {'rows':>5} {'p50 ms':>8} {'p95 ms':>8}")
+    for name, fn in cases.items():
+        rows = len((await fn())[0])
+        r = await timed(args.repeat, fn)
+        flag = "" if r["p95_ms"] < 50 else "  > 50 ms"
+        print(f"{name:<26} {rows:>5} {r['p50_ms']:>8.2f} {r['p95_ms']:>8.2f}{flag}")
+
+    page, _ = await list_users(verified=True)
+    ids = [u.id for u in page]
+    r = await timed(1, lambda: set_banned(ids, True))
+    print(f"\nbulk ban of {len(ids)} users (one UPDATE): {r['p50_ms']:.2f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=1_000_000)
+    parser.add_argument("--repeat", type=int, default=20)
+    asyncio.run(main(parser.parse_args()))
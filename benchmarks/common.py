@@ -0,0 +1,47 @@
+"""
+Shared setup for the benchmark scripts.
+
+Import this before anything from `app`: it points RelayCat at a throwaway
+data dir and fills in the settings a real deployment would provide.
+Run benchmarks from the repo root, e.g. `python -m benchmarks.bench_rules`.
+"""
+import os
+import statistics
+import tempfile
+import time
+
+BENCH_DIR = tempfile.mkdtemp(prefix="relaycat-bench-")
+
+os.environ.setdefault("RELAYCAT_BOT_TOKEN", "123456:bench-token")
+os.environ.setdefault("RELAYCAT_ADMIN_ID", "1")
+os.environ.setdefault("RELAYCAT_DATA_DIR", BENCH_DIR)
+os.environ.setdefault("RELAYCAT_DB_URL", f"sqlite+aiosqlite:///{BENCH_DIR}/relaycat.db")
+
+
+def timeit(fn, repeat: int = 5, number: int = 1) -> float:
+    """Best-of-`repeat` wall time in seconds for `number` calls of fn()."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def percentile(samples: list, pct: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    idx = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[idx]
+
+
+def summarize(samples: list) -> dict:
+    return {
+        "count": len(samples),
+        "mean_ms": statistics.fmean(samples) * 1000 if samples else 0.0,
+        "p50_ms": percentile(samples, 50) * 1000,
+        "p95_ms": percentile(samples, 95) * 1000,
+        "p99_ms": percentile(samples, 99) * 1000,
+    }
@@ -0,0 +1,75 @@
+"""
+A stand-in for aiogram's HTTP session: no network, every call is recorded
+and answered with a plausible result. It can also play Telegram's flood
+control and answer with 429s, or with 403s for users who blocked the bot.
+"""
+import asyncio
+import itertools
+import time
+from datetime import datetime
+
+from aiogram.client.session.base import BaseSession
+from aiogram.exceptions import TelegramForbiddenError, TelegramRetryAfter
+from aiogram.types import Chat, Message, MessageId, User
+
+
+class FakeSession(BaseSession):
+    def __init__(self, latency: float = 0.0, flood_chats: dict | None = None, retry_after: int = 1,
+                 blocked_chats: set | None = None, deleted_messages: set | None = None):
+        """
+        latency: seconds every call takes
+        flood_chats: {chat_id: n} answers the first n calls into that chat with a 429
+        blocked_chats: chats whose every call is answered with a 403
+        deleted_messages: message ids forward_messages skips, as Telegram does
+        """
+        super().__init__()
+        self.latency = latency
+        self.flood_chats = dict(flood_chats or {})
+        self.retry_after = retry_after
+        self.blocked_chats = set(blocked_chats or ())
+        self.deleted_messages = set(deleted_messages or ())
+        self.calls: list = []  # (method name, chat_id, monotonic time)
+        self.floods = 0
+        self.flood_calls: list = []  # (chat_id, monotonic time) of every 429
+        self._ids = itertools.count(1_000_000)
+
+    async def close(self):
+        pass
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        yield b""
+
+    async def make_request(self, bot, method, timeout=None):
+        name = type(method).__name__
+        chat_id = getattr(method, "chat_id", None)
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.flood_chats.get(chat_id, 0) > 0:
+            self.flood_chats[chat_id] -= 1
+            self.floods += 1
+            self.flood_calls.append((chat_id, time.monotonic()))
+            raise TelegramRetryAfter(method=method, message="Too Many Requests", retry_after=self.retry_after)
+        if chat_id in self.blocked_chats:
+            raise TelegramForbiddenError(method=method, message="Forbidden: bot was blocked by the user")
+        self.calls.append((name, chat_id, time.monotonic()))
+        return self._result(bot, method, chat_id)
+
+    def _result(self, bot, method, chat_id):
+        returning = getattr(method, "__returning__", bool)
+        if returning is Message:
+            return Message(
+                message_id=next(self._ids),
+                date=datetime.now(),
+                chat=Chat(id=chat_id or 0, type="private"),
+                text=getattr(method, "text", None),
+            ).as_(bot)
+        if returning is MessageId:
+            return MessageId(message_id=next(self._ids))
+        if returning == list[MessageId]:
+            return [MessageId(message_id=next(self._ids)) for m in method.message_ids if m not in self.deleted_messages]
+        if returning is User:
+            return User(id=123456, is_bot=True, first_name="RelayCat")
+        return True
+
+    def count(self, name: str | None = None) -> int:
+        return sum(1 for n, _, _ in self.calls if name is None or n == name)
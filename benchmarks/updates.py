@@ -0,0 +1,100 @@
+"""
+Synthetic Telegram updates, shaped like what the Bot API sends RelayCat.
+
+    factory = UpdateFactory(bot, admin_id=1)
+    await dp.feed_update(bot, factory.start(user_id))
+"""
+import itertools
+import time
+
+from aiogram import Bot
+from aiogram.types import Update
+
+from app.bot.verification import EMOJIS, challenge_pool
+
+BOT_ID = 123456
+
+
+def user_json(user_id: int) -> dict:
+    return {"id": user_id, "is_bot": False, "first_name": f"User{user_id}", "username": f"user{user_id}"}
+
+
+class UpdateFactory:
+    def __init__(self, bot: Bot, admin_id: int):
+        self.bot = bot
+        self.admin_id = admin_id
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._media_groups = itertools.count(1)
+
+    def _update(self, **payload) -> Update:
+        return Update.model_validate({"update_id": next(self._update_ids), **payload}, context={"bot": self.bot})
+
+    def _message(self, user_id: int, **fields) -> dict:
+        return {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private", "first_name": f"User{user_id}"},
+            "from": user_json(user_id),
+            **fields,
+        }
+
+    def start(self, user_id: int) -> Update:
+        return self._update(message=self._message(
+            user_id, text="/start", entities=[{"type": "bot_command", "offset": 0, "length": 6}]
+        ))
+
+    def verify(self, user_id: int, correct: bool = True, legacy: bool = False) -> Update:
+        """
+        Tap on the challenge keyboard sent in answer to /start. `legacy`
+        taps a verify:<emoji> button, the format before signed challenges.
+        """
+        if legacy:
+            target = EMOJIS[user_id % len(EMOJIS)]
+            clicked = target if correct else EMOJIS[(user_id + 1) % len(EMOJIS)]
+            data = f"verify:{clicked}"
+        else:
+            challenge = challenge_pool.challenge(user_id)
+            target = challenge.target
+            buttons = [b for row in challenge.markup.inline_keyboard for b in row if (b.text == target) == correct]
+            data = buttons[user_id % len(buttons)].callback_data
+        challenge = {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": BOT_ID, "is_bot": True, "first_name": "RelayCat"},
+            "text": f"Welcome! To prove you are human, please tap the {target} button below:",
+        }
+        return self._update(callback_query={
+            "id": str(next(self._update_ids)),
+            "from": user_json(user_id),
+            "chat_instance": str(user_id),
+            "message": challenge,
+            "data": data,
+        })
+
+    def text(self, user_id: int, text: str) -> Update:
+        return self._update(message=self._message(user_id, text=text))
+
+    def album(self, user_id: int, size: int) -> list:
+        group = str(next(self._media_groups))
+        return [
+            self._update(message=self._message(
+                user_id,
+                media_group_id=group,
+                photo=[{"file_id": f"photo{group}-{i}", "file_unique_id": f"u{group}-{i}", "width": 800, "height": 600}],
+                caption="album" if i == 0 else None,
+            ))
+            for i in range(size)
+        ]
+
+    def admin_reply(self, admin_message_id: int, text: str) -> Update:
+        """Admin replying to the forwarded copy `admin_message_id` in their chat."""
+        forwarded = {
+            "message_id": admin_message_id,
+            "date": int(time.time()),
+            "chat": {"id": self.admin_id, "type": "private"},
+            "from": {"id": BOT_ID, "is_bot": True, "first_name": "RelayCat"},
+            "text": "forwarded",
+        }
+        return self._update(message=self._message(self.admin_id, text=text, reply_to_message=forwarded))
@@ -0,0 +1,46 @@
+import time
+
+from aiogram.types import Update
+from sqlalchemy import delete, event
+
+from app.cluster import UpdateSink
+from app.bot.loader import bot, dp
+from app.database.core import engine, AsyncSessionLocal
+from app.database.models import QueuedUpdate
+
+
+def update(update_id: int) -> Update:
+    return Update.model_validate({"update_id": update_id, "message": {
+        "message_id": update_id, "date": int(time.time()),
+        "chat": {"id": 100 + update_id, "type": "private"},
+        "from": {"id": 100 + update_id, "is_bot": False, "first_name": "User"},
+        "text": "hi",
+    }}, context={"bot": bot})
+
+
+def test_sink_counts_the_backlog_once_per_interval(run):
+    counts = []
+
+    def query(conn, cursor, statement, *args):
+        if "count" in statement.lower():
+            counts.append(statement)
+
+    async def main():
+        async with AsyncSessionLocal() as session:
+            await session.execute(delete(QueuedUpdate))
+            await session.commit()
+        sink = UpdateSink(dp, bot, workers=2, max_pending=5, overflow="drop")
+        sink.refresh_interval = 3600
+        event.listen(engine.sync_engine, "before_cursor_execute", query)
+        try:
+            for i in range(8):
+                await sink.submit(update(i))
+                await sink.flush()
+        finally:
+            event.remove(engine.sync_engine, "before_cursor_execute", query)
+        return sink
+
+    sink = run(main())
+    assert len(counts) == 1
+    # Full once its own inserts reach the limit, without counting again
+    assert (sink.accepted, sink.dropped) == (5, 3)
@@ -0,0 +1,28 @@
+from app.bot.keywords import KeywordFilter
+
+
+def test_literal_words_match_after_normalization(run):
+    async def main():
+        keywords = KeywordFilter()
+        await keywords.load()
+        keywords.add([("WeChat", False)])
+        return keywords
+
+    keywords = run(main())
+    assert keywords.find("add me on ＷｅＣ​ｈａｔ") == "wechat"
+    assert keywords.find("nothing to see") is None
+
+
+def test_regex_words_match_whatever_case_and_form_they_are_written_in(run):
+    async def main():
+        keywords = KeywordFilter()
+        await keywords.load()
+        keywords.add([(r"Buy\s+NOW", True), (r"ﬁnance\d+", True)])
+        return keywords
+
+    keywords = run(main())
+    assert keywords.find("please buy   now") == r"Buy\s+NOW"
+    assert keywords.find("BUY NOW") == r"Buy\s+NOW"
+    # NFKC turns the ligature into "fi", the message as sent still has it
+    assert keywords.find("ﬁnance24 offers") == r"ﬁnance\d+"
+    assert keywords.find("finance24 offers") is None
@@ -0,0 +1,35 @@
+import asyncio
+import time
+
+from app.bot.loader import bot
+from app.bot.outbound import OutboundScheduler
+
+FLOODED, OTHER = 2001, 2002
+RETRY_AFTER = 1
+
+
+def test_a_429_pauses_its_chat_and_is_retried_once(run, telegram):
+    scheduler = OutboundScheduler(global_rate=100, chat_rate=100, chat_burst=5)
+    telegram.middleware(scheduler)
+    telegram.flood_chats = {FLOODED: 1}
+    telegram.retry_after = RETRY_AFTER
+
+    async def main():
+        flooded = asyncio.create_task(bot.send_message(FLOODED, "first"))
+        await asyncio.sleep(0.05)  # the 429 is in
+        # Queued behind the flood wait, not sent into it
+        later = asyncio.create_task(bot.send_message(FLOODED, "second"))
+        await asyncio.gather(*(bot.send_message(OTHER, f"other {i}") for i in range(5)))
+        other_done = time.monotonic()
+        await asyncio.gather(flooded, later)
+        return other_done
+
+    other_done = run(main())
+    ((_, flood_at),) = telegram.flood_calls
+    sent = {chat: [at for _, c, at in telegram.calls if c == chat] for chat in (FLOODED, OTHER)}
+    assert len(sent[FLOODED]) == 2
+    assert min(sent[FLOODED]) - flood_at >= RETRY_AFTER
+    # The other chat kept flowing during the pause
+    assert len(sent[OTHER]) == 5
+    assert other_done - flood_at < RETRY_AFTER / 2
+    assert (scheduler.retried, scheduler.sent, scheduler.failed) == (1, 7, 0)
@@ -0,0 +1,58 @@
+from sqlalchemy import func
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.future import select
+
+import app.database.route_writer as module
+from app.database.core import AsyncSessionLocal
+from app.database.models import MessageRoute
+from app.database.route_writer import RouteWriter
+
+
+async def stored(admin_message_ids) -> int:
+    async with AsyncSessionLocal() as session:
+        return await session.scalar(
+            select(func.count()).select_from(MessageRoute).where(MessageRoute.admin_message_id.in_(admin_message_ids))
+        )
+
+
+def test_a_bad_row_is_dropped_after_max_attempts(run):
+    async def main():
+        writer = RouteWriter(batch_size=10, flush_interval=1, max_attempts=2)
+        for admin_message_id in (8001, 8002, 8003):
+            writer.add(501, admin_message_id, 1)
+        writer.add({"not": "an id"}, 8004, 1)  # the database can't bind it
+        results = [await writer.flush() for _ in range(3)]
+        return writer, results, await stored([8001, 8002, 8003, 8004])
+
+    writer, results, count = run(main())
+    assert results == [False, False, True]
+    assert (writer.written, writer.dropped, writer.queued) == (3, 1, 0)
+    assert count == 3
+    assert writer.lookup(8001) is None  # answered by the database now
+
+
+def test_an_unavailable_database_keeps_the_routes_queued(run, monkeypatch):
+    class Down:
+        async def __aenter__(self):
+            return self
+
+        async def __aexit__(self, *exc):
+            return False
+
+        async def execute(self, *args):
+            raise OperationalError("INSERT", {}, Exception("database is locked"))
+
+    async def main():
+        writer = RouteWriter(batch_size=10, flush_interval=1, max_attempts=2)
+        writer.add(502, 8101, 1)
+        writer.add(502, 8102, 1)
+        monkeypatch.setattr(module, "AsyncSessionLocal", Down)
+        for _ in range(4):
+            assert not await writer.flush()
+        monkeypatch.setattr(module, "AsyncSessionLocal", AsyncSessionLocal)
+        assert await writer.flush()
+        return writer, await stored([8101, 8102])
+
+    writer, count = run(main())
+    assert (writer.written, writer.dropped, writer.queued) == (2, 0, 0)
+    assert count == 2
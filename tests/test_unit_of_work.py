@@ -0,0 +1,110 @@
+from contextlib import contextmanager
+
+import pytest
+from sqlalchemy import event
+from sqlalchemy.future import select
+
+import app.bot.handlers as handlers
+from app.bot.loader import bot, dp
+from app.bot.unit_of_work import UnitOfWork, on_commit
+from app.bot.outbox import Outbox
+from app.bot.rules import rule_engine
+from app.bot.keywords import keyword_filter
+from app.database.core import engine, AsyncSessionLocal
+from app.database.cache import evict_user
+from app.database.models import User, Setting
+
+MAX_QUERIES = 2
+
+
+@contextmanager
+def counting():
+    counts = {"queries": 0, "connections": 0}
+
+    def query(*args):
+        counts["queries"] += 1
+
+    def checkout(*args):
+        counts["connections"] += 1
+
+    event.listen(engine.sync_engine, "before_cursor_execute", query)
+    event.listen(engine.sync_engine, "checkout", checkout)
+    try:
+        yield counts
+    finally:
+        event.remove(engine.sync_engine, "before_cursor_execute", query)
+        event.remove(engine.sync_engine, "checkout", checkout)
+
+
+def test_text_update_uses_one_session_and_bounded_queries(run, telegram, updates, monkeypatch):
+    user_id = 7001
+    # The handlers' queue for this test only, nothing is left behind
+    outbox = Outbox(concurrency=1, max_attempts=1, backoff_base=1, backoff_max=1, keep=0)
+    monkeypatch.setattr(handlers, "outbox", outbox)
+
+    async def main():
+        async with AsyncSessionLocal() as session:
+            session.add(User(id=user_id, first_name="Sender", is_verified=True, is_banned=False, is_blocked=False))
+            await session.commit()
+        # Loaded at startup by the bot, not by the first message
+        await rule_engine.get()
+        await keyword_filter.load()
+        evict_user(user_id)
+
+        # Cold: the user is read from the database
+        with counting() as cold:
+            await dp.feed_update(bot, updates.text(user_id, "hello there"))
+        # Warm: everything comes from the caches
+        with counting() as warm:
+            await dp.feed_update(bot, updates.text(user_id, "hello again"))
+        return cold, warm
+
+    cold, warm = run(main())
+    assert outbox.queued == 2
+    assert cold["connections"] == 1
+    assert cold["queries"] <= MAX_QUERIES
+    assert warm == {"queries": 0, "connections": 0}
+
+
+async def setting(key: str) -> str | None:
+    async with AsyncSessionLocal() as session:
+        return await session.scalar(select(Setting.value).where(Setting.key == key))
+
+
+def test_on_commit_runs_after_the_commit(run):
+    uow = UnitOfWork()
+    seen = []
+
+    async def handler(event, data):
+        data["session"].add(Setting(key="test:commit", value="1"))
+        on_commit(data["session"], lambda: seen.append(uow.commits))
+        return "handled"
+
+    async def main():
+        result = await uow(handler, None, {})
+        return result, await setting("test:commit")
+
+    result, value = run(main())
+    assert result == "handled"
+    assert value == "1"
+    assert seen == [1]  # ran once, after the commit was counted
+
+
+def test_on_commit_is_dropped_on_rollback(run):
+    uow = UnitOfWork()
+    seen = []
+
+    async def handler(event, data):
+        data["session"].add(Setting(key="test:rollback", value="1"))
+        await data["session"].flush()
+        on_commit(data["session"], lambda: seen.append("ran"))
+        raise RuntimeError("handler failed")
+
+    async def main():
+        with pytest.raises(RuntimeError):
+            await uow(handler, None, {})
+        return await setting("test:rollback")
+
+    assert run(main()) is None
+    assert seen == []
+    assert uow.rollbacks == 1 and uow.commits == 0
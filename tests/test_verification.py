@@ -0,0 +1,121 @@
+import base64
+
+from app.bot.verification import ChallengePool, OPTIONS
+from app.database.cache import get_user, evict_user
+from app.database.models import User
+from app.database.user_writer import user_writer
+
+
+def buttons(challenge, correct: bool) -> list[str]:
+    return [b.callback_data for row in challenge.markup.inline_keyboard for b in row
+            if (b.text == challenge.target) == correct]
+
+
+def pool(key: bytes = b"test-key") -> ChallengePool:
+    return ChallengePool(key, size=16, ttl=600)
+
+
+USER = 1001
+
+
+def test_right_button_passes_and_wrong_one_fails():
+    p = pool()
+    challenge = p.challenge(USER)
+    assert all(p.check(data, USER) is True for data in buttons(challenge, True))
+    assert all(p.check(data, USER) is False for data in buttons(challenge, False))
+
+
+def test_callback_data_fits_telegram_limit():
+    p = pool()
+    data = p.callback_data(p.epoch(), p.size - 1, OPTIONS - 1, 2**63 - 1)
+    assert len(data.encode()) <= 64
+
+
+def test_forged_callback_is_rejected():
+    p = pool()
+    data = buttons(p.challenge(USER), False)[0]
+    _, epoch, slot, idx, sig = data.split(":")
+    other = base64.urlsafe_b64encode(bytes(12)).decode()
+    assert p.check(f"verify:{epoch}:{slot}:{idx}:{other}", USER) is None
+    # Another button's index under this button's signature
+    assert p.check(f"verify:{epoch}:{slot}:{(int(idx) + 1) % OPTIONS}:{sig}", USER) is None
+    # Signed with another key
+    assert p.check(pool(b"other-key").callback_data(int(epoch), int(slot), int(idx), USER), USER) is None
+
+
+def test_one_users_button_fails_for_another():
+    p = pool()
+    challenge = p.challenge(USER)
+    assert all(p.check(data, USER + 1) is None for data in buttons(challenge, True))
+    assert p.passed == 0
+
+
+def test_expired_and_future_callbacks_are_rejected():
+    p = pool()
+    epoch = p.epoch()
+    target = p._layouts(epoch - 1)[0]
+    idx = target.options.index(target.target)
+    # Still good in the next period
+    assert p.check(p.callback_data(epoch - 1, 0, idx, USER), USER) is True
+    assert p.check(p.callback_data(epoch - 2, 0, idx, USER), USER) is None
+    assert p.check(p.callback_data(epoch + 1, 0, idx, USER), USER) is None
+
+
+def test_malformed_and_out_of_range_callbacks_are_rejected():
+    p = pool()
+    epoch = p.epoch()
+    assert p.check("verify:🍎", USER) is None
+    assert p.check("verify:a:b:c:d", USER) is None
+    assert p.check(p.callback_data(epoch, p.size, 0, USER), USER) is None
+    assert p.check(p.callback_data(epoch, 0, OPTIONS, USER), USER) is None
+    assert p.stats()["rejected"] == 4
+
+
+def test_layouts_are_the_same_in_every_process():
+    a, b = pool(), pool()
+    epoch = a.epoch()
+    assert [c.options for c in a._layouts(epoch)] == [c.options for c in b._layouts(epoch)]
+    assert [c.options for c in a._layouts(epoch)] != [c.options for c in pool(b"other-key")._layouts(epoch)]
+
+
+def test_get_user_sees_queued_users_and_flags(run):
+    async def main():
+        user_writer.add(User(id=9001, username="new", first_name="New", is_verified=False))
+        evict_user(9001)
+        assert (await get_user(9001)).username == "new"
+
+        await user_writer.flush()
+        user_writer.verify(9001)
+        evict_user(9001)  # e.g. pushed out of the LRU in a join flood
+        assert (await get_user(9001)).is_verified
+
+        await user_writer.flush()
+        evict_user(9001)
+        assert (await get_user(9001)).is_verified
+
+    run(main())
+
+
+def test_get_user_does_not_cache_a_read_that_raced_a_write(run, monkeypatch):
+    import app.database.cache as cache
+
+    async def main():
+        user_writer.add(User(id=9002, first_name="Racer", is_verified=False))
+        await user_writer.flush()
+        evict_user(9002)
+
+        load = cache._load_user
+
+        async def racing_load(session, user_id):
+            user = await load(session, user_id)
+            # Verified and written while the read was in flight
+            user_writer.verify(user_id)
+            await user_writer.flush()
+            return user
+
+        monkeypatch.setattr(cache, "_load_user", racing_load)
+        await get_user(9002)
+        monkeypatch.setattr(cache, "_load_user", load)
+        assert (await get_user(9002)).is_verified
+
+    run(main())